@@ -0,0 +1,340 @@
+"""
+Benchmarks of the USB comms to the robot devices
+
+A result is a dict of the form:
+{'meta': {'ts': 1704110380.1, 'fleet_id': 'stretch-se3-3000', 'stretch_body': '0.7.31', 'sim': False,
+          'n': 1000, 'warmup': 50, 'devices': {'hello-pimu': {'firmware_version': 'Pimu.v0.7.0p6', ...}}},
+ 'latency': {'hello-pimu': {'push': {<stats>}, 'pull': {<stats>}, 'push_pull': {<stats>}}, ...},
+ 'concurrency': [{'threads': 2, 'devices': [...], 'aggregate_hz': 612.0, 'per_device': {'hello-pimu': {<stats>}},
+                  'errors': {'hello-wacc': '...'}}, ...],  # errors only if a device failed
+ 'payload': {'hello-motor-arm': {'push': {'64': {<stats>, 'bytes_per_s': ..}, ...}, 'pull': {'1024': {..}}}}}
+
+where <stats> is {'n', 'mean_ms', 'std_ms', 'min_ms', 'p50_ms', 'p95_ms', 'p99_ms', 'max_ms', 'rate_hz', 'hist': {'edges_ms', 'counts'}}
+"""
+
+import array as arr
+import contextlib
+import io
+import json
+import os
+import platform
+import threading
+import time
+import numpy as np
+import stretch_body.hello_utils as hu
+import stretch_factory.firmware_utils as fwu
+import stretch_factory.hardware_sim as hsim
+
+HELLO_DEVICES = ['hello-pimu', 'hello-wacc', 'hello-motor-arm', 'hello-motor-lift', 'hello-motor-left-wheel', 'hello-motor-right-wheel']
+DXL_CHAINS = ['head', 'end_of_arm']
+PAYLOAD_SIZES = [16, 64, 256, 512, 1024]
+HIST_EDGES_MS = [0.0] + list(np.round(np.logspace(-1, 3, 25), 3))  # 0.1ms to 1s, log spaced
+REGRESSION_METRICS = ['p50_ms', 'p95_ms', 'p99_ms']
+BARRIER_TIMEOUT_S = 60.0  # Longest wait for the other devices to finish warming up in bench_concurrency
+
+
+def compute_latency_stats(latency_s):
+    """
+    Summarize an array of per-call latencies (seconds)
+    """
+    x = np.asarray(latency_s, dtype=np.float64) * 1000.0
+    if len(x) == 0:
+        return {'n': 0}
+    p50, p95, p99 = np.percentile(x, [50, 95, 99])
+    counts, _ = np.histogram(np.clip(x, 0, HIST_EDGES_MS[-1]), bins=HIST_EDGES_MS)
+    return {'n': int(len(x)), 'mean_ms': float(x.mean()), 'std_ms': float(x.std()), 'min_ms': float(x.min()),
+            'p50_ms': float(p50), 'p95_ms': float(p95), 'p99_ms': float(p99), 'max_ms': float(x.max()),
+            'rate_hz': float(1000.0 / x.mean()) if x.mean() > 0 else None,
+            'hist': {'edges_ms': [float(e) for e in HIST_EDGES_MS], 'counts': [int(c) for c in counts]}}
+
+
+def time_calls(fn, n, warmup=0):
+    """
+    Call fn warmup times untimed, then n times timed. Returns the per-call latencies (s)
+    """
+    for i in range(warmup):
+        fn()
+    out = np.empty(n, dtype=np.float64)
+    for i in range(n):
+        ts = time.perf_counter()
+        fn()
+        out[i] = time.perf_counter() - ts
+    return out
+
+
+# ########################### Devices ##################################
+
+def make_device(name):
+    if name in DXL_CHAINS:
+        if hsim.enabled():
+            return hsim.SimDynamixelGroup(name, {'head': ['head_pan', 'head_tilt'], 'end_of_arm': ['wrist_yaw', 'stretch_gripper']}[name])
+        if name == 'head':
+            import stretch_body.head
+            return stretch_body.head.Head()
+        import stretch_body.end_of_arm
+        return stretch_body.end_of_arm.EndOfArm()
+    return fwu.make_device(name)
+
+
+def get_command(name, dev):
+    """
+    A no-op command that marks the device dirty so that push_command does an RPC
+    """
+    if name == 'hello-pimu':
+        return dev.set_fan_off
+    if name == 'hello-wacc':
+        return lambda: dev.set_D3(0)
+    if name.startswith('hello-motor'):
+        return dev.enable_pos_traj_incr
+    return None
+
+
+def open_devices(names):
+    devs = {}
+    for n in names:
+        d = make_device(n)
+        if d.startup(threaded=False):
+            devs[n] = d
+        else:
+            print('Unable to start %s. Skipping.' % n)
+    return devs
+
+
+def get_device_meta(name, dev):
+    info = getattr(dev, 'board_info', None)
+    if info is None:
+        return {}
+    return {k: info.get(k) for k in ['board_variant', 'firmware_version', 'protocol_version', 'hardware_id']}
+
+
+def get_meta(devs, **kwargs):
+    try:
+        import stretch_body.version
+        sb_version = stretch_body.version.__version__
+    except ImportError:
+        sb_version = None
+    try:
+        from importlib.metadata import version
+        sf_version = version('hello-robot-stretch-factory')
+    except Exception:
+        sf_version = None
+    meta = {'ts': time.time(), 'date': hu.create_time_string(), 'host': platform.node(), 'python': platform.python_version(),
+            'fleet_id': hu.get_fleet_id(), 'stretch_body': sb_version, 'stretch_factory': sf_version,
+            'sim': hsim.enabled(), 'devices': {n: get_device_meta(n, d) for n, d in devs.items()}}
+    if hsim.enabled():
+        c = hsim.get_config()
+        meta['sim_config'] = {k: c[k] for k in ['latency_s', 'jitter_s', 'loss', 'timeout_s', 'byte_time_s']}
+    meta.update(kwargs)
+    return meta
+
+
+# ########################### Benchmarks ##################################
+
+def bench_latency(name, dev, n=1000, warmup=50):
+    """
+    Round trip latency of a command push, a status pull, and a push followed by a pull
+    """
+    out = {'pull': compute_latency_stats(time_calls(dev.pull_status, n, warmup))}
+    cmd = get_command(name, dev)
+    if cmd is not None:
+        def push():
+            cmd()
+            dev.push_command()
+
+        def push_pull():
+            push()
+            dev.pull_status()
+
+        out['push'] = compute_latency_stats(time_calls(push, n, warmup))
+        out['push_pull'] = compute_latency_stats(time_calls(push_pull, n, warmup))
+    return out
+
+
+def bench_concurrency(devs, n=500, warmup=50, thread_counts=None, barrier_timeout_s=BARRIER_TIMEOUT_S):
+    """
+    Run push/pull on k devices at once, one thread per device, for each k in thread_counts.
+    Reports the aggregate rate and per-device latency under contention.
+    A device that fails is reported in 'errors' and left out of the aggregate rate.
+    """
+    names = sorted(devs.keys())
+    if thread_counts is None:
+        thread_counts = sorted(set([k for k in [1, 2, 4, len(names)] if k <= len(names)]))
+    results = []
+    for k in thread_counts:
+        use = names[:k]
+        lat = {}
+        errors = {}
+        barrier = threading.Barrier(k, timeout=barrier_timeout_s)
+
+        def worker(name):
+            dev = devs[name]
+            cmd = get_command(name, dev)
+
+            def push_pull():
+                if cmd is not None:
+                    cmd()
+                    dev.push_command()
+                dev.pull_status()
+
+            try:
+                for i in range(warmup):
+                    push_pull()
+            except Exception as e:
+                errors[name] = 'Warmup failed: %s' % str(e)
+            # A failed device still waits so that the others start their timed sections together
+            try:
+                barrier.wait()
+            except threading.BrokenBarrierError:
+                errors.setdefault(name, 'Timed out waiting for the other devices')
+            if name in errors:
+                return
+            try:
+                lat[name] = time_calls(push_pull, n)
+            except Exception as e:
+                errors[name] = str(e)
+
+        threads = [threading.Thread(target=worker, args=(d,)) for d in use]
+        ts = time.perf_counter()
+        for t in threads:
+            t.start()
+        for t in threads:
+            t.join()
+        dt = time.perf_counter() - ts
+        ok = [d for d in use if d in lat]
+        wall = max([lat[d].sum() for d in ok], default=0)  # The timed sections start together at the barrier
+        c = {'threads': k, 'devices': use, 'aggregate_hz': float(len(ok) * n / wall) if wall > 0 else None,
+             'elapsed_s': float(dt), 'per_device': {d: compute_latency_stats(lat[d]) for d in ok}}
+        if len(errors):
+            c['errors'] = errors
+        results.append(c)
+    return results
+
+
+def bench_payload(name, dev, sizes=None, n=200, warmup=20):
+    """
+    Push load tests sweeping the payload size, and pull load tests (fixed size, set by the firmware).
+    Returns None if the firmware does not support load tests.
+    """
+    sizes = PAYLOAD_SIZES if sizes is None else sizes
+    default = arr.array('B', range(256)) * 4
+    out = {'push': {}, 'pull': {}}
+    try:
+        for s in sizes:
+            dev.load_test_payload = arr.array('B', [i % 256 for i in range(s)])
+            st = compute_latency_stats(time_calls(dev.push_load_test, n, warmup))
+            st['bytes_per_s'] = s / (st['p50_ms'] / 1000.0) if st['p50_ms'] > 0 else None
+            out['push'][str(s)] = st
+        dev.load_test_payload = default
+        dev.push_load_test()
+        with contextlib.redirect_stdout(io.StringIO()):  # pull_load_test prints per call
+            st = compute_latency_stats(time_calls(dev.pull_load_test, n, warmup))
+        st['bytes_per_s'] = len(default) / (st['p50_ms'] / 1000.0) if st['p50_ms'] > 0 else None
+        out['pull'][str(len(default))] = st
+    except NotImplementedError:
+        return None
+    finally:
+        dev.load_test_payload = default
+    return out
+
+
+def run(names=None, n=1000, warmup=50, concurrency=True, payload=True, payload_sizes=None):
+    """
+    Run the benchmark suite over the named devices and return the result dict
+    """
+    names = HELLO_DEVICES if names is None else names
+    devs = open_devices(names)
+    result = {'meta': get_meta(devs, n=n, warmup=warmup), 'latency': {}, 'concurrency': [], 'payload': {}}
+    try:
+        for name, dev in devs.items():
+            print('Latency: %s' % name)
+            result['latency'][name] = bench_latency(name, dev, n, warmup)
+        hello = {k: v for k, v in devs.items() if k in HELLO_DEVICES}
+        if concurrency and len(hello) > 1:
+            print('Concurrency: %d devices' % len(hello))
+            result['concurrency'] = bench_concurrency(hello, max(1, n // 2), warmup)
+        if payload:
+            for name, dev in devs.items():
+                if name.startswith('hello-motor'):
+                    print('Payload: %s' % name)
+                    p = bench_payload(name, dev, payload_sizes, max(1, n // 5), max(1, warmup // 5))
+                    if p is not None:
+                        result['payload'][name] = p
+    finally:
+        for d in devs.values():
+            d.stop()
+    return result
+
+
+# ########################### Output ##################################
+
+def save_result(result, filename):
+    with open(filename, 'w') as fh:
+        json.dump(result, fh, indent=1)
+
+
+def load_result(filename):
+    with open(filename, 'r') as fh:
+        return json.load(fh)
+
+
+def get_default_dir():
+    d = hu.get_stretch_directory('log/comms_benchmark/')
+    os.makedirs(d, exist_ok=True)
+    return d
+
+
+def get_baseline_filename():
+    return os.path.join(get_default_dir(), 'baseline.json')
+
+
+def _flatten(result):
+    """
+    {(section, device, test): stats} for every latency stats dict in a result
+    """
+    out = {}
+    for d, tests in result.get('latency', {}).items():
+        for t, st in tests.items():
+            out[('latency', d, t)] = st
+    for c in result.get('concurrency', []):
+        for d, st in c['per_device'].items():
+            out[('concurrency_%d' % c['threads'], d, 'push_pull')] = st
+    for d, p in result.get('payload', {}).items():
+        for direction in p:
+            for size, st in p[direction].items():
+                out[('payload', d, '%s_%s' % (direction, size))] = st
+    return out
+
+
+def compare(result, baseline, tolerance_pct=20.0, floor_ms=0.1):
+    """
+    Compare latency percentiles against a baseline result. A metric regresses if it is more than
+    tolerance_pct slower and more than floor_ms slower (so sub-jitter changes are not flagged).
+    Returns a list of rows {'section','device','test','metric','baseline','current','change_pct','regression'}
+    """
+    cur = _flatten(result)
+    base = _flatten(baseline)
+    rows = []
+    for k in sorted(set(cur.keys()) & set(base.keys())):
+        for m in REGRESSION_METRICS:
+            b = base[k].get(m)
+            c = cur[k].get(m)
+            if b is None or c is None:
+                continue
+            change = 100.0 * (c - b) / b if b > 0 else 0.0
+            rows.append({'section': k[0], 'device': k[1], 'test': k[2], 'metric': m, 'baseline': b, 'current': c,
+                         'change_pct': change, 'regression': change > tolerance_pct and (c - b) > floor_ms})
+    return rows
+
+
+def format_histogram(stats, width=40):
+    """
+    Text rendering of a latency histogram, one line per non-empty bin
+    """
+    lines = []
+    counts = stats['hist']['counts']
+    edges = stats['hist']['edges_ms']
+    m = max(counts) if len(counts) else 0
+    for i, c in enumerate(counts):
+        if c:
+            lines.append('%8.2f-%-8.2f ms | %s %d' % (edges[i], edges[i + 1], '#' * max(1, int(width * c / m)), c))
+    return '\n'.join(lines)
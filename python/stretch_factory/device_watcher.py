@@ -0,0 +1,111 @@
+import ctypes
+import ctypes.util
+import os
+import select
+import struct
+import time
+
+# From <sys/inotify.h>
+IN_ATTRIB = 0x00000004
+IN_MOVED_FROM = 0x00000040
+IN_MOVED_TO = 0x00000080
+IN_CREATE = 0x00000100
+IN_DELETE = 0x00000200
+IN_Q_OVERFLOW = 0x00004000
+IN_EVENT_HEADER = struct.Struct('iIII')  # wd, mask, cookie, len
+
+_libc = None
+
+
+def _get_libc():
+    global _libc
+    if _libc is None:
+        _libc = ctypes.CDLL(ctypes.util.find_library('c') or 'libc.so.6', use_errno=True)
+    return _libc
+
+
+class DeviceWatcher():
+    """
+    Block until a condition on a /dev directory becomes true, waking on the inotify events of that
+    directory rather than polling it with a process per check. When inotify is not available
+    (eg, non-Linux or the directory can not be watched) it falls back to polling the condition.
+
+    Each wait uses its own inotify instance so waits may run concurrently from several threads.
+    """
+    poll_period_s = 0.05  # Used only by the polling fallback
+
+    def __init__(self, directory='/dev'):
+        self.directory = directory
+
+    def _open(self):
+        try:
+            libc = _get_libc()
+            fd = libc.inotify_init1(os.O_NONBLOCK | os.O_CLOEXEC)
+            if fd < 0:
+                return None
+            mask = IN_CREATE | IN_DELETE | IN_MOVED_TO | IN_MOVED_FROM | IN_ATTRIB
+            if libc.inotify_add_watch(fd, self.directory.encode('utf-8'), mask) < 0:
+                os.close(fd)
+                return None
+            return fd
+        except (OSError, AttributeError):
+            return None
+
+    def _drain(self, fd):
+        # Return the names from all queued events, or None if the kernel queue overflowed
+        names = []
+        while True:
+            try:
+                buf = os.read(fd, 4096)
+            except BlockingIOError:
+                return names
+            i = 0
+            while i + IN_EVENT_HEADER.size <= len(buf):
+                wd, mask, cookie, n = IN_EVENT_HEADER.unpack_from(buf, i)
+                i = i + IN_EVENT_HEADER.size
+                if mask & IN_Q_OVERFLOW:
+                    return None
+                names.append(buf[i:i + n].rstrip(b'\0').decode('utf-8', 'replace'))
+                i = i + n
+
+    def wait_for(self, condition, timeout, names=None):
+        """
+        Wait up to timeout seconds for condition() to return True.
+        condition is checked once up front and then each time an entry in the directory changes.
+        If names is given, only changes to those entries trigger a check.
+        Return True if the condition was met.
+        """
+        ts = time.time()
+        fd = self._open()
+        try:
+            if condition():  # Checked after the watch is in place so no event can be missed
+                return True
+            while True:
+                remaining = timeout - (time.time() - ts)
+                if remaining <= 0:
+                    return False
+                if fd is None:
+                    time.sleep(min(self.poll_period_s, remaining))
+                    if condition():
+                        return True
+                    continue
+                r, _, _ = select.select([fd], [], [], remaining)
+                if r:
+                    changed = self._drain(fd)
+                    if (changed is None or names is None or len(set(changed) & set(names))) and condition():
+                        return True
+        finally:
+            if fd is not None:
+                os.close(fd)
+
+    def wait_for_device(self, device_name, timeout=10.0, present=True):
+        """
+        Wait for /dev/<device_name> to appear (present=True) or disappear (present=False).
+        device_name may be given as 'hello-motor-arm' or '/dev/hello-motor-arm'
+        """
+        path = os.path.join(self.directory, os.path.basename(device_name))
+        return self.wait_for(lambda: os.path.exists(path) == present, timeout, names=[os.path.basename(path)])
+
+
+def wait_for_device(device_name, timeout=10.0, present=True):
+    return DeviceWatcher().wait_for_device(device_name, timeout, present)
@@ -1,58 +1,140 @@
+import bisect
 import click
 import os
-import git
 import sys
+import time
+import yaml
 from stretch_factory.firmware_version import FirmwareVersion
+from stretch_factory.firmware_mirror import FirmwareMirror, FirmwareMirrorError
+import stretch_factory.hardware_sim as hsim
+
+DEVICE_FAMILY = {'hello-motor-lift': 'Stepper', 'hello-motor-arm': 'Stepper', 'hello-motor-left-wheel': 'Stepper',
+                 'hello-motor-right-wheel': 'Stepper', 'hello-wacc': 'Wacc', 'hello-pimu': 'Pimu'}
+
+
+class FirmwareTagIndex():
+    """
+    Version tags of the firmware repo, sorted per device family (Stepper, Wacc, Pimu)
+
+    Persisted to tag_index.yaml in the mirror directory and rebuilt when the mirror has been fetched since:
+    {'last_fetch': 1700000000.0, 'families': {'Pimu': ['Pimu.v0.0.1p0', 'Pimu.v0.0.2p0', ...], ...}}
+    """
+    def __init__(self, mirror):
+        self.mirror = mirror
+        self.filename = os.path.join(mirror.mirror_dir, 'tag_index.yaml')
+        self.versions = {}  # Family: sorted list of FirmwareVersion
+        self.keys = {}  # Family: matching list of FirmwareVersion.get_key()
+        self.load()
+
+    def load(self):
+        families = None
+        last_fetch = self.mirror.get_last_fetch()
+        try:
+            with open(self.filename, 'r') as s:
+                index = yaml.safe_load(s) or {}
+            if index.get('last_fetch') == last_fetch:
+                families = index.get('families')
+        except (IOError, yaml.YAMLError):
+            pass
+        if families is None:
+            families = self.build()
+            try:
+                tmp_filename = self.filename + '.%d.tmp' % os.getpid()
+                with open(tmp_filename, 'w') as yaml_file:
+                    yaml.dump({'last_fetch': last_fetch, 'families': families}, yaml_file, default_flow_style=False)
+                os.replace(tmp_filename, self.filename)
+            except (IOError, OSError):
+                pass
+        for f in families:
+            self.versions[f] = [FirmwareVersion(t) for t in families[f]]
+            self.keys[f] = [v.get_key() for v in self.versions[f]]
+
+    def build(self):
+        families = {}
+        for t in self.mirror.get_tags():
+            v = FirmwareVersion(t)
+            if v.valid:
+                families.setdefault(v.device, []).append(v)
+        return {f: [v.to_string() for v in sorted(families[f], key=lambda x: x.get_key())] for f in families}
+
+    def get_versions(self, family):
+        return list(self.versions.get(family, []))
+
+    def get_latest(self, family, protocols=None):
+        """
+        Most recent version of the family with one of the protocols (ints). Any protocol if None
+        """
+        keys = self.keys.get(family, [])
+        if not len(keys):
+            return None
+        if protocols is None:
+            return self.versions[family][-1]
+        for p in sorted(set(protocols), reverse=True):
+            # Versions sort by protocol first, so the last one before protocol p+1 is the latest of p
+            idx = bisect.bisect_left(keys, (p + 1,)) - 1
+            if idx >= 0 and keys[idx][0] == p:
+                return self.versions[family][idx]
+        return None
+
+    def get_range(self, family, lo=None, hi=None):
+        """
+        Versions of the family with lo <= version <= hi (FirmwareVersion, either may be None)
+        """
+        keys = self.keys.get(family, [])
+        i = 0 if lo is None else bisect.bisect_left(keys, lo.get_key())
+        j = len(keys) if hi is None else bisect.bisect_right(keys, hi.get_key())
+        return self.versions.get(family, [])[i:j]
+
 
 class FirmwareAvailable():
     """
     Determine what firmware is available on GIT
     """
-    def __init__(self, use_device):
+    def __init__(self, use_device, offline=False, bundle=None, refresh_interval_h=None, force_refresh=False):
+        """
+        The firmware repo is read from a local FirmwareMirror. It's fetched from Github when older than
+        refresh_interval_h (or force_refresh). With offline it's only ever updated from bundle, a git bundle file.
+        """
         self.use_device = use_device #True/False dict for each device name
-        self.repo = None
         self.repo_path = None
         self.versions = {}
         for d in self.use_device:
             if self.use_device[d]:
                 self.versions[d] = []  # List of available versions for that device
-        self.__clone_firmware_repo()
+        url = hsim.get_firmware_repo() if hsim.enabled() else None
+        mirror_dir = os.path.join(hsim.get_sim_dir(), 'firmware_mirror') if hsim.enabled() else None
+        self.mirror = FirmwareMirror(mirror_dir=mirror_dir, url=url, refresh_interval_h=refresh_interval_h,
+                                     offline=offline, bundle=bundle)
+        self.__update_firmware_mirror(force_refresh)
         self.__get_available_firmware_versions()
 
-    def __clone_firmware_repo(self):
-        print('Collecting information...', end='')
-        self.repo_path = '/tmp/stretch_firmware_update'
-        if not os.path.isdir(self.repo_path):
-            # print('Cloning latest version of Stretch Firmware to %s'% self.repo_path)
-            try:
-                git.Repo.clone_from('https://github.com/hello-robot/stretch_firmware', self.repo_path)
-            except git.GitCommandError as e:
-                if "could not resolve host" in e.stderr.lower():
+    def __update_firmware_mirror(self, force_refresh):
+        print('Collecting information...')
+        try:
+            if self.mirror.update(force=force_refresh):
+                print('Updated firmware mirror %s' % self.mirror.path)
+        except FirmwareMirrorError as e:
+            if self.mirror.offline or not self.mirror.exists():
+                if "could not resolve host" in str(e).lower():
                     print("ERROR: Unable to connect to Github. Check internet connection?", file=sys.stderr)
                 else:
-                    print("ERROR: Unable to clone stretch_firmware from Github into /tmp/stretch_firmware_update.",
-                          file=sys.stderr)
+                    print("ERROR: Unable to create the stretch_firmware mirror at %s." % self.mirror.path, file=sys.stderr)
+                print(str(e), file=sys.stderr)
                 sys.exit(1)
+            # Fall back to the existing mirror when the network is down
+            click.secho('WARNING: Unable to refresh the firmware mirror. Using the copy from %s' %
+                        time.ctime(self.mirror.get_last_fetch() or 0), fg="yellow", bold=True)
+        self.repo_path = self.mirror.path
+        self.tag_index = FirmwareTagIndex(self.mirror)
 
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        self.repo = git.Repo(self.repo_path)
-        os.chdir(self.repo_path)
-
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        os.system('git checkout master >/dev/null 2>&1')
-
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        os.system('git fetch --tags >/dev/null 2>&1 ')
+    def get_source_path(self, ref):
+        """
+        Path of a checkout of a tag or branch (with an arduino/ directory of sketches)
+        """
+        return self.mirror.get_worktree(ref)
 
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        os.system('git pull >/dev/null 2>&1 ')
-        sys.stdout.write('.')
-        sys.stdout.flush()
-        print('\n')
+    def read_file(self, ref, path):
+        return self.mirror.read_file(ref, path)
 
     def pretty_print(self):
         click.secho(' Currently Tagged Versions of Stretch Firmware on Master Branch '.center(110, '#'), fg="cyan",
@@ -62,55 +144,22 @@ class FirmwareAvailable():
             for v in self.versions[device_name]:
                 print(v)
 
-    # python -m pip install gitpython
-    # https://www.devdungeon.com/content/working-git-repositories-python
     def __get_available_firmware_versions(self):
-        if self.repo is None:
-            return
-        for t in self.repo.tags:
-            v = FirmwareVersion(t.name)
-            if v.valid:
-                for device_name in self.versions:
-                    if (v.device == 'Stepper' and device_name in ['hello-motor-lift', 'hello-motor-arm',
-                                                                  'hello-motor-left-wheel',
-                                                                  'hello-motor-right-wheel']) or \
-                            (v.device == 'Wacc' and device_name == 'hello-wacc') or \
-                            (v.device == 'Pimu' and device_name == 'hello-pimu'):
-                        self.versions[device_name].append(v)
+        for device_name in self.versions:
+            self.versions[device_name] = self.tag_index.get_versions(DEVICE_FAMILY[device_name])
 
     def get_most_recent_version(self, device_name, supported_protocols):
         """
         For the device and supported protocol versions (eg, '['p0','p1']'), return the most recent version (type FirmwareVersion)
         """
-        if len(self.versions[device_name]) == 0:
-            return None
-        recent = None
-        if supported_protocols is not None:
-            s = [int(x[1:]) for x in supported_protocols]
-        else:
-            class Everything(object):
-                def __contains__(self, other):
-                    return True
-            s = Everything()
-        supported_versions = []
-        for v in self.versions[device_name]:
-            if v.protocol in s:
-                supported_versions.append(v)
-        for sv in supported_versions:
-            if recent is None or sv > recent:
-                recent = sv
-        return recent
+        protocols = None if supported_protocols is None else [int(x[1:]) for x in supported_protocols]
+        return self.tag_index.get_latest(DEVICE_FAMILY[device_name], protocols)
 
-    def get_remote_branches(self):
-        branches = []
-        print('Collecting information...')
-        for ref in self.repo.git.branch('-r').split('\n'):
-            sys.stdout.write('.')
-            sys.stdout.flush()
-            branches.append(ref)
-        print('\n')
-        branches = [b.strip(' ') for b in branches if b.find('HEAD') == -1]
-        branches.remove('origin/master')  # Move master to position 0
-        branches = ['origin/master'] + branches
-        return branches
+    def get_versions_in_range(self, device_name, lo=None, hi=None):
+        """
+        Available versions of the device with lo <= version <= hi (type FirmwareVersion, either may be None)
+        """
+        return self.tag_index.get_range(DEVICE_FAMILY[device_name], lo, hi)
 
+    def get_remote_branches(self):
+        return self.mirror.get_branches()
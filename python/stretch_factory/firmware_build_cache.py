@@ -0,0 +1,201 @@
+import click
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+import time
+import yaml
+from subprocess import Popen, PIPE, DEVNULL
+import stretch_body.hello_utils as hu
+import stretch_factory.firmware_utils as fwu
+
+
+class FirmwareBuildCache():
+    """
+    Content addressed cache of compiled firmware binaries, stored under stretch_user/firmware_build_cache
+
+    A binary is keyed on the sketch name, git tag and commit, arduino-cli version, a hash of the
+    arduino-cli config file and a digest of the sketch (and library) sources. This lets the identical
+    hello_stepper binary be compiled once and reused across devices, resumes and robots.
+
+    The index.yaml in the cache directory has the form:
+    {'entries': {<key>: {'sketch': 'hello_stepper', 'tag': 'Stepper.v0.6.0p4', 'commit': '1a2b3c...',
+                         'toolchain': '0.31.0', 'size': 58412, 'created': 1700000000.0, 'last_used': 1700000000.0}},
+     'stats': {'hits': 12, 'misses': 3}}
+    """
+    max_size_mb = 200  # Evict least recently used entries once the cache grows beyond this
+    max_age_days = 30  # Evict entries not used for this long
+
+    def __init__(self, cache_dir=None, max_size_mb=None, max_age_days=None):
+        self.cache_dir = cache_dir if cache_dir is not None else hu.get_stretch_directory('firmware_build_cache/')
+        if max_size_mb is not None:
+            self.max_size_mb = max_size_mb
+        if max_age_days is not None:
+            self.max_age_days = max_age_days
+        os.makedirs(self.cache_dir, exist_ok=True)
+        self.index_filename = os.path.join(self.cache_dir, 'index.yaml')
+        self.lock_filename = os.path.join(self.cache_dir, '.lock')
+        self.lock = threading.Lock()
+        self.stats = {'hits': 0, 'misses': 0}  # This session only
+        self.toolchain_version = None
+
+    # ########################### Keys ##################################
+
+    def make_key(self, sketch_name, tag, src_path, config_file):
+        """
+        Return the cache key (a hex digest) and a dict describing what went into it
+        """
+        if self.toolchain_version is None:
+            self.toolchain_version = fwu.get_arduino_cli_version() or 'None'
+        info = {'sketch': sketch_name,
+                'tag': str(tag),
+                'commit': self.get_commit(src_path),
+                'toolchain': self.toolchain_version,
+                'config': self.hash_file(config_file),
+                'source': self.hash_sources(src_path, sketch_name)}
+        h = hashlib.sha256()
+        for k in sorted(info.keys()):
+            h.update(('%s=%s\n' % (k, info[k])).encode('utf-8'))
+        return h.hexdigest(), info
+
+    def get_commit(self, src_path):
+        try:
+            out = Popen(['git', '-C', src_path, 'rev-parse', 'HEAD'], stdout=PIPE, stderr=DEVNULL).communicate()[0]
+            return out.decode('utf-8').strip() or 'None'
+        except OSError:
+            return 'None'
+
+    def hash_file(self, filename):
+        h = hashlib.sha256()
+        try:
+            with open(filename, 'rb') as f:
+                h.update(f.read())
+        except IOError:
+            return 'None'
+        return h.hexdigest()
+
+    def hash_sources(self, src_path, sketch_name):
+        # Covers uncommitted changes when flashing from --install_path or a dirty branch checkout
+        h = hashlib.sha256()
+        for d in [sketch_name, 'libraries']:
+            root_dir = os.path.join(src_path, 'arduino', d)
+            for root, dirs, files in os.walk(root_dir):
+                dirs[:] = sorted(x for x in dirs if x != 'build')
+                for fn in sorted(files):
+                    full_fn = os.path.join(root, fn)
+                    h.update(os.path.relpath(full_fn, src_path).encode('utf-8'))
+                    h.update(self.hash_file(full_fn).encode('utf-8'))
+        return h.hexdigest()
+
+    # ########################### Index ##################################
+
+    def _locked_index(self, fn):
+        # Serialize read-modify-write of the index between threads and processes
+        with self.lock:
+            with open(self.lock_filename, 'w') as lf:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+                try:
+                    index = self._read_index()
+                    ret = fn(index)
+                    self._write_index(index)
+                    return ret
+                finally:
+                    fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def _read_index(self):
+        try:
+            with open(self.index_filename, 'r') as s:
+                index = yaml.load(s, Loader=yaml.FullLoader)
+        except IOError:
+            index = None
+        if not index:
+            index = {}
+        index.setdefault('entries', {})
+        index.setdefault('stats', {'hits': 0, 'misses': 0})
+        return index
+
+    def _write_index(self, index):
+        tmp_filename = self.index_filename + '.tmp'
+        with open(tmp_filename, 'w') as yaml_file:
+            yaml.dump(index, yaml_file, default_flow_style=False)
+        os.replace(tmp_filename, self.index_filename)
+
+    def _entry_filename(self, key):
+        return os.path.join(self.cache_dir, key + '.bin')
+
+    # ########################### Access ##################################
+
+    def get(self, key):
+        """
+        Return the path to the cached binary for key, or None on a miss
+        """
+        def do_get(index):
+            e = index['entries'].get(key)
+            if e is not None and os.path.isfile(self._entry_filename(key)):
+                e['last_used'] = time.time()
+                index['stats']['hits'] += 1
+                self.stats['hits'] += 1
+                return self._entry_filename(key)
+            index['entries'].pop(key, None)
+            index['stats']['misses'] += 1
+            self.stats['misses'] += 1
+            return None
+        return self._locked_index(do_get)
+
+    def put(self, key, bin_filename, info):
+        """
+        Copy a freshly compiled binary into the cache and return its cached path
+        """
+        def do_put(index):
+            tmp_filename = self._entry_filename(key) + '.tmp'
+            shutil.copyfile(bin_filename, tmp_filename)
+            os.replace(tmp_filename, self._entry_filename(key))
+            e = {k: info[k] for k in ['sketch', 'tag', 'commit', 'toolchain']}
+            e['size'] = os.path.getsize(self._entry_filename(key))
+            e['created'] = time.time()
+            e['last_used'] = e['created']
+            index['entries'][key] = e
+            self._evict(index, keep=key)
+            return self._entry_filename(key)
+        return self._locked_index(do_put)
+
+    def _evict(self, index, keep=None):
+        now = time.time()
+        entries = index['entries']
+        for k in list(entries.keys()):
+            if k != keep and now - entries[k]['last_used'] > self.max_age_days * 24 * 3600:
+                self._remove(entries, k)
+        by_age = sorted(entries.keys(), key=lambda x: entries[x]['last_used'])
+        total = sum(entries[k]['size'] for k in entries)
+        for k in by_age:
+            if total <= self.max_size_mb * 1024 * 1024:
+                break
+            if k != keep:
+                total = total - entries[k]['size']
+                self._remove(entries, k)
+
+    def _remove(self, entries, key):
+        entries.pop(key, None)
+        try:
+            os.remove(self._entry_filename(key))
+        except OSError:
+            pass
+
+    def evict(self):
+        self._locked_index(lambda index: self._evict(index))
+
+    def clear(self):
+        def do_clear(index):
+            for k in list(index['entries'].keys()):
+                self._remove(index['entries'], k)
+        self._locked_index(do_clear)
+
+    def pretty_print_stats(self):
+        index = self._locked_index(lambda index: index)
+        size = sum(e['size'] for e in index['entries'].values())
+        click.secho('Firmware build cache: %s' % self.cache_dir, fg="cyan", bold=True)
+        print('This session: %d hits | %d misses' % (self.stats['hits'], self.stats['misses']))
+        print('All time:     %d hits | %d misses' % (index['stats']['hits'], index['stats']['misses']))
+        print('Entries:      %d | %.1f of %d MB' % (len(index['entries']), size / (1024.0 * 1024.0), self.max_size_mb))
+        print('')
@@ -1,11 +1,22 @@
 import click
+import os
+import threading
+import time
+import yaml
 import stretch_body.stepper
 import stretch_body.pimu
 import stretch_body.wacc
 import stretch_body.device
 import stretch_body.device
 import stretch_body.hello_utils
+from stretch_body.version import __version__ as stretch_body_version
 from stretch_factory.firmware_version import FirmwareVersion
+import stretch_factory.firmware_utils as fwu
+import stretch_factory.hardware_sim as hsim
+
+PROBE_TIMEOUT = 10.0
+# Board info of devices seen this session (cleared on reboot), keyed by fwu.get_enumeration_key
+CACHE_FILENAME = '/tmp/stretch_factory_firmware_installed.yaml'
 
 class FirmwareInstalled():
     """
@@ -18,7 +29,7 @@ class FirmwareInstalled():
       'supported_protocols': ['p0', 'p1']}}
     """
 
-    def __init__(self, use_device):
+    def __init__(self, use_device, timeout=PROBE_TIMEOUT, use_cache=False):
         """
         use_device has form of:
         {'hello-motor-lift': True, 'hello-motor-arm': True, 'hello-motor-right-wheel': True, 'hello-motor-left-wheel': True, 'hello-pimu': True, 'hello-wacc': True}
@@ -32,36 +43,105 @@ class FirmwareInstalled():
           'supported_protocols': ['p0', 'p1', 'p2'],
           'installed_protocol_valid': True,
           'version': 'Stepper.v0.3.0p2'},...}
+
+        Devices are probed concurrently. A device that doesn't reply within timeout seconds is left as None
+        (and listed in timed_out) so the others are still reported.
+        With use_cache, results are reused for the session while the device stays on the bus (see CACHE_FILENAME).
         """
         self.use_device = use_device
         self.config_info = {'hello-motor-lift': None, 'hello-motor-arm': None, 'hello-motor-left-wheel': None,
                             'hello-motor-right-wheel': None, 'hello-pimu': None, 'hello-wacc': None}
+        self.timed_out = []
         print('Collecting information...')
+        cache = self.load_cache() if use_cache else {}
+        keys = {}
+        threads = {}
+        results = {}
         for device in self.use_device.keys():
             if self.use_device[device]:
-                if device == 'hello-wacc':
-                    dd = stretch_body.wacc.Wacc()
-                elif device == 'hello-pimu':
-                    dd = stretch_body.pimu.Pimu()
-                else:
-                    dd = stretch_body.stepper.Stepper('/dev/' + device)
-                if not dd.startup():
-                    click.secho('Unable to communicate with device %s'%device,fg="red", bold=True)
-                else:
-                    if dd.board_info['firmware_version'] is not None:  # Was able to pull board info from device
-                        self.config_info[device] = {}
-                        self.config_info[device]['board_info'] = dd.board_info.copy()
-                        try:
-                            self.config_info[device]['supported_protocols'] = list(dd.supported_protocols.keys())
-                        except AttributeError:
-                            # Older versions of stretch body used a different represenation
-                            self.config_info[device]['supported_protocols'] = [dd.valid_firmware_protocol]
-                        self.config_info[device]['installed_protocol_valid'] = (
-                                    dd.board_info['protocol_version'] in self.config_info[device]['supported_protocols'])
-                        self.config_info[device]['version'] = FirmwareVersion(self.config_info[device]['board_info']['firmware_version'])
-                        dd.stop()
-                    else:
-                        self.config_info[device] = None
+                if use_cache:
+                    keys[device] = self.get_cache_key(device)
+                    if keys[device] in cache:
+                        self.config_info[device] = self.from_cache_entry(cache[keys[device]])
+                        continue
+                # Daemon threads so that a hung device can't block exit
+                threads[device] = threading.Thread(target=self.__probe_worker, args=(device, results), daemon=True)
+                threads[device].start()
+        deadline = time.time() + timeout
+        for device in threads:
+            threads[device].join(max(0.0, deadline - time.time()))
+            if threads[device].is_alive():
+                click.secho('Timed out communicating with device %s' % device, fg="red", bold=True)
+                self.timed_out.append(device)
+            else:
+                self.config_info[device] = results.get(device)
+        if use_cache:
+            for device in threads:
+                if keys[device] is not None and self.config_info[device] is not None:
+                    cache[keys[device]] = self.to_cache_entry(self.config_info[device])
+            self.save_cache(cache)
+
+    def __probe_worker(self, device, results):
+        try:
+            results[device] = self.probe_device(device)
+        except Exception as e:
+            click.secho('Error communicating with device %s: %s' % (device, str(e)), fg="red", bold=True)
+            results[device] = None
+
+    def probe_device(self, device):
+        dd = fwu.make_device(device)
+        if not fwu.identify_device(dd):
+            click.secho('Unable to communicate with device %s'%device,fg="red", bold=True)
+            return None
+        info = {}
+        info['board_info'] = dd.board_info.copy()
+        try:
+            info['supported_protocols'] = list(dd.supported_protocols.keys())
+        except AttributeError:
+            # Older versions of stretch body used a different represenation
+            info['supported_protocols'] = [dd.valid_firmware_protocol]
+        info['installed_protocol_valid'] = (dd.board_info['protocol_version'] in info['supported_protocols'])
+        info['version'] = FirmwareVersion(info['board_info']['firmware_version'])
+        return info
+
+    # ########################### Session cache ##################################
+
+    def get_cache_key(self, device):
+        key = fwu.get_enumeration_key(device)
+        if key is None:
+            return None
+        return key + ':' + str(stretch_body_version)  # Supported protocols depend on the installed Stretch Body
+
+    def to_cache_entry(self, info):
+        return {'board_info': info['board_info'], 'supported_protocols': info['supported_protocols'],
+                'installed_protocol_valid': info['installed_protocol_valid']}
+
+    def from_cache_entry(self, entry):
+        info = dict(entry)
+        info['version'] = FirmwareVersion(info['board_info']['firmware_version'])
+        return info
+
+    def get_cache_filename(self):
+        if hsim.enabled():
+            return os.path.join(hsim.get_sim_dir(), os.path.basename(CACHE_FILENAME))
+        return CACHE_FILENAME
+
+    def load_cache(self):
+        try:
+            with open(self.get_cache_filename(), 'r') as s:
+                return yaml.safe_load(s) or {}
+        except (IOError, yaml.YAMLError):
+            return {}
+
+    def save_cache(self, cache):
+        try:
+            fn = self.get_cache_filename()
+            tmp = fn + '.%d.tmp' % os.getpid()
+            with open(tmp, 'w') as s:
+                yaml.dump(cache, s)
+            os.replace(tmp, fn)
+        except (IOError, OSError):
+            pass
 
     def get_supported_protocols(self, device_name):
         if self.is_device_valid(device_name):
@@ -0,0 +1,233 @@
+import fcntl
+import hashlib
+import os
+import shutil
+import threading
+import time
+import yaml
+from subprocess import Popen, PIPE
+import stretch_body.hello_utils as hu
+import stretch_factory.hello_device_utils as hdu
+
+
+class FirmwareMirrorError(Exception):
+    pass
+
+
+class FirmwareMirror():
+    """
+    Persistent bare mirror of the stretch_firmware repo, stored under stretch_user/firmware_mirror
+
+    Each tag or branch commit that is built gets its own detached worktree, so several versions can be
+    checked out at once and a tag that was checked out before is available instantly. Worktrees are evicted like
+the build cache: those not used for max_age_days, then the least recently used beyond max_worktrees. The last use
+of a worktree is the mtime of its directory.
+    The mirror is only fetched once refresh_interval_h has passed since the last fetch. In offline mode
+    (implied by giving a bundle) it is never fetched from the network, and is created or updated from a git
+    bundle file instead:
+
+        git clone --mirror https://github.com/hello-robot/stretch_firmware && git -C stretch_firmware.git bundle create stretch_firmware.bundle --all
+
+    The layout of mirror_dir is:
+        stretch_firmware.git/     bare mirror
+        worktrees/<name>/         one worktree per tag (by name) or branch commit (by sha), mtime is its last use
+        arduino-cli/<hash>.yaml   arduino-cli config for each source tree (see get_arduino_config_file)
+        fetch.yaml                {'last_fetch': 1700000000.0, 'source': <url or bundle>}
+    """
+    url = 'https://github.com/hello-robot/stretch_firmware'
+    refresh_interval_h = 1.0  # Fetch at most this often unless forced
+    max_worktrees = 8  # Evict least recently used worktrees beyond this many
+    max_age_days = 30  # Evict worktrees not used for this long
+
+    def __init__(self, mirror_dir=None, url=None, refresh_interval_h=None, offline=False, bundle=None,
+                 max_worktrees=None, max_age_days=None):
+        self.mirror_dir = mirror_dir if mirror_dir is not None else hu.get_stretch_directory('firmware_mirror/')
+        if url is not None:
+            self.url = url
+        if refresh_interval_h is not None:
+            self.refresh_interval_h = refresh_interval_h
+        if max_worktrees is not None:
+            self.max_worktrees = max_worktrees
+        if max_age_days is not None:
+            self.max_age_days = max_age_days
+        self.bundle = os.path.abspath(bundle) if bundle else None
+        self.offline = offline or self.bundle is not None
+        self.path = os.path.join(self.mirror_dir, 'stretch_firmware.git')
+        self.worktree_dir = os.path.join(self.mirror_dir, 'worktrees')
+        self.fetch_filename = os.path.join(self.mirror_dir, 'fetch.yaml')
+        self.lock_filename = os.path.join(self.mirror_dir, '.lock')
+        self.lock = threading.Lock()
+        os.makedirs(self.mirror_dir, exist_ok=True)
+
+    # ########################### Git ##################################
+
+    def git(self, *args, cwd=None):
+        """
+        Run a git command in the mirror. Returns its stdout, raising FirmwareMirrorError on failure
+        """
+        cmd = ['git'] + list(args)
+        if cwd is None:
+            cmd = ['git', '--git-dir', self.path] + list(args)
+        p = Popen(cmd, cwd=cwd, stdout=PIPE, stderr=PIPE)
+        out, err = p.communicate()
+        if p.returncode != 0:
+            raise FirmwareMirrorError('%s: %s' % (' '.join(cmd), err.decode('utf-8', 'replace').strip()))
+        return out.decode('utf-8', 'replace')
+
+    def _locked(self, fn):
+        # Serialize changes to the mirror and worktrees between threads and processes
+        with self.lock:
+            with open(self.lock_filename, 'w') as lf:
+                fcntl.flock(lf, fcntl.LOCK_EX)
+                try:
+                    return fn()
+                finally:
+                    fcntl.flock(lf, fcntl.LOCK_UN)
+
+    # ########################### Refresh ##################################
+
+    def exists(self):
+        return os.path.isfile(os.path.join(self.path, 'HEAD'))
+
+    def get_last_fetch(self):
+        try:
+            with open(self.fetch_filename, 'r') as s:
+                return (yaml.safe_load(s) or {}).get('last_fetch')
+        except IOError:
+            return None
+
+    def is_stale(self):
+        last = self.get_last_fetch()
+        return last is None or time.time() - last > self.refresh_interval_h * 3600
+
+    def update(self, force=False):
+        """
+        Create the mirror if needed and refresh it when stale (or forced).
+        Online the source is url. Offline the source is the bundle, and without a bundle the existing mirror
+        is used as is. Returns True if the mirror was fetched, raising FirmwareMirrorError if it isn't usable.
+        """
+        def do_update():
+            if self.offline:
+                if self.bundle is None:
+                    if not self.exists():
+                        raise FirmwareMirrorError('No firmware mirror at %s. A bundle is required to work offline.' % self.path)
+                    return False
+                source = self.bundle
+            else:
+                source = self.url
+            if not self.exists():
+                tmp_path = self.path + '.tmp'
+                shutil.rmtree(tmp_path, ignore_errors=True)
+                self.git('clone', '--mirror', source, tmp_path, cwd=self.mirror_dir)
+                os.replace(tmp_path, self.path)
+            elif force or self.bundle is not None or self.is_stale():
+                self.git('fetch', '--prune', '--tags', source, '+refs/heads/*:refs/heads/*')
+            else:
+                return False
+            self.git('worktree', 'prune')
+            tmp_filename = self.fetch_filename + '.tmp'
+            with open(tmp_filename, 'w') as yaml_file:
+                yaml.dump({'last_fetch': time.time(), 'source': source}, yaml_file, default_flow_style=False)
+            os.replace(tmp_filename, self.fetch_filename)
+            return True
+        return self._locked(do_update)
+
+    # ########################### Refs ##################################
+
+    def get_tags(self):
+        return [t for t in self.git('for-each-ref', '--format=%(refname:short)', 'refs/tags').split('\n') if t]
+
+    def get_branches(self):
+        """
+        Branch names with master first
+        """
+        branches = [b for b in self.git('for-each-ref', '--format=%(refname:short)', 'refs/heads').split('\n') if b]
+        if 'master' in branches:
+            branches.remove('master')
+            branches = ['master'] + branches
+        return branches
+
+    def resolve(self, ref):
+        """
+        Commit sha of a tag, branch or sha. Also accepts the origin/<branch> form of older resume files
+        """
+        if ref.startswith('origin/'):
+            ref = ref[len('origin/'):]
+        return self.git('rev-parse', '--verify', '--quiet', ref + '^{commit}').strip()
+
+    def read_file(self, ref, path):
+        """
+        Contents of path at ref, without checking it out. None if it doesn't exist
+        """
+        try:
+            return self.git('show', '%s:%s' % (self.resolve(ref), path))
+        except FirmwareMirrorError:
+            return None
+
+    # ########################### Worktrees ##################################
+
+    def get_worktree(self, ref):
+        """
+        Return the path of a clean checkout of ref. Tags are checked out once and reused, branches by commit.
+        """
+        sha = self.resolve(ref)
+        name = ref if ref in self.get_tags() else sha
+        path = os.path.join(self.worktree_dir, name.replace('/', '_'))
+
+        def do_get():
+            if os.path.isfile(os.path.join(path, '.git')):
+                if self.git('rev-parse', 'HEAD', cwd=path).strip() == sha:
+                    os.utime(path)  # Last use
+                    return path
+                shutil.rmtree(path)  # Tag was moved upstream
+                self.git('worktree', 'prune')
+            elif os.path.isdir(path):
+                shutil.rmtree(path)
+            os.makedirs(self.worktree_dir, exist_ok=True)
+            self.git('worktree', 'add', '--detach', '--force', path, sha)
+            self._evict(keep=path)
+            return path
+        return self._locked(do_get)
+
+    def get_worktrees(self):
+        """
+        Paths of the worktrees, least recently used first
+        """
+        if not os.path.isdir(self.worktree_dir):
+            return []
+        paths = [os.path.join(self.worktree_dir, n) for n in os.listdir(self.worktree_dir)]
+        return sorted([p for p in paths if os.path.isdir(p)], key=os.path.getmtime)
+
+    def _evict(self, keep=None):
+        # Called with the mirror locked
+        paths = [p for p in self.get_worktrees() if p != keep]
+        now = time.time()
+        old = [p for p in paths if now - os.path.getmtime(p) > self.max_age_days * 24 * 3600]
+        rest = [p for p in paths if p not in old]
+        n_keep = self.max_worktrees - (1 if keep is not None else 0)
+        evicted = old + rest[:max(0, len(rest) - n_keep)]
+        for p in evicted:
+            shutil.rmtree(p, ignore_errors=True)
+        if evicted:
+            self.git('worktree', 'prune')
+        return evicted
+
+    def evict(self):
+        return self._locked(self._evict)
+
+    def get_arduino_config_file(self, src_path):
+        """
+        Write the arduino-cli config for a source tree with an arduino/ directory. Returns the config file.
+        """
+        src_path = os.path.abspath(src_path)
+        d = os.path.join(self.mirror_dir, 'arduino-cli')
+        os.makedirs(d, exist_ok=True)
+        filename = os.path.join(d, hashlib.sha1(src_path.encode('utf-8')).hexdigest()[:16] + '.yaml')
+        return hdu.create_arduinocli_config_file(src_path, filename)
+
+    def clear_worktrees(self):
+        def do_clear():
+            shutil.rmtree(self.worktree_dir, ignore_errors=True)
+            if self.exists():
+                self.git('worktree', 'prune')
+        self._locked(do_clear)
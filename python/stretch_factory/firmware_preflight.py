@@ -0,0 +1,128 @@
+import click
+import os
+import shutil
+from concurrent.futures import ThreadPoolExecutor
+import stretch_factory.firmware_utils as fwu
+
+
+class FirmwarePreflight():
+    """
+    Checks run for all targets of a FirmwareUpdater before any firmware is written, so that predictable
+    failures (missing calibration, toolchain, device off the bus, compile errors, full disk) are found up front.
+
+    Checks run concurrently. Compiling fills the updater's build cache, so flashing later reuses the binaries.
+    results is a list of {'check': 'compile', 'device': 'hello-motor-arm', 'ok': True, 'detail': 'Stepper.v0.6.2p5'}
+    where device is None for checks of the host.
+    """
+    min_free_mb = 200  # Needed in each of the mirror, build cache and /tmp directories
+
+    def __init__(self, updater):
+        self.updater = updater
+        self.results = []
+
+    def get_targets(self):
+        """
+        Devices that still have firmware to flash
+        """
+        u = self.updater
+        return [d for d in u.target if u.state['use_device'].get(d) and u.target[d] is not None and
+                not u.state['completed'][d]['flash']]
+
+    def add(self, check, device, ok, detail=''):
+        self.results.append({'check': check, 'device': device, 'ok': bool(ok), 'detail': detail})
+        return ok
+
+    # ########################### Checks ##################################
+
+    def check_toolchain(self):
+        version = fwu.get_arduino_cli_version()
+        self.add('arduino-cli', None, version == fwu.ARDUINO_CLI_VERSION,
+                 'Installed %s. Requires %s' % (version, fwu.ARDUINO_CLI_VERSION))
+        bossac = fwu.get_bossac(self.updater.home_dir)
+        self.add('bossac', None, fwu.is_bossac_installed(self.updater.home_dir), bossac)
+
+    def check_disk_space(self):
+        u = self.updater
+        dirs = {'mirror': u.fw_available.mirror.mirror_dir, 'tmp': os.path.dirname(u.resume_tmp_filename)}
+        if u.build_cache is not None:
+            dirs['build cache'] = u.build_cache.cache_dir
+        for name, d in dirs.items():
+            free_mb = shutil.disk_usage(d).free / (1024.0 * 1024.0)
+            self.add('disk space', None, free_mb >= self.min_free_mb, '%s: %.0f MB free at %s' % (name, free_mb, d))
+
+    def check_calibration(self, device_name):
+        if fwu.get_sketch_name(device_name) != 'hello_stepper':
+            return
+        ok = fwu.does_stepper_have_encoder_calibration_YAML(device_name)
+        self.add('calibration', device_name, ok, 'Encoder calibration YAML present' if ok else
+                 'Encoder calibration YAML missing. First run REx_stepper_calibration_flash_to_YAML.py %s' % device_name)
+
+    def check_port(self, device_name):
+        port = fwu.get_port_name(device_name) if fwu.is_device_present(device_name) else None
+        self.add('port', device_name, port is not None, '/dev/%s' % port if port else 'Device not on bus')
+        self.add('installed', device_name, self.updater.fw_installed.is_device_valid(device_name),
+                 str(self.updater.fw_installed.get_version(device_name)) if self.updater.fw_installed.is_device_valid(device_name)
+                 else 'Unable to read board info')
+
+    def get_builds(self, devices):
+        """
+        {(sketch_name, tag): [devices]} so that each distinct firmware is built once
+        """
+        builds = {}
+        for d in devices:
+            builds.setdefault((fwu.get_sketch_name(d), self.updater.target[d].to_string()), []).append(d)
+        return builds
+
+    def check_compile(self, sketch_name, tag, devices):
+        u = self.updater
+        detail = '%s %s' % (sketch_name, tag)
+        try:
+            compile_fail, fw_bin = u.compile_firmware(devices[0], tag, u.state['repo_path'], verbose=False)
+        except Exception as e:  # Eg, the tag or branch is missing from the mirror
+            compile_fail = True
+            detail = detail + ': ' + str(e)
+        for d in devices:
+            self.add('compile', d, not compile_fail, detail if not compile_fail else 'Failed to compile ' + detail)
+
+    # ########################### Run ##################################
+
+    def run(self, max_workers=8):
+        """
+        Run all checks. Return True if all passed
+        """
+        self.results = []
+        devices = self.get_targets()
+        tasks = [self.check_toolchain, self.check_disk_space]
+        for (sketch_name, tag), ds in self.get_builds(devices).items():
+            tasks.append(lambda s=sketch_name, t=tag, ds=ds: self.check_compile(s, t, ds))
+        for d in self.updater.target:
+            tasks.append(lambda d=d: self.check_calibration(d))
+        for d in devices:
+            tasks.append(lambda d=d: self.check_port(d))
+        with ThreadPoolExecutor(max_workers=max_workers) as executor:
+            for f in [executor.submit(t) for t in tasks]:
+                try:
+                    f.result()
+                except Exception as e:
+                    self.add('preflight', None, False, 'Exception: %s' % str(e))
+        order = ['arduino-cli', 'bossac', 'disk space', 'calibration', 'port', 'installed', 'compile', 'preflight']
+        self.results.sort(key=lambda r: (r['device'] or '', order.index(r['check'])))
+        return self.is_ok()
+
+    def is_ok(self):
+        return all(r['ok'] for r in self.results)
+
+    def get_failures(self):
+        return [r for r in self.results if not r['ok']]
+
+    def pretty_print(self):
+        click.secho(' PREFLIGHT CHECKS '.center(110, '#'), fg="cyan", bold=True)
+        for r in self.results:
+            click.secho('%s | %s | %s | %s' % ('PASS' if r['ok'] else 'FAIL', (r['device'] or 'host').upper().ljust(25),
+                                                r['check'].ljust(12), r['detail']), fg="green" if r['ok'] else "red")
+        nfail = len(self.get_failures())
+        if nfail:
+            click.secho('%d of %d preflight checks failed. No firmware was written.' % (nfail, len(self.results)), fg="red", bold=True)
+        else:
+            click.secho('All %d preflight checks passed' % len(self.results), fg="green", bold=True)
+        print('')
@@ -11,6 +11,9 @@ import yaml
 import time
 import sys
 import stretch_body.device
+import threading
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tabulate import tabulate
 
 import stretch_body.hello_utils
 import shlex
@@ -18,21 +21,71 @@ from stretch_factory.firmware_available import FirmwareAvailable
 from stretch_factory.firmware_recommended import FirmwareRecommended
 from stretch_factory.firmware_installed import FirmwareInstalled
 from stretch_factory.firmware_version import FirmwareVersion
+from stretch_factory.firmware_build_cache import FirmwareBuildCache
+from stretch_factory.firmware_preflight import FirmwarePreflight
+from stretch_factory.phase_timer import PhaseTimer
 import stretch_factory.firmware_utils as fwu
+import stretch_factory.hardware_sim as hsim
 
 import stretch_factory.hello_device_utils as hdu
 
 
+class ThreadOutputRouter():
+    """
+    Stand-in for sys.stdout that sends the output of registered threads to their own file.
+    Output from all other threads goes to the original stream.
+    """
+    def __init__(self, stream):
+        self.stream = stream
+        self.files = {}
+
+    def register(self, fh):
+        self.files[threading.get_ident()] = fh
+
+    def unregister(self):
+        self.files.pop(threading.get_ident(), None)
+
+    def write(self, s):
+        fh = self.files.get(threading.get_ident())
+        if fh is None:
+            return self.stream.write(s)
+        return fh.write(s)
+
+    def flush(self):
+        fh = self.files.get(threading.get_ident())
+        if fh is None:
+            return self.stream.flush()
+        return fh.flush()
+
+    def isatty(self):
+        return threading.get_ident() not in self.files and self.stream.isatty()
+
+    def __getattr__(self, name):
+        return getattr(self.stream, name)
+
 
 class FirmwareUpdater():
+    states = ['flash', 'return_to_bus', 'establish_comms', 'version_validate', 'calibration_flash', 'return_to_bus2']
+
     def __init__(self, use_device,args):
         #use_device = {'hello-motor-arm': True, 'hello-motor-right-wheel': True, 'hello-motor-left-wheel': True, 'hello-pimu': True, 'hello-wacc': True,'hello-motor-lift': True}
         self.ready_to_run = False
         self.resume_tmp_filename='/tmp/REx_firmware_updater_resume.yaml'
+        if hsim.enabled():
+            self.resume_tmp_filename = hsim.get_sim_dir() + '/REx_firmware_updater_resume.yaml'
+        if getattr(args, 'resume_file', None):
+            self.resume_tmp_filename = os.path.abspath(args.resume_file)
         self.args=args
         state_from_yaml = self.from_yaml()
         self.home_dir = os.path.expanduser('~')
-        self.stepper_type = None
+        self.stepper_type = {}
+        self.state_lock = threading.Lock() #Guards writes of the resume YAML
+        self.flash_lock = threading.RLock() #Serializes steps that share the bootloader node
+        self.compile_locks = {}
+        self.device_time = {}
+        self.device_log = {}
+        self.build_cache = None if getattr(args, 'no_build_cache', False) else FirmwareBuildCache()
+        self.timer = PhaseTimer()
 
         if args.resume:
             if not state_from_yaml:
@@ -77,9 +130,12 @@ class FirmwareUpdater():
                                                             'calibration_flash': False,
                                                             'return_to_bus2': False}
 
+        self.state['parallel'] = max(1, getattr(args, 'parallel', 1))
+        self.timer = PhaseTimer(self.state.setdefault('timing', []), self.state_lock) #Spans of this and any resumed runs
+
 
         #Check that all devices targeted can be updated
-        self.fw_installed = FirmwareInstalled(self.state['use_device'])
+        self.fw_installed = FirmwareInstalled(self.state['use_device'], use_cache=True)
         all_valid=True
         for d in self.state['use_device']:
             if self.state['use_device'][d] and not self.fw_installed.is_device_valid(d):
@@ -102,10 +158,12 @@ class FirmwareUpdater():
         #     self.ready_to_run=False
         #     return
 
-        self.fw_available = FirmwareAvailable(self.state['use_device'])
+        self.fw_available = FirmwareAvailable(self.state['use_device'], offline=getattr(args, 'offline', False),
+                                              bundle=getattr(args, 'bundle', None),
+                                              refresh_interval_h=getattr(args, 'refresh_interval', None),
+                                              force_refresh=getattr(args, 'refresh', False))
         self.fw_recommended = FirmwareRecommended(self.state['use_device'], self.fw_installed, self.fw_available)
 
-        self.create_arduino_config_file()
         self.ready_to_run = fwu.check_arduino_cli_install(self.state['no_prompts'])
 
         # Set the target version to flash to recommended for each device
@@ -161,8 +219,12 @@ class FirmwareUpdater():
         #At this point self.state dictionary has all information needed to run an update cycle
 
     def to_yaml(self):
-        with open(self.resume_tmp_filename, 'w') as yaml_file:
-         yaml.dump(self.state, yaml_file, default_flow_style=False)
+        # Write to a temp file and rename so that concurrent device updates never leave a partial file
+        with self.state_lock:
+            tmp_filename = self.resume_tmp_filename + '.tmp'
+            with open(tmp_filename, 'w') as yaml_file:
+                yaml.dump(self.state, yaml_file, default_flow_style=False)
+            os.replace(tmp_filename, self.resume_tmp_filename)
 
     def from_yaml(self):
         try:
@@ -216,126 +278,231 @@ class FirmwareUpdater():
 
         self.print_upload_warning()
 
-        #First check that all calibration present
-        for device_name in self.target:
-            sketch_name = fwu.get_sketch_name(device_name)
-            if sketch_name == 'hello_stepper' and not fwu.does_stepper_have_encoder_calibration_YAML(device_name):
-                print('Encoder data has not been stored for %s and should be stored first.' % device_name)
-                print('First run REx_stepper_calibration_flash_to_YAML.py '+device_name)
-                print('Aborting firmware flash.')
-                return False
+        #First check everything that can be checked before writing any firmware
+        print('Running preflight checks...')
+        preflight = FirmwarePreflight(self)
+        with self.timer.span('preflight') as span:
+            span['ok'] = preflight.run()
+        preflight.pretty_print()
+        if not preflight.is_ok():
+            print('Aborting firmware flash.')
+            return False
+        if getattr(self.args, 'preflight_only', False):
+            return True
 
         #self.pretty_print_state()
         #Advance the state machine
         if self.state['no_prompts'] or click.confirm('Proceed with update??'):
-            call('sudo echo', shell=True)
+            if not hsim.enabled():
+                call('sudo echo', shell=True)
             print('\n\n\n')
-            #Flash all devices
+            if self.state.get('parallel', 1) > 1:
+                success = self.run_parallel(self.state['parallel'])
+            else:
+                success = True
+                for d in self.target:
+                    ts = time.time()
+                    success = self.run_device(d)
+                    self.device_time[d] = time.time() - ts
+                    if not success:
+                        break
+            self.report_timing()
+            if not success:
+                return False
+
+            print('')
+            click.secho(' CONGRATULATIONS... '.center(110, '#'), fg="cyan", bold=True)
             for d in self.target:
-                click.secho(' %s  '.center(110, '#') % d.upper(), fg="yellow", bold=True)
-                click.secho(' %s |  COMPILE AND FLASH FIRMWARE... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
-                if not self.state['completed'][d]['flash']:
-                    if self.fw_installed.is_device_valid(d):
-                        nretry=3
-                        for i in range(nretry):
-                            compile_fail, upload_success=self.do_device_flash(d,self.target[d].to_string(),self.state['repo_path'],self.state['verbose'])
-                            self.state['completed'][d]['flash'] = not compile_fail and upload_success
-                            if self.state['completed'][d]['flash']:
-                                break
-                            if compile_fail:
-                                click.secho('WARNING: Firmware failed to compile. Fix source then try again', fg="red",bold=True)
-                                break
-                            if not upload_success: #Dont retry if compile failure
-                                #It may get here if the usb bus connectoin fails during flash
-                                #Attempt to reset the device and then try again
-
-                                click.secho('WARNING: Failed firmware flash for %s'%d, fg='red', bold=True)
-                                break
-                                # print('Retrying firmware flash for %s'%d)
-                                # port=fwu.get_port_name(d)
-                                # if port is not None:
-                                #     hdu.place_arduino_in_bootloader('/dev/'+port)
-                           
-                    else:
-                        click.secho('WARNING: Unable to flash %s as device not valid'%d, fg="yellow", bold=True)
-                        self.state['completed'][d]['flash'] =False
-
-                    if not self.state['completed'][d]['flash']:
-                        click.secho('WARNING: Device %s did not flash firmware successfully'%d, fg="red", bold=True)
-                        click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
-                        click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
-                        self.to_yaml()
-                        return False
+                click.secho('%s | No issues encountered. Firmware updated to %s.'%(d.upper().ljust(25),str(self.target[d])), fg="green", bold=True)
+            print('')
+            if self.build_cache is not None:
+                self.build_cache.pretty_print_stats()
+            self.delete_yaml()
+            return True
 
-                click.secho(' %s |   CHECK #1 IF DEVICE RETURNS TO BUS... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
-                if  not self.state['completed'][d]['return_to_bus']:
-                    self.state['completed'][d]['return_to_bus']=self.wait_on_return_to_bus(d)
+    def run_parallel(self, max_workers):
+        """
+        Run the per-device state machine for all targets concurrently, at most max_workers at a time.
+        Output of each device is written to its own log file. Steps that can not be attributed to a
+        single device on the bus (bootloader entry, bossac, usbreset) are serialized by flash_lock. Each version
+        is compiled in its own checkout, so compiles of different versions run concurrently.
+        """
+        log_dir = stretch_body.hello_utils.get_stretch_directory('log/')
+        time_string = stretch_body.hello_utils.create_time_string()
+        router = ThreadOutputRouter(sys.stdout)
+        results = {}
+
+        def worker(d):
+            log_fn = log_dir + 'firmware_update_%s_%s.log' % (d, time_string)
+            self.device_log[d] = log_fn
+            ts = time.time()
+            with open(log_fn, 'w') as fh:
+                router.register(fh)
+                try:
+                    return self.run_device(d)
+                except Exception as e:
+                    print('Exception during update of %s: %s' % (d, str(e)))
+                    self.to_yaml()
+                    return False
+                finally:
+                    router.unregister()
+                    self.device_time[d] = time.time() - ts
 
-                    if not self.state['completed'][d]['return_to_bus']:
-                        click.secho('WARNING: Device %s did not return to bus successfully'%d, fg="red", bold=True)
-                        click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
-                        click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
-                        self.to_yaml()
-                        return False
+        click.secho(' UPDATING %d DEVICES IN PARALLEL (MAX %d AT A TIME)... '.center(110, '#') % (len(self.target), max_workers), fg="cyan", bold=True)
+        sys.stdout = router
+        try:
+            with ThreadPoolExecutor(max_workers=max_workers) as executor:
+                futures = {executor.submit(worker, d): d for d in self.target}
+                for f in as_completed(futures):
+                    d = futures[f]
+                    results[d] = f.result()
+                    click.secho('%s | %s after %.1fs. Log: %s' % (d.upper().ljust(25), 'Done' if results[d] else 'FAILED',
+                                self.device_time[d], self.device_log[d]), fg="green" if results[d] else "red", bold=True)
+        finally:
+            sys.stdout = router.stream
+        self.pretty_print_summary()
+        success = all(results.values())
+        if not success:
+            click.secho('WARNING: Not all devices updated successfully', fg="red", bold=True)
+            click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
+            click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
+            self.to_yaml()
+        return success
+
+    def run_device(self, d):
+        """
+        Advance the update state machine for a single device.
+        Return True if all states completed. On failure the state is written to the resume YAML.
+        """
+        click.secho(' %s  '.center(110, '#') % d.upper(), fg="yellow", bold=True)
+        click.secho(' %s |  COMPILE AND FLASH FIRMWARE... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
+        if not self.state['completed'][d]['flash']:
+            with self.timer.span('flash', d) as span:
+                if self.fw_installed.is_device_valid(d):
+                    nretry=3
+                    for i in range(nretry):
+                        compile_fail, upload_success=self.do_device_flash(d,self.target[d].to_string(),self.state['repo_path'],self.state['verbose'])
+                        self.state['completed'][d]['flash'] = not compile_fail and upload_success
+                        if self.state['completed'][d]['flash']:
+                            break
+                        if compile_fail:
+                            click.secho('WARNING: Firmware failed to compile. Fix source then try again', fg="red",bold=True)
+                            break
+                        if not upload_success: #Dont retry if compile failure
+                            #It may get here if the usb bus connectoin fails during flash
+                            #Attempt to reset the device and then try again
 
-                time.sleep(3.0) #Give a chance for devices to become ready for comms
+                            click.secho('WARNING: Failed firmware flash for %s'%d, fg='red', bold=True)
+                            break
+                            # print('Retrying firmware flash for %s'%d)
+                            # port=fwu.get_port_name(d)
+                            # if port is not None:
+                            #     hdu.place_arduino_in_bootloader('/dev/'+port)
 
-                click.secho(' %s |   CHECK IF ESTABLISH COMMS... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
-                if not self.state['completed'][d]['establish_comms']:
-                    self.state['completed'][d]['establish_comms'] = self.verify_establish_comms(d)
+                else:
+                    click.secho('WARNING: Unable to flash %s as device not valid'%d, fg="yellow", bold=True)
+                    self.state['completed'][d]['flash'] =False
+                span['ok'] = self.state['completed'][d]['flash']
 
-                    if not self.state['completed'][d]['establish_comms']:
-                        click.secho('WARNING: Device %s did not establish comms successfully'%d, fg="red", bold=True)
-                        click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
-                        click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
-                        self.to_yaml()
-                        return False
+            if not self.state['completed'][d]['flash']:
+                click.secho('WARNING: Device %s did not flash firmware successfully'%d, fg="red", bold=True)
+                click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
+                click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
+                self.to_yaml()
+                return False
 
-                click.secho('%s |  CHECK FOR CORRECT VERSION UPDATE... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
-                if not self.state['completed'][d]['version_validate']:
-                    self.state['completed'][d]['version_validate'] = self.verify_firmware_version(d)
-                    if not self.state['completed'][d]['version_validate']: #If failed, force to try upload again
-                        self.state['completed'][d]['flash']=False
-                        self.state['completed'][d]['return_to_bus']=False
-                        self.state['completed'][d]['establish_comms'] = False
-                        click.secho('WARNING: Device %s has not updated to target firmware version'%d, fg="red", bold=True)
-                        click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
-                        click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
-                        self.to_yaml()
-                        return False
+        click.secho(' %s |   CHECK #1 IF DEVICE RETURNS TO BUS... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
+        if  not self.state['completed'][d]['return_to_bus']:
+            with self.timer.span('return_to_bus', d) as span:
+                self.state['completed'][d]['return_to_bus']=span['ok']=self.wait_on_return_to_bus(d)
 
-                click.secho('%s |  RESTORING CALIBRATION DATA... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
-                if not self.state['completed'][d]['calibration_flash']:
-                    self.state['completed'][d]['calibration_flash'] = self.flash_stepper_calibration(d)
+            if not self.state['completed'][d]['return_to_bus']:
+                click.secho('WARNING: Device %s did not return to bus successfully'%d, fg="red", bold=True)
+                click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
+                click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
+                self.to_yaml()
+                return False
 
-                if not self.state['completed'][d]['calibration_flash']:
-                    click.secho('WARNING: Device %s failed on encoder calibration flash'%d, fg="red", bold=True)
-                    click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
-                    click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
-                    self.to_yaml()
-                    return False
+        self.timer.sleep(3.0, d, 'ready for comms') #Give a chance for devices to become ready for comms
 
-                click.secho('%s |  CHECK #2 IF RETURNED TO BUS... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
-                if  not self.state['completed'][d]['return_to_bus2']:
-                    self.state['completed'][d]['return_to_bus2']=self.wait_on_return_to_bus(d)
+        click.secho(' %s |   CHECK IF ESTABLISH COMMS... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
+        if not self.state['completed'][d]['establish_comms']:
+            with self.timer.span('establish_comms', d) as span:
+                self.state['completed'][d]['establish_comms'] = span['ok'] = self.verify_establish_comms(d)
 
-                if not self.state['completed'][d]['return_to_bus2']:
-                    click.secho('WARNING: Device %s did not return to bus successfully'%d, fg="red", bold=True)
-                    click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
-                    click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
-                    self.to_yaml()
-                    return False
-                print('\n\n\n')
+            if not self.state['completed'][d]['establish_comms']:
+                click.secho('WARNING: Device %s did not establish comms successfully'%d, fg="red", bold=True)
+                click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
+                click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
+                self.to_yaml()
+                return False
 
-            print('')
-            click.secho(' CONGRATULATIONS... '.center(110, '#'), fg="cyan", bold=True)
-            for d in self.target:
-                click.secho('%s | No issues encountered. Firmware updated to %s.'%(d.upper().ljust(25),str(self.target[d])), fg="green", bold=True)
-            self.delete_yaml()
-            return True
+        click.secho('%s |  CHECK FOR CORRECT VERSION UPDATE... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
+        if not self.state['completed'][d]['version_validate']:
+            with self.timer.span('version_validate', d) as span:
+                self.state['completed'][d]['version_validate'] = span['ok'] = self.verify_firmware_version(d)
+            if not self.state['completed'][d]['version_validate']: #If failed, force to try upload again
+                self.state['completed'][d]['flash']=False
+                self.state['completed'][d]['return_to_bus']=False
+                self.state['completed'][d]['establish_comms'] = False
+                click.secho('WARNING: Device %s has not updated to target firmware version'%d, fg="red", bold=True)
+                click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
+                click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
+                self.to_yaml()
+                return False
+
+        click.secho('%s |  RESTORING CALIBRATION DATA... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
+        if not self.state['completed'][d]['calibration_flash']:
+            with self.timer.span('calibration_flash', d) as span:
+                self.state['completed'][d]['calibration_flash'] = span['ok'] = self.flash_stepper_calibration(d)
+
+        if not self.state['completed'][d]['calibration_flash']:
+            click.secho('WARNING: Device %s failed on encoder calibration flash'%d, fg="red", bold=True)
+            click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
+            click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
+            self.to_yaml()
+            return False
+
+        click.secho('%s |  CHECK #2 IF RETURNED TO BUS... '.center(110, '#')%d.upper(), fg="cyan", bold=True)
+        if  not self.state['completed'][d]['return_to_bus2']:
+            with self.timer.span('return_to_bus2', d) as span:
+                self.state['completed'][d]['return_to_bus2']=span['ok']=self.wait_on_return_to_bus(d)
+
+        if not self.state['completed'][d]['return_to_bus2']:
+            click.secho('WARNING: Device %s did not return to bus successfully'%d, fg="red", bold=True)
+            click.secho('WARNING: Power cycle robot.', fg="red", bold=True)
+            click.secho('WARNING: Then run: REx_firmware_updater.py --resume', fg="red", bold=True)
+            self.to_yaml()
+            return False
+        print('\n\n\n')
+        return True
+
+    def pretty_print_summary(self):
+        click.secho(' UPDATE SUMMARY '.center(110, '#'), fg="cyan", bold=True)
+        states = self.states
+        rows = []
+        for d in self.target:
+            completed = self.state['completed'][d]
+            boot = self.state.get('bootloader', {}).get(d)
+            rows.append([d, str(self.target[d])] + ['Y' if completed[s] else 'N' for s in states] +
+                        ['%d' % len(boot['attempts']) if boot else '-',
+                         '%.1f' % self.device_time[d] if d in self.device_time else '-', self.device_log.get(d, '-')])
+        print(tabulate(rows, headers=['DEVICE', 'TARGET'] + [s.upper() for s in states] + ['BOOTLOADER TRIES', 'TIME (S)', 'LOG']))
+        print('')
 
     # ########################################################################################################3
 
+    def report_timing(self):
+        """
+        Print where the time of the update went and write the spans to --timing if given
+        """
+        click.secho(' UPDATE TIMING (S) '.center(110, '#'), fg="cyan", bold=True)
+        self.timer.pretty_print(self.states + ['sleep'], list(self.target))
+        filename = getattr(self.args, 'timing', None)
+        if filename:
+            self.timer.save(filename, getattr(self.args, 'timing_format', 'chrome'))
+            print('Wrote timing to %s' % filename)
+
     def all_completed(self,state_name):
         all_completed=True
         for d in self.target:
@@ -344,18 +511,16 @@ class FirmwareUpdater():
     
     def extract_stepper_type(self, device_name):
                 if 'hello-motor' in device_name:
-                    st = stretch_body.stepper.Stepper('/dev/' + device_name)
+                    st = fwu.make_device(device_name)
                     for i in st.supported_protocols.keys():
                         recent_protocol = i.strip('p')
                     if int(recent_protocol) >= 5:
-                        if not st.startup():
+                        if not fwu.identify_device(st):
                             click.secho('FAIL: Unable to establish comms with device %s' % device_name.upper(), fg="red")
                             return False
                         else:
                             if int(st.board_info['protocol_version'].strip('p')) >= 5:
-                                self.stepper_type = st.board_info['stepper_type']
-                                time.sleep(0.5)
-                            st.stop()
+                                self.stepper_type[device_name] = st.board_info['stepper_type']
                             del st
 
 # ########################################################################################################################
@@ -363,10 +528,70 @@ class FirmwareUpdater():
         """
         Return compile_fail, upload_success
         """
-        
-        config_file = self.fw_available.repo_path + '/arduino-cli.yaml'
+        return self.__do_device_flash(device_name, tag, repo_path, verbose, port_name)
+
+    def get_compile_lock(self, src_path, sketch_name):
+        # Compiles of the same sketch in the same source tree share a build directory
+        with self.state_lock:
+            return self.compile_locks.setdefault((src_path, sketch_name), threading.Lock())
+
+    def get_source_path(self, tag, repo_path=None):
+        """
+        Source tree to build tag from: repo_path if given, else a checkout of the branch head for
+        --install_branch or of the version's tag
+        """
+        if repo_path is not None:
+            return repo_path
+        ref = self.state['install_branch'] if isinstance(self.state.get('install_branch'), str) else tag
+        return self.fw_available.get_source_path(ref)
+
+    def compile_firmware(self, device_name, tag, repo_path=None, verbose=False):
+        """
+        Compile (or fetch from the build cache) the firmware for a device.
+        Return compile_fail, path of the binary
+        """
+        sketch_name = fwu.get_sketch_name(device_name)
+        src_path = self.get_source_path(tag, repo_path)
+        fwu.user_msg_log('Source: %s' % src_path, user_display=verbose)
+        with self.get_compile_lock(src_path, sketch_name):
+            config_file = self.fw_available.mirror.get_arduino_config_file(src_path)
+            fwu.user_msg_log('Config: ' + str(config_file), user_display=verbose)
+            fw_bin = src_path + fwu.get_sketch_binary_path(sketch_name)
+            cache_key = None
+            cached_bin = None
+            if self.build_cache is not None:
+                cache_key, cache_info = self.build_cache.make_key(sketch_name, tag, src_path, config_file)
+                cached_bin = self.build_cache.get(cache_key)
+                if cached_bin is not None:
+                    print('Using cached firmware build of %s for %s' % (sketch_name, tag))
+                    fwu.user_msg_log('Cached binary: %s' % cached_bin, user_display=verbose)
+                    fw_bin = cached_bin
+
+            if cached_bin is None:
+                compile_command = '%s compile --config-file %s --fqbn hello-robot:samd:%s %s/arduino/%s --export-binaries' % (
+                fwu.get_arduino_cli(), config_file, sketch_name, src_path, sketch_name)
+                fwu.user_msg_log(compile_command, user_display=verbose)
+                c = Popen(shlex.split(compile_command), shell=False, bufsize=64, stdin=PIPE, stdout=PIPE,
+                          close_fds=True).stdout.read().strip()
+                if type(c) == bytes:
+                    c = c.decode("utf-8")
+                cc = c.split('\n')
+                fwu.user_msg_log(c, user_display=verbose)
+
+                # In version 0.18.x the last line after compile is: Sketch uses xxx bytes (58%) of program storage space. Maximum is yyy bytes.
+                # In version 0.24.x +this is now on line 0.
+                # Need a more robust way to determine successful compile. Works for now.
+                success = (str(cc[0]).find('Sketch uses') != -1)
+                if not success:
+                    print('Firmware failed to compile %s at %s' % (sketch_name, src_path))
+                    return True, None
+                else:
+                    print('Success in firmware compile')
+                if cache_key is not None:
+                    fw_bin = self.build_cache.put(cache_key, fw_bin, cache_info)
+        return False, fw_bin
 
-        fwu.user_msg_log('Config: ' + str(config_file), user_display=verbose)
+    def __do_device_flash(self, device_name, tag, repo_path=None, verbose=False, port_name=None):
         fwu.user_msg_log('Repo: ' + str(repo_path), user_display=verbose)
 
         sketch_name=fwu.get_sketch_name(device_name)
@@ -379,40 +604,17 @@ class FirmwareUpdater():
             port_name = fwu.get_port_name(device_name)
 
         
-        self.extract_stepper_type(device_name)
+        with self.timer.span('stepper_type', device_name):
+            self.extract_stepper_type(device_name)
         fwu.user_msg_log('Device: %s Port: %s' % (device_name, port_name), user_display=verbose)
 
         if port_name is not None and sketch_name is not None:
             print('Starting programming. This will take about 5s...')
-            if repo_path is None:
-                os.chdir(self.fw_available.repo_path)
-                cmd='git checkout ' + tag + '>/dev/null 2>&1'
-                os.system(cmd)
-                if verbose:
-                    print('Ran: %s from %s'%(cmd,self.fw_available.repo_path))
-                src_path = self.fw_available.repo_path
-            else:
-                src_path = repo_path
-
-            compile_command = 'arduino-cli compile --config-file %s --fqbn hello-robot:samd:%s %s/arduino/%s --export-binaries' % (
-            config_file, sketch_name, src_path, sketch_name)
-            fwu.user_msg_log(compile_command, user_display=verbose)
-            c = Popen(shlex.split(compile_command), shell=False, bufsize=64, stdin=PIPE, stdout=PIPE,
-                      close_fds=True).stdout.read().strip()
-            if type(c) == bytes:
-                c = c.decode("utf-8")
-            cc = c.split('\n')
-            fwu.user_msg_log(c, user_display=verbose)
-
-            # In version 0.18.x the last line after compile is: Sketch uses xxx bytes (58%) of program storage space. Maximum is yyy bytes.
-            # In version 0.24.x +this is now on line 0.
-            # Need a more robust way to determine successful compile. Works for now.
-            success = (str(cc[0]).find('Sketch uses') != -1)
-            if not success:
-                print('Firmware failed to compile %s at %s' % (sketch_name, src_path))
+            with self.timer.span('compile', device_name) as span:
+                compile_fail, fw_bin = self.compile_firmware(device_name, tag, repo_path, verbose)
+                span['ok'] = not compile_fail
+            if compile_fail:
                 return True, False
-            else:
-                print('Success in firmware compile')
 
         #     upload_command = 'arduino-cli upload  --config-file %s -p /dev/%s --fqbn hello-robot:samd:%s %s/arduino/%s' % (
         #     config_file, port_name, sketch_name, src_path, sketch_name)
@@ -447,59 +649,41 @@ class FirmwareUpdater():
         #     print('Firmware update %s. Failed to find device %s' % (tag, device_name))
         #     return False, False
 
-        ############## bug fix experimental code ################################################
-        flash_port_name = None
-        if device_name == 'hello-pimu':
-                fw_file = '/arduino/hello_pimu/build/hello-robot.samd.hello_pimu/hello_pimu.ino.bin'
-
-        if 'hello-motor' in device_name:
-            fw_file = '/arduino/hello_stepper/build/hello-robot.samd.hello_stepper/hello_stepper.ino.bin'
-
-        if device_name == 'hello-wacc':
-            fw_file = '/arduino/hello_wacc/build/hello-robot.samd.hello_wacc/hello_wacc.ino.bin'
-
-        
-        flash_sts = False, False
-        found_arduino_zero = False
-        while True:
-            try:
-                print(f"#### Trying To place {device_name} in bootloader mode #######")
-                test_port = hdu.serial.Serial('/dev/'+port_name, baudrate=1200)
-                test_port.__del__()
-                time.sleep(2)
-
-                bootloader_device = hdu.find_tty_devices()
-                for k in bootloader_device.keys():
-                    if bootloader_device[k]['model'] == 'Arduino_Zero':
-                        flash_port_name = k
-                        found_arduino_zero = True
-                        break
-
-                if found_arduino_zero:
-                    click.secho(f'Success {device_name} is in bootloader mode on {flash_port_name}, Now Flashing!', fg="green", bold=True)
-                    time.sleep(1)
-                    flash_command = self.home_dir+'/.arduino15/packages/arduino/tools/bossac/1.7.0/bossac -i -d --port='+flash_port_name+ ' -U true -i -e -w -v '+src_path + fw_file+' -R' 
+        # The bootloader can only be found by its 'Arduino_Zero' model name, so only one device may be in it at a time
+        with self.timer.span('wait_flash_lock', device_name):
+            self.flash_lock.acquire()
+        try:
+            print(f"#### Trying To place {device_name} in bootloader mode #######")
+            with self.timer.span('bootloader', device_name) as span:
+                outcome = fwu.enter_bootloader(port_name)
+                span['ok'] = outcome['success']
+            self.set_bootloader_outcome(device_name, outcome)
+            if not outcome['success']:
+                click.secho('%s failed to enter bootloader mode after %d attempts (%.1fs)' % (device_name,
+                            len(outcome['attempts']), outcome['elapsed_s']), fg="red", bold=True)
+                return False, False
+            flash_port_name = outcome['port']
+            click.secho(f'Success {device_name} is in bootloader mode on {flash_port_name}, Now Flashing!', fg="green", bold=True)
+            self.timer.sleep(1, device_name, 'before bossac')
+            flash_command = fwu.get_bossac(self.home_dir)+' -i -d --port='+flash_port_name+ ' -U true -i -e -w -v '+fw_bin+' -R'
+            with self.timer.span('bossac', device_name) as span:
+                result = call(flash_command, shell=True, stdout=DEVNULL)
+                span['ok'] = result == 0
+            if result != 0:
+                click.secho(f'Flashing {device_name} FAILED', fg="red", bold=True)
+                return False, False
+            click.secho(f'Success Flashing {device_name}', fg="green", bold=True)
+            self.timer.sleep(1, device_name, 'after bossac')
+            return False, True
+        finally:
+            self.flash_lock.release()
 
-                    result = call(flash_command, shell=True, stdout=DEVNULL)
-                    if result == 0:
-                        click.secho(f'Success Flashing {device_name}', fg="green", bold=True)
-                        time.sleep(1)
-                        flash_sts = False, True
-                        break
-                    else:
-                        click.secho(f'Flashing {device_name} FAILED', fg="red", bold=True)
-                        break
-                else:
-                    click.secho(f'{device_name} not in bootloader mode, retrying!', fg="yellow", bold=True)
-                    time.sleep(1)
-                    test_port = hdu.serial.Serial('/dev/'+port_name, baudrate=2000000)
-                    time.sleep(1)
-                    test_port.__del__()
-                    time.sleep(1) 
-            except TypeError:
-                continue
-        return flash_sts
-        ############## bug fix experimental code ################################################
+    def set_bootloader_outcome(self, device_name, outcome):
+        """
+        Record the outcome of bootloader entry in the resume state so a failure can be diagnosed on --resume
+        """
+        with self.state_lock:
+            self.state.setdefault('bootloader', {})[device_name] = outcome
 
 # ########################################################################################################3
     def wait_on_return_to_bus(self,device_name):
@@ -515,10 +699,10 @@ class FirmwareUpdater():
                 # Doesn't fully present on the USB bus with a serial No for Udev to find
                 # In does present as an 'Arduino Zero' product. This will attempt to reset it
                 # and re-present to the bus
-                time.sleep(1.0)
+                self.timer.sleep(1.0, device_name, 'before usb reset')
                 click.secho(f'Resetting usb of {device_name} please wait a few seconds', fg="yellow", bold = False)
-                call('sudo usbreset \"Arduino Zero\"', shell=True, stdout=DEVNULL)
-                time.sleep(2.0)
+                with self.flash_lock: #Don't reset a device that is in its bootloader being flashed
+                    fwu.usb_reset('Arduino Zero')
             else:
                 found = True
                 break
@@ -546,19 +730,10 @@ class FirmwareUpdater():
         return False
 
     def verify_establish_comms(self,device_name):
-        if device_name == 'hello-wacc':
-            dd = stretch_body.wacc.Wacc()
-        elif device_name == 'hello-pimu':
-            dd = stretch_body.pimu.Pimu()
-        else:
-            dd = stretch_body.stepper.Stepper('/dev/' + device_name)
-        if not dd.startup():
+        dd = fwu.make_device(device_name)
+        if not fwu.identify_device(dd):
             click.secho('FAIL: Unable to establish comms with device %s' % device_name.upper(), fg="red")
             return False
-        else:
-            time.sleep(0.5)
-            dd.stop()
-            del dd
         click.secho('PASS: Established comms with device %s ' % device_name.upper(),fg="green")
         return True
 # ########################################################################################################3
@@ -569,7 +744,7 @@ class FirmwareUpdater():
                 click.secho('Device %s failed to return to bus.' % device_name, fg="red", bold=True)
                 return False
             #time.sleep(1.0)
-            motor = stretch_body.stepper.Stepper('/dev/' + device_name)
+            motor = fwu.make_device(device_name)
             motor.startup()
             if not motor.hw_valid:
                 click.secho('Failed to startup stepper %s' % device_name, fg="red", bold=True)
@@ -586,18 +761,17 @@ class FirmwareUpdater():
                 motor.write_encoder_calibration_to_flash(data)
                 print('\n')
 
-                if int(motor.board_info['protocol_version'].strip('p')) >= 5 and self.stepper_type is not None:
+                if int(motor.board_info['protocol_version'].strip('p')) >= 5 and self.stepper_type.get(device_name) is not None:
                     print('Writing stepper type to flash...')
-                    motor.write_stepper_type_to_flash(self.stepper_type)
+                    motor.write_stepper_type_to_flash(self.stepper_type[device_name])
                     print('Success writing stepper type to Flash')
                     print('\n')
 
                 print('Successful write of FLASH.')
-                fwu.wait_on_device(device_name)
                 motor.board_reset()
                 motor.push_command()
                 motor.transport.ser.close()
-                time.sleep(2.0) #Give time to return to bus
+                fwu.wait_on_device_removal(device_name, timeout=2.0) #Wait for reset to take it off the bus
                 return True
         click.secho('Successful flash of device calibration',fg="green")
         return True
@@ -630,26 +804,25 @@ class FirmwareUpdater():
                         4: '0.7.0p5',
                     }
                     ## Checks to hw id to ensure that user can not downgrade fw to far
-                    for f_limit in range(len(vs)):
-                        fw_limit = self.min_allowed_fw_version.get(self.fw_installed.get_hw_id(device_name), None)
-                        if fw_limit is None:
-                            raise ValueError(f'Hardware ID for {device_name.upper()} Exceeds Mapped Version Please Contact Hello Robot Support') # exit out with error message asking user to contact Hello Robot Support
-                        fw_version = str(vs[f_limit])
-                        fw_version = fw_version[fw_version.index('v') + 1:]
-                        if fw_version == fw_limit:
-                            break
+                    fw_limit = self.min_allowed_fw_version.get(self.fw_installed.get_hw_id(device_name), None)
+                    if fw_limit is None:
+                        raise ValueError(f'Hardware ID for {device_name.upper()} Exceeds Mapped Version Please Contact Hello Robot Support') # exit out with error message asking user to contact Hello Robot Support
+                    vs = self.fw_available.get_versions_in_range(device_name, lo=FirmwareVersion(vs[0].device + '.v' + fw_limit))
+                    if not len(vs):
+                        click.secho('No firmware for %s is available at or above version %s' % (device_name.upper(), fw_limit), fg="red")
+                        return False
 
-                    for i in range(f_limit, len(vs)):
+                    for i in range(len(vs)):
                         if vs[i] == self.fw_recommended.recommended[device_name]:
-                            default_id = i-f_limit
-                        print('%d: %s' % (i-f_limit, vs[i]))
+                            default_id = i
+                        print('%d: %s' % (i, vs[i]))
 
 
                     valid_id = True
                     while valid_id:
                         id = click.prompt('Please enter desired version id [Recommended]', default=default_id)
-                        if id >= 0 and id < len(vs) - f_limit:
-                            vt = vs[id+f_limit]
+                        if id >= 0 and id < len(vs):
+                            vt = vs[id]
                             valid_id = False
                         else:
                             click.secho('Invalid ID Try Again', fg="red")
@@ -781,25 +954,6 @@ class FirmwareUpdater():
 
 
 
-    def create_arduino_config_file(self):
-        if  self.state['install_path']:
-            user_path = self.state['install_path']
-        else:
-            user_path = self.fw_available.repo_path + '/arduino'
-       
-        arduino_config = {'board_manager': {'additional_urls': []},
-                          'daemon': {'port': '50051'},
-                          'directories': {'data': os.environ['HOME'] + '/.arduino15',
-                                          'downloads': os.environ['HOME'] + '/.arduino15/staging',
-                                          'user': user_path},
-                          'library': {'enable_unsafe_install': False},
-                          'logging': {'file': '', 'format': 'text', 'level': 'info'},
-                          'metrics': {'addr': ':9090', 'enabled': True},
-                          'sketch': {'always_export_binaries': False},
-                          'telemetry': {'addr': ':9090', 'enabled': True}}
-        with open(self.fw_available.repo_path + '/arduino-cli.yaml', 'w') as yaml_file:
-            yaml.dump(arduino_config, yaml_file, default_flow_style=False)
-
     def pretty_print_target(self):
         click.secho(' UPDATING FIRMWARE TO... '.center(110, '#'), fg="cyan", bold=True)
         for device_name in self.target:
@@ -854,14 +1008,10 @@ class FirmwareUpdater():
         return None
 
     def get_firmware_version_from_git(self,sketch_name,tag):
-        #click.secho('---------------Git Checkout-------------------------', fg="green")
-        os.chdir(self.fw_available.repo_path)
-        os.system('git checkout ' + tag +' >/dev/null 2>&1')
-        #print('Checked out out firmware %s from Git for %s' % (tag,sketch_name))
-        file_path = self.fw_available.repo_path+'/arduino/'+sketch_name+'/Common.h'
-        f=open(file_path,'r')
-        lines=f.readlines()
-        for l in lines:
+        common_h = self.fw_available.read_file(tag, 'arduino/'+sketch_name+'/Common.h')
+        if common_h is None:
+            return None
+        for l in common_h.splitlines(True):
             if l.find('FIRMWARE_VERSION')>=0:
                 version=l[l.find('"')+1:-2] #Format of: '#define FIRMWARE_VERSION "Wacc.v0.0.1p1"\n'
                 return FirmwareVersion(version)
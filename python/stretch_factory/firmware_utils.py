@@ -1,8 +1,9 @@
 #!/usr/bin/env python
 
+import array as arr
 import click
 import os
-from subprocess import Popen, PIPE
+from subprocess import Popen, PIPE, call, DEVNULL
 import stretch_body.stepper
 import stretch_body.pimu
 import stretch_body.wacc
@@ -13,6 +14,8 @@ import stretch_body.device
 import stretch_body.hello_utils
 import shlex
 import stretch_factory.hello_device_utils as hdu
+import stretch_factory.device_watcher as device_watcher
+import stretch_factory.hardware_sim as hsim
 
 log_device = stretch_body.device.Device(req_params=False)
 
@@ -25,17 +28,26 @@ def check_ubuntu_version():
     res = Popen(shlex.split('cat /etc/lsb-release | grep DISTRIB_RELEASE'), shell=False, bufsize=64, stdin=PIPE, stdout=PIPE,close_fds=True).stdout.read().strip(b'\n')
     return res == b'DISTRIB_RELEASE=18.04'
 
-def check_arduino_cli_install(no_prompts=False):
-    target_version = b'0.31.0'  # 0.18.3'
-    version = 'None'
-    res = Popen(shlex.split('arduino-cli version'), shell=False, bufsize=64, stdin=PIPE, stdout=PIPE,close_fds=True).stdout.read()
-    do_install = False
+def get_arduino_cli_version():
+    """
+    Return the installed arduino-cli version string (eg '0.31.0'), or None if not installed
+    """
+    try:
+        res = Popen(shlex.split(get_arduino_cli() + ' version'), shell=False, bufsize=64, stdin=PIPE, stdout=PIPE,close_fds=True).stdout.read()
+    except OSError:
+        return None
     if not (res[:11] == b'arduino-cli'):
-        do_install = True
-    else:
-        version = res[res.find(b'Version:') + 9:res.find(b' Commit')]
-        if version != target_version:
-            do_install = True
+        return None
+    return res[res.find(b'Version:') + 9:res.find(b' Commit')].decode('utf-8')
+
+ARDUINO_CLI_VERSION = '0.31.0'  # 0.18.3'
+
+def check_arduino_cli_install(no_prompts=False):
+    target_version = ARDUINO_CLI_VERSION.encode('utf-8')
+    version = get_arduino_cli_version()
+    do_install = version is None or version.encode('utf-8') != target_version
+    if version is None:
+        version = 'None'
     if do_install:
         click.secho('WARNING:---------------------------------------------------------------------------------',
                     fg="yellow", bold=True)
@@ -63,6 +75,12 @@ def get_sketch_name(device_name):
     if device_name == 'hello-pimu':
         return 'hello_pimu'
 
+def get_sketch_binary_path(sketch_name):
+    """
+    Path, relative to the firmware repo, of the binary exported by 'arduino-cli compile --export-binaries'
+    """
+    return '/arduino/%s/build/hello-robot.samd.%s/%s.ino.bin' % (sketch_name, sketch_name, sketch_name)
+
 def exec_process(cmdline, silent, input=None, **kwargs):
     """Execute a subprocess and returns the returncode, stdout buffer and stderr buffer.
        Optionally prints stdout and stderr while running."""
@@ -84,38 +102,199 @@ def exec_process(cmdline, silent, input=None, **kwargs):
     return stdout
 
 
-def is_device_present(device_name):
-    try:
-        exec_process(['ls', '/dev/'+device_name], True)
+# ########################### Hardware access ##################################
+# Everything that touches the bus goes through here so that it can be redirected to hardware_sim
+
+def get_dev_dir():
+    return hsim.get_dev_dir() if hsim.enabled() else '/dev'
+
+def get_arduino_cli():
+    if hsim.enabled():
+        return sys.executable + ' -m stretch_factory.sim_toolchain arduino-cli'
+    return 'arduino-cli'
+
+def get_bossac(home_dir=None):
+    if hsim.enabled():
+        return sys.executable + ' -m stretch_factory.sim_toolchain bossac'
+    home_dir = os.path.expanduser('~') if home_dir is None else home_dir
+    return home_dir + '/.arduino15/packages/arduino/tools/bossac/1.7.0/bossac'
+
+def is_bossac_installed(home_dir=None):
+    if hsim.enabled():
         return True
-    except RuntimeError as e:
+    return os.access(get_bossac(home_dir), os.X_OK)
+
+def make_device(device_name):
+    """
+    Return an (unstarted) Stretch Body device for a hello-* device name
+    """
+    if hsim.enabled():
+        return hsim.make_device(device_name)
+    if device_name == 'hello-wacc':
+        return stretch_body.wacc.Wacc()
+    if device_name == 'hello-pimu':
+        return stretch_body.pimu.Pimu()
+    return stretch_body.stepper.Stepper('/dev/' + device_name)
+
+def identify_device(dd):
+    """
+    Read board_info from an unstarted device (see make_device) without a full startup().
+    Opens the port, requests the board info RPC and closes. Nothing is pushed to the board
+    and its protocol isn't loaded, so only board_info and supported_protocols are valid afterwards.
+    Returns True if the board replied with its firmware version
+    """
+    if hsim.enabled():
+        return dd.identify()
+    if not dd.transport.startup():
         return False
+    try:
+        if isinstance(dd, stretch_body.pimu.Pimu):
+            rpc = dd.RPC_GET_PIMU_BOARD_INFO
+        elif isinstance(dd, stretch_body.wacc.Wacc):
+            rpc = dd.RPC_GET_WACC_BOARD_INFO
+        else:
+            rpc = dd.RPC_GET_STEPPER_BOARD_INFO
+        dd.transport.do_pull_rpc_sync(arr.array('B', [rpc]), dd.rpc_board_info_reply)
+    finally:
+        dd.transport.stop()
+    return bool(dd.board_info['firmware_version'])
+
+def touch_port(port_name, baudrate):
+    #Open and close the port at baudrate. At 1200 baud this places the board in its bootloader
+    if hsim.enabled():
+        hsim.get_bus().touch(port_name, baudrate)
+        return
+    p = hdu.serial.Serial('/dev/' + port_name, baudrate=baudrate)
+    p.__del__()
+
+def find_tty_devices():
+    if hsim.enabled():
+        return hsim.get_bus().find_tty_devices()
+    hdu.invalidate_tty_device_cache()
+    return hdu.find_tty_devices()
+
+def usb_reset(name='Arduino Zero'):
+    if hsim.enabled():
+        hsim.get_bus().usb_reset()
+        return 0
+    return call('sudo usbreset \"%s\"' % name, shell=True, stdout=DEVNULL)
+
+BOOTLOADER_ATTEMPTS = 5
+BOOTLOADER_DETECT_TIMEOUT = 4.0  # Time for the board to drop off and return as Arduino_Zero after a 1200 baud touch
+BOOTLOADER_BACKOFF = 1.0  # Wait before the next attempt, doubled each attempt up to BOOTLOADER_BACKOFF_MAX
+BOOTLOADER_BACKOFF_MAX = 8.0
+BOOTLOADER_RECHECK = 0.5  # udev may label a new node after its last /dev event, so also recheck this often
+
+def find_bootloader_port():
+    """
+    Return the tty of the (one) board in its bootloader, found by its Arduino_Zero model. None if there is none.
+    """
+    for k, v in find_tty_devices().items():
+        if v['model'] == 'Arduino_Zero':
+            return k
+    return None
+
+def wait_on_bootloader(timeout=BOOTLOADER_DETECT_TIMEOUT):
+    """
+    Wait for a board to appear in its bootloader. Wakes on /dev events rather than rescanning the bus.
+    Return its tty, or None on timeout
+    """
+    watcher = device_watcher.DeviceWatcher(get_dev_dir())
+    found = []
+
+    def check():
+        port = find_bootloader_port()
+        if port is not None:
+            found.append(port)
+        return port is not None
+    ts = time.time()
+    while not found:
+        remaining = timeout - (time.time() - ts)
+        if remaining <= 0 or watcher.wait_for(check, min(BOOTLOADER_RECHECK, remaining)):
+            break
+    return found[0] if found else None
+
+def enter_bootloader(port_name, attempts=BOOTLOADER_ATTEMPTS, detect_timeout=BOOTLOADER_DETECT_TIMEOUT,
+                     backoff=BOOTLOADER_BACKOFF, backoff_max=BOOTLOADER_BACKOFF_MAX):
+    """
+    Place the board on port_name in its bootloader with a 1200 baud touch, retrying up to attempts times
+    with exponential backoff between them. Only one board may be in its bootloader at a time.
+    Returns the outcome:
+        {'success': True, 'port': '/dev/ttyACM0', 'elapsed_s': 2.1,
+         'attempts': [{'attempt': 1, 'touch_s': 0.02, 'detect_s': 2.0, 'found': True, 'error': None}, ...]}
+    """
+    outcome = {'success': False, 'port': None, 'elapsed_s': 0.0, 'attempts': []}
+    ts = time.time()
+    for i in range(attempts):
+        a = {'attempt': i + 1, 'touch_s': 0.0, 'detect_s': 0.0, 'found': False, 'error': None}
+        outcome['attempts'].append(a)
+        t0 = time.time()
+        try:
+            touch_port(port_name, 1200)
+        except (OSError, ValueError, TypeError) as e:  # SerialException is an OSError
+            a['error'] = str(e)
+        a['touch_s'] = time.time() - t0
+        t0 = time.time()
+        outcome['port'] = wait_on_bootloader(detect_timeout)
+        a['detect_s'] = time.time() - t0
+        a['found'] = outcome['port'] is not None
+        if a['found']:
+            outcome['success'] = True
+            break
+        if i < attempts - 1:
+            wait = min(backoff * 2 ** i, backoff_max)
+            user_msg_log('Bootloader not found on attempt %d of %d. Retrying in %.1fs' % (i + 1, attempts, wait), fg="yellow")
+            try:
+                touch_port(port_name, 2000000)  # Clear the 1200 baud setting before touching again
+            except (OSError, ValueError, TypeError):
+                pass
+            time.sleep(wait)
+    outcome['elapsed_s'] = time.time() - ts
+    return outcome
+
+def is_device_present(device_name):
+    return os.path.exists(os.path.join(get_dev_dir(), device_name))
 
 def wait_on_device(device_name,timeout=10.0):
     #Wait for device to appear on bus for timeout seconds
+    #Blocks on /dev arrival events rather than polling
     print('Waiting for device %s to return to bus.'%device_name)
-    ts=time.time()
-    itr=0
-    while(time.time()-ts<timeout):
-        if is_device_present(device_name):
-            return True
-        itr=itr+1
-        if itr % 5 == 0:
-            sys.stdout.write('.')
-            sys.stdout.flush()
-        time.sleep(0.1)
-    return False
+    if hsim.enabled():
+        hsim.get_bus()
+    return device_watcher.DeviceWatcher(get_dev_dir()).wait_for_device(device_name,timeout=timeout,present=True)
+
+def wait_on_device_removal(device_name,timeout=10.0):
+    #Wait for device to drop off the bus for timeout seconds
+    if hsim.enabled():
+        hsim.get_bus()
+    return device_watcher.DeviceWatcher(get_dev_dir()).wait_for_device(device_name,timeout=timeout,present=False)
 
 def get_port_name(device_name):
     try:
-        port_name = Popen(shlex.split("ls -l /dev/" + device_name), shell=False, bufsize=64, stdin=PIPE, stdout=PIPE,close_fds=True).stdout.read().strip().split()[-1]
-        if not type(port_name)==str:
-            port_name=port_name.decode('utf-8')
-        return port_name
-    except IndexError:
+        return os.path.basename(os.readlink(os.path.join(get_dev_dir(), device_name)))
+    except OSError:
         return None
 
+def get_usb_serial(device_name):
+    if hsim.enabled():
+        d = hsim.get_bus().get_device(device_name)
+        return d['serial_no'] if d is not None else None
+    return hdu.get_udev_properties(os.path.realpath('/dev/' + device_name)).get('ID_SERIAL_SHORT')
+
+def get_enumeration_key(device_name):
+    """
+    Identify the current enumeration of a device by its USB serial and the creation time of its tty node.
+    This changes whenever the device drops off and returns to the bus (eg, after a flash). None if not on the bus.
+    """
+    try:
+        ctime = os.stat(os.path.join(get_dev_dir(), device_name)).st_ctime
+    except OSError:
+        return None
+    return '%s:%s:%.6f' % (device_name, get_usb_serial(device_name), ctime)
+
 def does_stepper_have_encoder_calibration_YAML(device_name):
+    if hsim.enabled():
+        return True
     d=stretch_body.device.Device(req_params=False)
     sn = d.robot_params[device_name]['serial_no']
     fn = 'calibration_steppers/' + device_name + '_' + sn + '.yaml'
@@ -124,18 +303,7 @@ def does_stepper_have_encoder_calibration_YAML(device_name):
 
 def get_device_protocols(device_name):
     #return list like ['p0','p1']
-    s=get_sketch_name(device_name)
-    if s == 'hello_wacc':
-        import stretch_body.wacc
-        dd = stretch_body.wacc.Wacc()
-        return list(dd.supported_protocols.keys())
-    elif s == 'hello_pimu':
-        import stretch_body.pimu
-        dd = stretch_body.pimu.Pimu()
-        return list(dd.supported_protocols.keys())
-    elif s == 'hello_stepper':
-        import stretch_body.stepper
-        dd = stretch_body.stepper.Stepper('/dev/'+device_name)
-        return list(dd.supported_protocols.keys())
-    return []
+    if get_sketch_name(device_name) is None:
+        return []
+    return list(make_device(device_name).supported_protocols.keys())
 
@@ -23,35 +23,30 @@ class FirmwareVersion():
         return self.device + '.v' + str(self.major) + '.' + str(self.minor) + '.' + str(self.bugfix) + 'p' + str(
             self.protocol)
 
+    def get_key(self):
+        """
+        Sort key of the version. Versions are ordered by protocol, then major, minor and bugfix
+        """
+        return (self.protocol, self.major, self.minor, self.bugfix)
+
     def __gt__(self, other):
         if not self.valid or not other.valid:
             return False
-        if self.protocol > other.protocol:
-            return True
-        if self.protocol < other.protocol:
-            return False
-        if self.major > other.major:
-            return True
-        if self.minor > other.minor:
-            return True
-        if self.bugfix > other.bugfix:
-            return True
-        return False
+        return self.get_key() > other.get_key()
 
     def __lt__(self, other):
         if not self.valid or not other.valid:
             return False
-        if self.protocol < other.protocol:
-            return True
-        if self.protocol > other.protocol:
-            return False
-        if self.major < other.major:
-            return True
-        if self.minor < other.minor:
-            return True
-        if self.bugfix < other.bugfix:
-            return True
-        return False
+        return self.get_key() < other.get_key()
+
+    def __ge__(self, other):
+        return self.__gt__(other) or self.__eq__(other)
+
+    def __le__(self, other):
+        return self.__lt__(other) or self.__eq__(other)
+
+    def __hash__(self):
+        return hash(self.get_key())
 
     def __ne__(self, other):
         return not self.__eq__(other)
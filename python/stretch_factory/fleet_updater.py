@@ -0,0 +1,365 @@
+"""
+Firmware updates across a fleet of robots
+
+The fleet is described by a manifest YAML:
+
+    parallel: 2                        # Robots updated at once (optional)
+    robots:
+      - name: stretch-se3-3000
+        fleet_path: /home/hello-robot/stretch_user   # HELLO_FLEET_PATH of the robot [this host's]
+        fleet_id: stretch-se3-3000                    # HELLO_FLEET_ID of the robot [name]
+        transport: local                              # local | sim [local]
+        devices: [hello-pimu, hello-wacc]             # Devices to consider [all]
+      - name: sim-robot-1
+        transport: sim
+        sim_config: /path/to/sim.yaml                 # Base sim config (optional)
+
+Each robot is updated by running the firmware tools in a child process with the robot's environment,
+so a robot is just its fleet directory plus the transport that reaches its devices:
+    local: the devices on the USB bus of this host. Local robots share the one bus so are updated one at a time.
+    sim:   a simulated robot with its own bus under the robot's state directory (see hardware_sim.py)
+
+A robot is updated in phases:
+    plan:   read the installed firmware and use FirmwareRecommended to pick the target of each device
+    update: REx_firmware_updater.py --install for the devices with an upgrade, or --resume of an earlier run
+    verify: read the installed firmware again and check it matches the plan
+
+The state of each robot is kept in <state_dir>/<name>/ (plan.yaml, resume.yaml, update.log, ...), so an
+interrupted fleet update picks up where each robot left off. The aggregate report is written to
+<state_dir>/report.yaml as:
+    {'ts': 1700000000.0, 'elapsed_s': 130.2, 'robots': {'stretch-se3-3000': {'status': 'updated',
+     'phases': {'plan': 4.1, 'update': 61.0, 'verify': 3.9}, 'devices': {'hello-pimu': {'installed': 'Pimu.v0.6.0p5',
+     'target': 'Pimu.v0.7.0p6', 'update': True, 'error': None, 'verified': 'Pimu.v0.7.0p6'}},
+     'log': '<state_dir>/<name>/update.log'}}}
+A device whose firmware can't be read is recorded with 'installed': None and 'error': 'not on bus', and fails the robot.
+"""
+
+import argparse
+import copy
+import os
+import subprocess
+import sys
+import threading
+import time
+import click
+import yaml
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from tabulate import tabulate
+import stretch_body.hello_utils as hu
+
+DEVICES = ['hello-motor-arm', 'hello-motor-right-wheel', 'hello-motor-left-wheel', 'hello-pimu', 'hello-wacc', 'hello-motor-lift']
+DEVICE_ARGS = {'hello-pimu': '--pimu', 'hello-wacc': '--wacc', 'hello-motor-right-wheel': '--right_wheel',
+               'hello-motor-left-wheel': '--left_wheel', 'hello-motor-lift': '--lift', 'hello-motor-arm': '--arm'}
+PHASES = ['plan', 'update', 'verify']
+TRANSPORTS = ['local', 'sim']
+
+
+class FleetUpdaterError(Exception):
+    pass
+
+
+def get_updater_tool():
+    return os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), 'tools', 'REx_firmware_updater.py')
+
+
+def load_manifest(filename):
+    """
+    Read and check a fleet manifest, filling in the defaults of each robot
+    """
+    with open(filename, 'r') as s:
+        m = yaml.safe_load(s) or {}
+    robots = []
+    for r in m.get('robots', []):
+        r = dict(r)
+        if 'name' not in r:
+            raise FleetUpdaterError('Robot without a name in %s' % filename)
+        r.setdefault('fleet_path', os.environ.get('HELLO_FLEET_PATH'))
+        r.setdefault('fleet_id', r['name'])
+        r.setdefault('transport', 'local')
+        r.setdefault('devices', list(DEVICES))
+        if r['transport'] not in TRANSPORTS:
+            raise FleetUpdaterError('Robot %s has unknown transport %s' % (r['name'], r['transport']))
+        unknown = [d for d in r['devices'] if d not in DEVICES]
+        if unknown:
+            raise FleetUpdaterError('Robot %s has unknown devices %s' % (r['name'], unknown))
+        robots.append(r)
+    if len(set([r['name'] for r in robots])) != len(robots):
+        raise FleetUpdaterError('Robot names in %s are not unique' % filename)
+    return {'parallel': m.get('parallel', 1), 'robots': robots}
+
+
+# ########################### Transport ##################################
+
+class LocalTransport():
+    """
+    Runs the firmware tools for a robot whose devices are on this host
+    """
+    lock = threading.Lock()  # One local robot at a time as they share the USB bus
+
+    def __init__(self, robot, state_dir):
+        self.robot = robot
+        self.state_dir = state_dir
+
+    def get_env(self):
+        env = dict(os.environ)
+        if self.robot['fleet_path']:
+            env['HELLO_FLEET_PATH'] = self.robot['fleet_path']
+        env['HELLO_FLEET_ID'] = self.robot['fleet_id']
+        env.pop('STRETCH_FACTORY_SIM', None)
+        return env
+
+    def get_sim_args(self):
+        return []
+
+    def run(self, args, log_file):
+        """
+        Run python with args in the robot's environment, appending the output to log_file. Returns the exit code
+        """
+        with self.lock:
+            with open(log_file, 'a') as fh:
+                fh.write('\n$ %s\n' % ' '.join(args))
+                fh.flush()
+                return subprocess.call([sys.executable] + list(args) + self.get_sim_args(), env=self.get_env(),
+                                       stdout=fh, stderr=subprocess.STDOUT, cwd=self.state_dir)
+
+
+class SimTransport(LocalTransport):
+    """
+    Runs the firmware tools against a simulated robot whose bus is kept in <state_dir>/sim
+    """
+    def __init__(self, robot, state_dir):
+        LocalTransport.__init__(self, robot, state_dir)
+        self.lock = threading.Lock()  # Its own bus, so it runs concurrently with other robots
+        self.config_file = os.path.join(state_dir, 'sim.yaml')
+        config = {}
+        if robot.get('sim_config'):
+            with open(robot['sim_config'], 'r') as s:
+                config = yaml.safe_load(s) or {}
+        config['sim_dir'] = os.path.join(state_dir, 'sim')
+        with open(self.config_file, 'w') as s:
+            yaml.dump(config, s, default_flow_style=False)
+
+    def get_env(self):
+        env = LocalTransport.get_env(self)
+        env['STRETCH_FACTORY_SIM'] = self.config_file
+        return env
+
+    def get_sim_args(self):
+        return ['--sim', self.config_file]
+
+
+def make_transport(robot, state_dir):
+    if robot['transport'] == 'sim':
+        return SimTransport(robot, state_dir)
+    return LocalTransport(robot, state_dir)
+
+
+# ########################### Robot ##################################
+
+class RobotUpdate():
+    """
+    The plan, update and verify phases of a single robot. State is kept in state_dir.
+    """
+    def __init__(self, robot, state_dir, mirror_args=None, update_args=None):
+        self.robot = robot
+        self.name = robot['name']
+        self.state_dir = state_dir
+        self.mirror_args = [] if mirror_args is None else list(mirror_args)  # Passed to all phases, eg --offline
+        self.update_args = [] if update_args is None else list(update_args)  # Passed to the updater, eg --parallel 2
+        os.makedirs(state_dir, exist_ok=True)
+        self.transport = make_transport(robot, state_dir)
+        self.plan_filename = os.path.join(state_dir, 'plan.yaml')
+        self.verify_filename = os.path.join(state_dir, 'verify.yaml')
+        self.resume_filename = os.path.join(state_dir, 'resume.yaml')
+        self.log_filename = os.path.join(state_dir, 'update.log')
+        self.result = {'status': 'pending', 'phases': {}, 'devices': {}, 'log': self.log_filename, 'error': None}
+
+    def is_resumable(self):
+        return os.path.isfile(self.resume_filename) and os.path.isfile(self.plan_filename)
+
+    def read_plan(self, filename):
+        with open(filename, 'r') as s:
+            return yaml.safe_load(s) or {}
+
+    def run_plan(self, filename):
+        args = ['-m', 'stretch_factory.fleet_updater', 'plan', '--out', filename, '--devices'] + self.robot['devices']
+        if self.transport.run(args + self.mirror_args, self.log_filename) != 0 or not os.path.isfile(filename):
+            raise FleetUpdaterError('Unable to read the installed firmware')
+        return self.read_plan(filename)
+
+    def run_update(self, plan, resume):
+        args = [get_updater_tool(), '--no_prompts', '--resume_file', self.resume_filename]
+        if resume:
+            args.append('--resume')
+        else:
+            args = args + ['--install'] + [DEVICE_ARGS[d] for d in plan if plan[d]['update']]
+        return self.transport.run(args + self.mirror_args + self.update_args, self.log_filename) == 0
+
+    def get_unreadable(self, plan):
+        """
+        Devices of the plan whose installed firmware couldn't be read
+        """
+        return [d for d in plan if plan[d]['installed'] is None]
+
+    def timed(self, phase, fn, *args):
+        ts = time.time()
+        try:
+            return fn(*args)
+        finally:
+            self.result['phases'][phase] = time.time() - ts
+
+    def run(self, plan_only=False):
+        """
+        Plan, update and verify the robot. Returns the result dict of the robot
+        """
+        r = self.result
+        try:
+            resume = self.is_resumable()
+            if resume:
+                plan = self.read_plan(self.plan_filename)
+                r['phases']['plan'] = 0.0
+            else:
+                plan = self.timed('plan', self.run_plan, self.plan_filename)
+            r['devices'] = copy.deepcopy(plan)
+            unreadable = self.get_unreadable(plan)
+            if unreadable:
+                # Don't take a robot with a missing board as up to date
+                r['status'] = 'failed'
+                r['error'] = 'Unable to read the installed firmware of %s' % ', '.join(unreadable)
+                return r
+            if plan_only:
+                r['status'] = 'planned'
+                return r
+            if not resume and not any([p['update'] for p in plan.values()]):
+                r['status'] = 'up to date'
+                return r
+            if not self.timed('update', self.run_update, plan, resume):
+                r['status'] = 'failed'
+                r['error'] = 'Update did not complete. Rerun to resume.'
+                return r
+            verified = self.timed('verify', self.run_plan, self.verify_filename)
+            ok = True
+            for d in plan:
+                r['devices'][d]['verified'] = verified.get(d, {}).get('installed')
+                if plan[d]['update']:
+                    ok = ok and r['devices'][d]['verified'] == plan[d]['target']
+            lost = [d for d in plan if r['devices'][d]['verified'] is None]
+            for d in lost:
+                r['devices'][d]['error'] = 'not on bus after the update'
+            r['status'] = 'updated' if ok and not lost else 'failed'
+            if lost:
+                r['error'] = 'Unable to read the installed firmware of %s after the update' % ', '.join(lost)
+            elif not ok:
+                r['error'] = 'Installed firmware does not match the plan'
+            else:
+                os.remove(self.plan_filename)
+        except (FleetUpdaterError, IOError) as e:
+            r['status'] = 'failed'
+            r['error'] = str(e)
+        return r
+
+
+# ########################### Fleet ##################################
+
+class FleetUpdater():
+    """
+    Update the firmware of the robots of a manifest, parallel robots at a time
+    """
+    def __init__(self, manifest, state_dir=None, parallel=None, offline=False, bundle=None, device_parallel=1):
+        self.manifest = manifest
+        self.state_dir = state_dir if state_dir is not None else hu.get_stretch_directory('log/fleet_firmware_update/')
+        self.parallel = max(1, parallel if parallel is not None else manifest['parallel'])
+        mirror_args = (['--offline'] if offline else []) + (['--bundle', os.path.abspath(bundle)] if bundle else [])
+        update_args = ['--parallel', str(device_parallel)]
+        self.robots = [RobotUpdate(r, os.path.join(self.state_dir, r['name']), mirror_args, update_args)
+                       for r in manifest['robots']]
+        self.report = None
+
+    def run(self, plan_only=False):
+        """
+        Returns True if all robots were planned, updated or already up to date
+        """
+        ts = time.time()
+        results = {}
+        with ThreadPoolExecutor(max_workers=self.parallel) as executor:
+            futures = {executor.submit(r.run, plan_only): r for r in self.robots}
+            for f in as_completed(futures):
+                r = futures[f]
+                results[r.name] = f.result()
+                click.secho('%s | %s' % (r.name.upper().ljust(25), results[r.name]['status']),
+                            fg="red" if results[r.name]['status'] == 'failed' else "green", bold=True)
+        self.report = {'ts': ts, 'elapsed_s': time.time() - ts, 'parallel': self.parallel,
+                       'robots': {r.name: results[r.name] for r in self.robots}}
+        self.save_report()
+        return all([v['status'] != 'failed' for v in results.values()])
+
+    def get_report_filename(self):
+        return os.path.join(self.state_dir, 'report.yaml')
+
+    def save_report(self, filename=None):
+        filename = self.get_report_filename() if filename is None else filename
+        tmp_filename = filename + '.tmp'
+        with open(tmp_filename, 'w') as s:
+            yaml.dump(self.report, s, default_flow_style=False)
+        os.replace(tmp_filename, filename)
+
+    def pretty_print(self):
+        click.secho(' FLEET FIRMWARE UPDATE '.center(110, '#'), fg="cyan", bold=True)
+        rows = []
+        for name, r in self.report['robots'].items():
+            n = len([d for d in r['devices'].values() if d['update']])
+            rows.append([name, r['status'], n] + ['%.1f' % r['phases'][p] if p in r['phases'] else '-' for p in PHASES] +
+                        [r['error'] or ''])
+        print(tabulate(rows, headers=['ROBOT', 'STATUS', 'UPDATES'] + ['%s (S)' % p.upper() for p in PHASES] + ['ERROR']))
+        print('')
+        totals = {p: sum([r['phases'].get(p, 0.0) for r in self.report['robots'].values()]) for p in PHASES}
+        print('Robot time per phase: %s' % ' | '.join(['%s %.1fs' % (p, totals[p]) for p in PHASES]))
+        print('Fleet update took %.1fs (wall clock) with %d at a time' % (self.report['elapsed_s'], self.parallel))
+        print('Report: %s' % self.get_report_filename())
+
+
+# ########################### Plan ##################################
+
+def plan(devices, offline=False, bundle=None):
+    """
+    Installed and recommended firmware of the devices of the robot this process runs on:
+        {'hello-pimu': {'installed': 'Pimu.v0.6.0p5', 'target': 'Pimu.v0.7.0p6', 'update': True}, ...}
+    """
+    from stretch_factory.firmware_installed import FirmwareInstalled
+    from stretch_factory.firmware_available import FirmwareAvailable
+    from stretch_factory.firmware_recommended import FirmwareRecommended
+    use_device = {d: d in devices for d in DEVICES}
+    installed = FirmwareInstalled(use_device)
+    recommended = FirmwareRecommended(use_device, installed=installed,
+                                      available=FirmwareAvailable(use_device, offline=offline, bundle=bundle))
+    out = {}
+    for d in devices:
+        v = installed.get_version(d) if installed.is_device_valid(d) else None
+        t = recommended.recommended.get(d)
+        out[d] = {'installed': str(v) if v is not None else None, 'target': str(t) if t is not None else None,
+                  'update': v is not None and t is not None and t > v,
+                  'error': 'not on bus' if v is None else None}
+    return out
+
+
+def main():
+    # Entry point run in each robot's environment by the transport
+    parser = argparse.ArgumentParser(description='Fleet firmware update helpers')
+    parser.add_argument('command', choices=['plan'])
+    parser.add_argument('--out', type=str, required=True)
+    parser.add_argument('--devices', nargs='+', default=DEVICES)
+    parser.add_argument('--offline', action='store_true')
+    parser.add_argument('--bundle', type=str, default=None)
+    parser.add_argument('--sim', nargs='?', const='', default=None)
+    args = parser.parse_args()
+    if args.sim is not None:
+        import stretch_factory.hardware_sim as hsim
+        hsim.enable(args.sim)
+    p = plan(args.devices, offline=args.offline, bundle=args.bundle)
+    with open(args.out, 'w') as s:
+        yaml.dump(p, s, default_flow_style=False)
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,774 @@
+"""
+Simulated Stretch hardware, so the firmware tools and calibration loops can be run end to end without a robot
+
+Enabled by setting STRETCH_FACTORY_SIM (or the tools' --sim flag) to 1, or to the path of a YAML file that
+overrides any of DEFAULT_CONFIG, eg:
+
+    latency_s: 0.004
+    loss: 0.01
+    devices:
+      hello-pimu: {firmware_version: Pimu.v0.6.0p5}
+
+The bus state (installed firmware versions, bootloader / reset state) is kept in <sim_dir>/bus.yaml so that it
+persists across runs and is shared with the fake arduino-cli and bossac (see sim_toolchain.py). The simulated
+/dev is <sim_dir>/dev, holding a ttyACMx node and a hello-* symlink for each device on the bus.
+"""
+
+import array as arr
+import contextlib
+import copy
+import fcntl
+import os
+import random
+import shutil
+import threading
+import time
+import yaml
+from yaml import CSafeLoader as Loader, CSafeDumper as Dumper
+from stretch_factory.firmware_version import FirmwareVersion
+
+SIM_ENV = 'STRETCH_FACTORY_SIM'
+
+DEFAULT_CONFIG = {'sim_dir': '/tmp/stretch_factory_sim',
+                  'seed': None,
+                  'latency_s': 0.002,  # Per RPC round trip
+                  'jitter_s': 0.0005,  # Std dev of the (one-sided) gaussian added to latency_s
+                  'loss': 0.0,  # Probability that an RPC gets no reply
+                  'timeout_s': 0.1,  # Time lost to an RPC with no reply
+                  'byte_time_s': 1e-6,  # Per payload byte, about USB full speed
+                  'compile_time_s': 2.0,
+                  'flash_time_s': 3.0,
+                  'reenumerate_s': 1.0,  # Time to drop off and return to the bus on a reset
+                  'bootloader_miss': 0.0,  # Probability a 1200 baud touch fails to enter the bootloader
+                  'flash_fail': 0.0,  # Probability that bossac fails
+                  'battery_voltage': 12.4,
+                  'supported_protocols': {'Stepper': ['p0', 'p1', 'p2', 'p3', 'p4', 'p5'],
+                                          'Pimu': ['p0', 'p1', 'p2', 'p3', 'p4', 'p5', 'p6'],
+                                          'Wacc': ['p0', 'p1', 'p2', 'p3']},
+                  'devices': {'hello-motor-lift': {'firmware_version': 'Stepper.v0.5.1p4', 'stepper_type': 'hello-motor-lift'},
+                              'hello-motor-arm': {'firmware_version': 'Stepper.v0.5.1p4', 'stepper_type': 'hello-motor-arm'},
+                              'hello-motor-left-wheel': {'firmware_version': 'Stepper.v0.5.1p4', 'stepper_type': 'hello-motor-left-wheel'},
+                              'hello-motor-right-wheel': {'firmware_version': 'Stepper.v0.5.1p4', 'stepper_type': 'hello-motor-right-wheel'},
+                              'hello-pimu': {'firmware_version': 'Pimu.v0.6.0p5'},
+                              'hello-wacc': {'firmware_version': 'Wacc.v0.5.0p3'}},
+                  'tags': ['Stepper.v0.5.1p4', 'Stepper.v0.6.2p5', 'Pimu.v0.6.0p5', 'Pimu.v0.7.0p6', 'Wacc.v0.5.0p3', 'Wacc.v0.5.1p3'],
+                  'dynamixels': {'head_pan': 11, 'head_tilt': 12, 'wrist_yaw': 13, 'stretch_gripper': 14},
+                  'joints': {'arm': {'range_m': [0.0, 0.52], 'effort_pct_per_accel': 120.0, 'effort_pct_per_vel': 10.0, 'effort_pct_bias': 0.0},
+                             'lift': {'range_m': [0.0, 1.1], 'effort_pct_per_accel': 150.0, 'effort_pct_per_vel': 15.0, 'effort_pct_bias': 20.0}},
+                  'effort_noise_pct': 1.0,
+                  'tracking_lag_s2': 0.005}  # Position error per m/s^2 of commanded acceleration
+
+_config = None
+_bus = None
+_bus_lock = threading.Lock()
+
+
+def enabled():
+    return bool(os.environ.get(SIM_ENV))
+
+
+def enable(config_file=None):
+    """
+    Turn on the simulation for this process and its children (eg, the fake toolchain)
+    """
+    global _config, _bus
+    os.environ[SIM_ENV] = os.path.abspath(config_file) if config_file else '1'
+    _config = None
+    _bus = None
+
+
+def get_config():
+    global _config
+    if _config is None:
+        c = copy.deepcopy(DEFAULT_CONFIG)
+        fn = os.environ.get(SIM_ENV, '')
+        if fn not in ('', '1'):
+            with open(fn, 'r') as s:
+                user = yaml.safe_load(s) or {}
+            for k, v in user.items():
+                if isinstance(v, dict) and isinstance(c.get(k), dict):
+                    c[k].update(v)
+                else:
+                    c[k] = v
+        _config = c
+    return _config
+
+
+def get_sim_dir():
+    return get_config()['sim_dir']
+
+
+def get_dev_dir():
+    return os.path.join(get_sim_dir(), 'dev')
+
+
+def get_board(device_name):
+    if device_name.startswith('hello-motor'):
+        return 'Stepper'
+    if device_name == 'hello-pimu':
+        return 'Pimu'
+    if device_name == 'hello-wacc':
+        return 'Wacc'
+    return None
+
+
+def get_sketch(board):
+    return {'Stepper': 'hello_stepper', 'Pimu': 'hello_pimu', 'Wacc': 'hello_wacc'}.get(board)
+
+
+# ########################### Bus ##################################
+
+class SimBus:
+    """
+    The USB bus as seen by the tools. Transitions (reset, bootloader entry, flash) take effect after
+    reenumerate_s, applied by sync() which is run from a background thread of each process using the bus.
+    """
+
+    def __init__(self, config=None):
+        self.config = get_config() if config is None else config
+        self.sim_dir = self.config['sim_dir']
+        self.dev_dir = os.path.join(self.sim_dir, 'dev')
+        self.state_file = os.path.join(self.sim_dir, 'bus.yaml')
+        self.lock_file = os.path.join(self.sim_dir, 'bus.lock')
+        self.rng = random.Random(self.config['seed'])
+        self._synced = None  # (state file mtime, next due transition) as of the last sync
+        os.makedirs(self.dev_dir, exist_ok=True)
+        with self._state() as s:
+            if not s.get('devices'):
+                s.update(self._initial_state())
+        self.sync()
+
+    def _initial_state(self):
+        devices = {}
+        for i, name in enumerate(self.config['devices']):
+            d = self.config['devices'][name]
+            devices[name] = {'firmware_version': d['firmware_version'],
+                             'stepper_type': d.get('stepper_type'),
+                             'serial_no': d.get('serial_no', 'SIM%06d' % i),
+                             'port': 'ttyACM%d' % i,
+                             'mode': 'app',  # app | bootloader | offline
+                             'next_mode': None,
+                             'due': None,
+                             'encoder_calibration': None,
+                             'n_flash': 0}
+        return {'devices': devices}
+
+    @contextlib.contextmanager
+    def _state(self, write=True):
+        with open(self.lock_file, 'a') as lf:
+            fcntl.flock(lf, fcntl.LOCK_EX)
+            try:
+                try:
+                    with open(self.state_file, 'r') as s:
+                        state = yaml.load(s, Loader=Loader) or {}
+                except IOError:
+                    state = {}
+                yield state
+                if write:
+                    tmp = self.state_file + '.tmp'
+                    with open(tmp, 'w') as s:
+                        yaml.dump(state, s, Dumper=Dumper)
+                    os.replace(tmp, self.state_file)
+            finally:
+                fcntl.flock(lf, fcntl.LOCK_UN)
+
+    def get_device(self, device_name):
+        with self._state(write=False) as s:
+            return copy.deepcopy(s['devices'].get(device_name))
+
+    def get_devices(self):
+        with self._state(write=False) as s:
+            return copy.deepcopy(s['devices'])
+
+    def update_device(self, device_name, **kwargs):
+        with self._state() as s:
+            s['devices'][device_name].update(kwargs)
+
+    def find_device_by_port(self, port):
+        port = os.path.basename(port)
+        for name, d in self.get_devices().items():
+            if d['port'] == port:
+                return name
+        return None
+
+    def _schedule(self, device_name, mode, next_mode, delay=None):
+        delay = self.config['reenumerate_s'] if delay is None else delay
+        self.update_device(device_name, mode=mode, next_mode=next_mode, due=time.time() + delay)
+
+    def sync(self):
+        """
+        Apply any transitions that are due and make the sim /dev match the bus
+        """
+        now = time.time()
+        if self._synced is not None and self._synced[0] == self._get_mtime() and (self._synced[1] is None or now < self._synced[1]):
+            return  # Nothing has changed
+        with self._state(write=False) as s:
+            devices = s['devices']
+            due = [n for n in devices if devices[n]['due'] is not None and devices[n]['due'] <= now]
+        if len(due):
+            with self._state() as s:
+                for n in due:
+                    d = s['devices'][n]
+                    if d['due'] is not None and d['due'] <= now:
+                        d['mode'], d['next_mode'], d['due'] = d['next_mode'], None, None
+                devices = s['devices']
+        want = {}
+        for n, d in devices.items():
+            if d['mode'] in ('app', 'bootloader'):
+                want[d['port']] = None
+            if d['mode'] == 'app':
+                want[n] = d['port']
+        have = set(os.listdir(self.dev_dir))
+        for e in have - set(want.keys()):
+            os.remove(os.path.join(self.dev_dir, e))
+        for e in sorted(want.keys(), key=lambda x: want[x] is not None):  # Nodes before their symlinks
+            p = os.path.join(self.dev_dir, e)
+            if want[e] is None:
+                if e not in have:
+                    open(p, 'a').close()
+            elif e not in have:
+                os.symlink(want[e], p)
+        pending = [d['due'] for d in devices.values() if d['due'] is not None]
+        self._synced = (self._get_mtime(), min(pending) if len(pending) else None)
+
+    def _get_mtime(self):
+        try:
+            return os.stat(self.state_file).st_mtime_ns
+        except OSError:
+            return None
+
+    # ########################### Events ##################################
+
+    def touch(self, port, baudrate):
+        """
+        Opening a port at 1200 baud puts the device in its bootloader (as on the SAMD21)
+        """
+        name = self.find_device_by_port(port)
+        if name is None or baudrate != 1200:
+            return
+        d = self.get_device(name)
+        if d['mode'] == 'app' and self.rng.random() >= self.config['bootloader_miss']:
+            self._schedule(name, 'offline', 'bootloader')
+
+    def reset_board(self, device_name):
+        self._schedule(device_name, 'offline', 'app')
+
+    def usb_reset(self):
+        for name, d in self.get_devices().items():
+            if d['mode'] == 'bootloader' and d['n_flash'] > 0:
+                self._schedule(name, 'offline', 'app')
+
+    def flash(self, port, firmware_version):
+        """
+        Called by the fake bossac. Returns True if the device took the new firmware
+        """
+        name = self.find_device_by_port(port)
+        if name is None or self.get_device(name)['mode'] != 'bootloader':
+            return False
+        if self.rng.random() < self.config['flash_fail']:
+            return False
+        d = self.get_device(name)
+        self.update_device(name, firmware_version=firmware_version, n_flash=d['n_flash'] + 1, encoder_calibration=None)
+        self._schedule(name, 'offline', 'app')
+        return True
+
+    def find_tty_devices(self):
+        """
+        Same form as hello_device_utils.find_tty_devices()
+        """
+        out = {}
+        for i, (name, d) in enumerate(sorted(self.get_devices().items())):
+            if d['mode'] == 'offline':
+                continue
+            app = d['mode'] == 'app'
+            out[os.path.join(self.dev_dir, d['port'])] = {'serial': d['serial_no'] if app else None,
+                                                         'vendor': 'Hello_Robot' if app else 'Arduino_LLC',
+                                                         'vendor_id': '2341',
+                                                         'model': 'Hello_' + get_board(name) if app else 'Arduino_Zero',
+                                                         'model_id': '804d' if app else '004d',
+                                                         'path': '/devices/sim/usb1/1-%d' % (i + 1)}
+        return out
+
+    def reset(self):
+        with self._state() as s:
+            s.clear()
+            s.update(self._initial_state())
+        self.sync()
+
+
+def _reconcile(bus):
+    while True:
+        try:
+            bus.sync()
+        except (IOError, OSError, yaml.YAMLError):
+            pass
+        time.sleep(0.02)
+
+
+def get_bus():
+    """
+    The bus for this process. Starts the thread that applies delayed transitions.
+    """
+    global _bus
+    with _bus_lock:
+        if _bus is None:
+            _bus = SimBus()
+            threading.Thread(target=_reconcile, args=(_bus,), daemon=True).start()
+        return _bus
+
+
+# ########################### Transport ##################################
+
+class SimSerial:
+    def __init__(self):
+        self.is_open = True
+
+    def close(self):
+        self.is_open = False
+
+
+class SimTransport:
+    """
+    Round trip of an RPC with configurable latency, jitter and loss
+    """
+
+    def __init__(self, name, config, rng):
+        self.name = name
+        self.config = config
+        self.rng = rng
+        self.ser = SimSerial()
+        self.status = {'n_rpc': 0, 'n_lost': 0, 'rpc_time_s': 0.0}
+
+    def do_rpc(self, nbytes=0):
+        ts = time.time()
+        self.status['n_rpc'] = self.status['n_rpc'] + 1
+        if self.rng.random() < self.config['loss']:
+            time.sleep(self.config['timeout_s'])
+            self.status['n_lost'] = self.status['n_lost'] + 1
+            ok = False
+        else:
+            time.sleep(self.config['latency_s'] + abs(self.rng.gauss(0, self.config['jitter_s'])) + nbytes * self.config['byte_time_s'])
+            ok = True
+        self.status['rpc_time_s'] = self.status['rpc_time_s'] + time.time() - ts
+        return ok
+
+    def do_push_rpc_sync(self, payload=None, reply_callback=None):
+        return self.do_rpc(len(payload) if payload is not None else 0)
+
+    def do_pull_rpc_sync(self, payload=None, reply_callback=None):
+        return self.do_rpc(len(payload) if payload is not None else 0)
+
+
+# ########################### Devices ##################################
+
+class SimDevice:
+    """
+    Stand-in for the stretch_body Stepper / Pimu / Wacc of a device on the sim bus
+    """
+
+    def __init__(self, name):
+        self.name = name
+        self.config = get_config()
+        self.bus = get_bus()
+        self.usb = os.path.join(self.bus.dev_dir, name)
+        self.board = get_board(name)
+        self.rng = random.Random(self.config['seed'])
+        self.transport = SimTransport(name, self.config, self.rng)
+        self.supported_protocols = {p: None for p in self.config['supported_protocols'].get(self.board, [])}
+        self.board_info = {'board_variant': None, 'firmware_version': None, 'protocol_version': None, 'hardware_id': 0}
+        self.hw_valid = False
+        self.status = {}
+        self.load_test_payload = arr.array('B', range(256)) * 4
+        self._reset_pending = False
+
+    def identify(self):
+        """
+        Board info RPC only, as with firmware_utils.identify_device
+        """
+        if not os.path.exists(self.usb):
+            print('Port %s not available' % self.usb)
+            return False
+        d = self.bus.get_device(self.name)
+        if d is None or d['mode'] != 'app' or not self.transport.do_rpc():
+            return False
+        v = FirmwareVersion(d['firmware_version'])
+        self.board_info = {'board_variant': '%s.%d' % (self.board, 1), 'firmware_version': d['firmware_version'],
+                           'protocol_version': 'p%d' % v.protocol, 'hardware_id': 1}
+        if self.board == 'Stepper' and v.protocol >= 5:
+            self.board_info['stepper_type'] = d['stepper_type']
+        return True
+
+    def startup(self, threaded=False):
+        if not self.identify():
+            return False
+        self.hw_valid = self.board_info['protocol_version'] in self.supported_protocols
+        if not self.hw_valid:
+            print('Firmware protocol mismatch on %s. Protocol on board is %s.' % (self.name, self.board_info['protocol_version']))
+            return False
+        self.pull_status()
+        return True
+
+    def stop(self):
+        self.hw_valid = False
+        self.transport.ser.close()
+
+    def update_status(self):
+        pass
+
+    def pull_status(self):
+        if self.hw_valid and self.transport.do_rpc():
+            self.update_status()
+
+    def push_command(self):
+        if not self.hw_valid:
+            return
+        self.transport.do_rpc()
+        if self._reset_pending:
+            self._reset_pending = False
+            self.hw_valid = False
+            self.bus.reset_board(self.name)
+
+    def board_reset(self):
+        self._reset_pending = True
+
+    def push_load_test(self):
+        if self.hw_valid:
+            self.transport.do_rpc(len(self.load_test_payload) + 1)
+
+    def pull_load_test(self):
+        if self.hw_valid:
+            self.transport.do_rpc(1024 + 1)  # The firmware always replies with its full buffer
+
+
+class SimStepper(SimDevice):
+    def __init__(self, name):
+        SimDevice.__init__(self, name)
+        self.status = {'pos': 0.0, 'vel': 0.0, 'effort_pct': 0.0, 'current': 0.0, 'pos_calibrated': True,
+                       'runstop_on': False, 'is_moving': False, 'in_guarded_event': False, 'in_safety_event': False}
+        self.gains = {}
+
+    def update_status(self):
+        self.status['current'] = self.status['effort_pct'] * 0.03
+
+    def enable_safety(self):
+        self.status['in_safety_event'] = True
+
+    def set_command(self, mode=None, x_des=None, v_des=None, a_des=None, i_des=None, stiffness=None, i_feedforward=None,
+                    i_contact_pos=None, i_contact_neg=None):
+        pass
+
+    def enable_pos_traj_incr(self):
+        self.set_command(x_des=0)
+
+    def disable_sync_mode(self):
+        pass
+
+    def enable_sync_mode(self):
+        pass
+
+    def disable_guarded_mode(self):
+        pass
+
+    def enable_guarded_mode(self):
+        pass
+
+    def write_gains_to_flash(self):
+        self.transport.do_rpc()
+
+    def read_encoder_calibration_from_YAML(self):
+        return [0.0] * 16384
+
+    def read_encoder_calibration_from_flash(self):
+        n = self.bus.get_device(self.name)['encoder_calibration']  # Only the length is kept on the bus
+        return [0.0] * n if n is not None else []
+
+    def write_encoder_calibration_to_flash(self, data):
+        for i in range(0, len(data), 512):  # Pages, as the real stepper writes them
+            self.transport.do_rpc()
+        self.bus.update_device(self.name, encoder_calibration=len(data))
+
+    def write_stepper_type_to_flash(self, type):
+        self.transport.do_rpc()
+        self.bus.update_device(self.name, stepper_type=type)
+
+
+class SimPimu(SimDevice):
+    def __init__(self, name='hello-pimu'):
+        SimDevice.__init__(self, name)
+        self.status = {'voltage': self.config['battery_voltage'], 'current': 2.0, 'temp': 30.0, 'cpu_temp': 50.0,
+                       'runstop_event': False, 'bump_event_cnt': 0, 'at_cliff': [False] * 4}
+
+    def update_status(self):
+        self.status['voltage'] = self.config['battery_voltage'] + self.rng.gauss(0, 0.02)
+
+    def set_fan_on(self):
+        pass
+
+    def set_fan_off(self):
+        pass
+
+
+class SimWacc(SimDevice):
+    def __init__(self, name='hello-wacc'):
+        SimDevice.__init__(self, name)
+        self.status = {'ax': 0.0, 'ay': 0.0, 'az': 9.8, 'a0': 0, 'd0': 0, 'd1': 0, 'd2': 0, 'd3': 0}
+
+    def set_D2(self, on):
+        self.status['d2'] = on
+
+    def set_D3(self, on):
+        self.status['d3'] = on
+
+
+class SimDynamixel:
+    """
+    A Dynamixel servo on a simulated U2D2 chain. Positions track commands immediately.
+    """
+
+    def __init__(self, name, dxl_id=None):
+        self.name = name
+        self.config = get_config()
+        self.dxl_id = self.config['dynamixels'].get(name, 1) if dxl_id is None else dxl_id
+        self.rng = random.Random(self.config['seed'])
+        self.transport = SimTransport(name, self.config, self.rng)
+        self.hw_valid = False
+        self.status = {'pos': 0.0, 'vel': 0.0, 'effort': 0.0, 'temp': 35.0, 'id': self.dxl_id}
+        self._goal = 0.0
+
+    def startup(self, threaded=False):
+        self.hw_valid = self.do_ping()
+        return self.hw_valid
+
+    def stop(self):
+        self.hw_valid = False
+
+    def do_ping(self, verbose=False):
+        return self.transport.do_rpc()
+
+    def move_to(self, x_r, v_r=None, a_r=None):
+        if self.transport.do_rpc():
+            self._goal = x_r
+
+    def move_by(self, x_r, v_r=None, a_r=None):
+        self.move_to(self._goal + x_r, v_r, a_r)
+
+    def pull_status(self):
+        if self.transport.do_rpc():
+            self.status['pos'] = self._goal
+
+
+class SimDynamixelGroup:
+    """
+    Stand-in for a DynamixelXChain (eg, Head or EndOfArm)
+    """
+
+    def __init__(self, name, motor_names):
+        self.name = name
+        self.motors = {m: SimDynamixel(m) for m in motor_names}
+
+    def startup(self, threaded=False):
+        return all([m.startup() for m in self.motors.values()])
+
+    def stop(self):
+        for m in self.motors.values():
+            m.stop()
+
+    def pull_status(self):
+        for m in self.motors.values():
+            m.pull_status()
+
+
+class SimPrismaticJoint:
+    """
+    Stand-in for stretch_body Arm / Lift when following a waypoint trajectory.
+    Effort is modeled as proportional to the commanded acceleration and velocity plus noise,
+    and the position lags the trajectory in proportion to the commanded acceleration.
+    """
+
+    def __init__(self, name):
+        from stretch_body.trajectories import PrismaticTrajectory
+        self.name = name
+        self.config = get_config()
+        self.joint_config = self.config['joints'][name]
+        self.motor = SimStepper('hello-motor-' + name)
+        self.rng = random.Random(self.config['seed'])
+        self.trajectory = PrismaticTrajectory()
+        self.params = {'range_m': list(self.joint_config['range_m']),
+                       'motion': {'trajectory_max': {'vel_m': 0.4, 'accel_m': 0.4}}}
+        self.status = {'pos': self.params['range_m'][0], 'vel': 0.0}
+        self._traj_ts = None
+        self._traj_duration = 0.0
+
+    def startup(self, threaded=False):
+        return self.motor.startup(threaded=threaded)
+
+    def stop(self):
+        self.motor.stop()
+
+    def push_command(self):
+        self.motor.push_command()
+
+    def pull_status(self):
+        self.motor.pull_status()
+        if self._traj_ts is None:
+            return
+        t = time.time() - self._traj_ts
+        x, v, a = [0.0 if e is None else e for e in self.trajectory.evaluate_at(min(t, self._traj_duration))]
+        if t > self._traj_duration:
+            v, a = 0.0, 0.0
+        c = self.joint_config
+        self.status['pos'] = x - self.config['tracking_lag_s2'] * a
+        self.status['vel'] = v
+        self.motor.status['pos'] = self.status['pos']
+        self.motor.status['vel'] = v
+        self.motor.status['effort_pct'] = c['effort_pct_bias'] + c['effort_pct_per_accel'] * a + c['effort_pct_per_vel'] * v + \
+                                          self.rng.gauss(0, self.config['effort_noise_pct'])
+        self.motor.status['current'] = self.motor.status['effort_pct'] * 0.03
+
+    def follow_trajectory(self, move_to_start_point=True, **kwargs):
+        if len(self.trajectory.waypoints) < 2 or not self.motor.hw_valid:
+            return False
+        self.motor.status['in_safety_event'] = False
+        if move_to_start_point:
+            self.status['pos'] = self.trajectory.waypoints[0].position
+        self._traj_ts = time.time()
+        self._traj_duration = self.trajectory.waypoints[-1].time
+        return True
+
+    def update_trajectory(self):
+        self.motor.transport.do_rpc()
+
+    def is_trajectory_active(self):
+        return self._traj_ts is not None and not self.motor.status['in_safety_event'] and \
+               time.time() - self._traj_ts <= self._traj_duration
+
+    def stop_trajectory(self):
+        self._traj_ts = None
+
+    def wait_until_at_setpoint(self, timeout=15.0):
+        return True
+
+    def move_to(self, x_m, v_m=None, a_m=None):
+        self.status['pos'] = x_m
+
+    def move_by(self, x_m, v_m=None, a_m=None):
+        self.status['pos'] = self.status['pos'] + x_m
+
+    def write_configuration_param_to_YAML(self, param_name, value, fleet_dir=None, force_creation=False):
+        """
+        Params are written to <sim_dir>/stretch_configuration_params.yaml rather than the fleet directory
+        """
+        fn = os.path.join(self.config['sim_dir'], 'stretch_configuration_params.yaml')
+        try:
+            with open(fn, 'r') as s:
+                p = yaml.safe_load(s) or {}
+        except IOError:
+            p = {}
+        d = p
+        keys = param_name.split('.')
+        for k in keys[:-1]:
+            d = d.setdefault(k, {})
+        d[keys[-1]] = float(value) if isinstance(value, (int, float)) else value
+        with open(fn, 'w') as s:
+            yaml.dump(p, s)
+
+
+def make_prismatic_joint(name):
+    """
+    A SimPrismaticJoint that is also an instance of stretch_body Arm / Lift, so that
+    tools which dispatch on the joint class work unchanged
+    """
+    from stretch_body.arm import Arm
+    from stretch_body.lift import Lift
+    base = {'arm': Arm, 'lift': Lift}[name]
+    return type('Sim' + base.__name__, (SimPrismaticJoint, base), {})(name)
+
+
+class SimBase:
+    """
+    Stand-in for stretch_body Base, driving a pair of simulated wheel steppers
+    """
+
+    def __init__(self):
+        self.name = 'base'
+        self.left_wheel = SimStepper('hello-motor-left-wheel')
+        self.right_wheel = SimStepper('hello-motor-right-wheel')
+        self.status = {'x': 0.0, 'y': 0.0, 'theta': 0.0, 'x_vel': 0.0, 'y_vel': 0.0, 'theta_vel': 0.0,
+                       'left_wheel': self.left_wheel.status, 'right_wheel': self.right_wheel.status}
+
+    def startup(self, threaded=False):
+        return self.left_wheel.startup(threaded) and self.right_wheel.startup(threaded)
+
+    def stop(self):
+        self.left_wheel.stop()
+        self.right_wheel.stop()
+
+    def translate_by(self, x_m, v_m=None, a_m=None, stiffness=None, contact_thresh_N=None, contact_thresh=None):
+        self.status['x'] = self.status['x'] + x_m
+
+    def rotate_by(self, x_r, v_r=None, a_r=None, stiffness=None, contact_thresh_N=None, contact_thresh=None):
+        self.status['theta'] = self.status['theta'] + x_r
+
+    def push_command(self):
+        self.left_wheel.push_command()
+        self.right_wheel.push_command()
+
+    def pull_status(self):
+        self.left_wheel.pull_status()
+        self.right_wheel.pull_status()
+
+
+def make_device(device_name):
+    board = get_board(device_name)
+    if board == 'Stepper':
+        return SimStepper(device_name)
+    if board == 'Pimu':
+        return SimPimu(device_name)
+    if board == 'Wacc':
+        return SimWacc(device_name)
+    return SimDynamixel(device_name)
+
+
+# ########################### Firmware repo ##################################
+
+def _write_common_h(repo_path, tag):
+    v = FirmwareVersion(tag)
+    d = os.path.join(repo_path, 'arduino', get_sketch(v.device))
+    os.makedirs(d, exist_ok=True)
+    with open(os.path.join(d, 'Common.h'), 'w') as f:
+        f.write('#define FIRMWARE_VERSION "%s"\n' % tag)
+    with open(os.path.join(d, get_sketch(v.device) + '.ino'), 'w') as f:
+        f.write('#include "Common.h"\n')
+
+
+def get_firmware_repo():
+    """
+    A local stand-in for the stretch_firmware repo with a commit and tag for each of config['tags']
+    """
+    import git
+    path = os.path.join(get_sim_dir(), 'stretch_firmware')
+    tags = get_config()['tags']
+    if os.path.isdir(path):
+        if sorted([t.name for t in git.Repo(path).tags]) == sorted(tags):
+            return path
+        shutil.rmtree(path)
+    repo = git.Repo.init(path, initial_branch='master')
+    with repo.config_writer() as cw:
+        cw.set_value('user', 'name', 'sim')
+        cw.set_value('user', 'email', 'sim@localhost')
+    first = {}
+    for t in tags:  # Every sketch is present from the first commit, at its family's first tag
+        first.setdefault(FirmwareVersion(t).device, t)
+    for t in first.values():
+        _write_common_h(path, t)
+    repo.git.add('-A')
+    repo.index.commit('Initial sim firmware')
+    for t in first.values():
+        repo.create_tag(t)
+    for t in tags:
+        if t not in first.values():
+            _write_common_h(path, t)
+            repo.git.add('-A')
+            repo.index.commit(t)
+            repo.create_tag(t)
+    return path
@@ -128,11 +128,7 @@ def get_hello_ttyACMx_mapping():
     return mapping
 
 def is_device_present(device):
-    try:
-        exec_process(['ls', device], True)
-        return True
-    except RuntimeError as e:
-        return False
+    return os.path.exists(device)
 
 
 def find_steppers_on_bus():
@@ -253,7 +249,13 @@ def find_ftdi_port():
 
 # ###################################
 
-def create_arduinocli_config_file(firmware_path):
+def create_arduinocli_config_file(firmware_path, config_file=None):
+    """
+    Write an arduino-cli config whose user directory is firmware_path/arduino.
+    It's written to firmware_path/arduino-cli.yaml unless config_file is given. Returns the config file.
+    """
+    if config_file is None:
+        config_file = firmware_path + '/arduino-cli.yaml'
     arduino_config = {'board_manager': {'additional_urls': []},
                         'daemon': {'port': '50051'},
                         'directories': {'data': os.environ['HOME'] + '/.arduino15',
@@ -264,9 +266,9 @@ def create_arduinocli_config_file(firmware_path):
                         'metrics': {'addr': ':9090', 'enabled': True},
                         'sketch': {'always_export_binaries': False},
                         'telemetry': {'addr': ':9090', 'enabled': True}}
-    with open(firmware_path + '/arduino-cli.yaml', 'w') as yaml_file:
+    with open(config_file, 'w') as yaml_file:
         yaml.dump(arduino_config, yaml_file, default_flow_style=False)
-    return firmware_path + '/arduino-cli.yaml'
+    return config_file
 
 def compile_arduino_firmware(sketch_name, repo_path, config_file=None):
     """
@@ -539,28 +541,79 @@ def assign_dynamixel_to_robot(device_name, robot_sn=None):
     return {'success': 0, 'sn': None}
 
 
-def find_tty_devices():
+TTY_DEVICE_CACHE_TTL = 2.0  # seconds
+_tty_device_cache = {'ts': 0, 'nodes': None, 'devices': {}}
+
+
+def invalidate_tty_device_cache():
+    """
+    Force the next find_tty_devices() to rescan. Call after anything that re-enumerates a device
+    """
+    _tty_device_cache['nodes'] = None
+
+
+def _get_tty_nodes():
+    # Identify each node by inode and ctime as well as name so that a device which drops off and
+    # re-enumerates under the same ttyACMx name (eg, into its bootloader) is seen as a change
+    nodes = []
+    for d in sorted(glob.glob('/dev/ttyACM*')) + sorted(glob.glob('/dev/ttyUSB*')):
+        try:
+            st = os.stat(d)
+            nodes.append((d, st.st_ino, st.st_ctime, st.st_rdev))
+        except OSError:
+            pass
+    return nodes
+
+
+def get_udev_properties(dev_node):
+    """
+    Returns a dictionary of all udev properties for a /dev node (eg, {'ID_MODEL':'Arduino_Zero',...})
+    Reads the udev database directly, only falling back to a single udevadm call if that is not available
+    """
+    props = {}
+    try:
+        rdev = os.stat(dev_node).st_rdev
+        with open('/run/udev/data/c%d:%d' % (os.major(rdev), os.minor(rdev)), 'r') as f:
+            for line in f:
+                if line.startswith('E:') and '=' in line:
+                    k, v = line[2:].rstrip('\n').split('=', 1)
+                    props[k] = v
+        props['DEVPATH'] = os.path.realpath('/sys/dev/char/%d:%d' % (os.major(rdev), os.minor(rdev)))[len('/sys'):]
+    except (OSError, IOError):
+        props = {}
+    if 'ID_MODEL' not in props:
+        try:
+            out = exec_process([b'udevadm', b'info', b'-n', bytes(dev_node[5:], 'utf-8')], True)
+        except RuntimeError:
+            return props
+        for a in out.decode(encoding='UTF-8').split('\n'):
+            if a.startswith('E: ') and '=' in a:
+                k, v = a[3:].split('=', 1)
+                props[k] = v
+    return props
+
+
+def find_tty_devices(use_cache=True):
     """
     Returns a dictionary of USB device details of tty class in the ttyUSB* and ttyACM* namespace.
+    Results are cached for TTY_DEVICE_CACHE_TTL seconds, or until a node is added, removed or re-enumerated.
     """
-    devices_dict = {}
-    ttyUSB_dev_list = glob.glob('/dev/ttyUSB*')
-    ttyACM_dev_list = glob.glob('/dev/ttyACM*')
-    for d in ttyACM_dev_list:
-        devices_dict[d] = {"serial": extract_udevadm_info(d, 'ID_SERIAL_SHORT'),
-                           "vendor": extract_udevadm_info(d, 'ID_VENDOR'),
-                           "vendor_id": extract_udevadm_info(d, 'ID_VENDOR_ID'),
-                           "model": extract_udevadm_info(d, 'ID_MODEL'),
-                           "model_id": extract_udevadm_info(d, 'ID_MODEL_ID'),
-                           "path": extract_udevadm_info(d, 'DEVPATH')}
-    for d in ttyUSB_dev_list:
-        devices_dict[d] = {"serial": extract_udevadm_info(d, 'ID_SERIAL_SHORT'),
-                           "vendor": extract_udevadm_info(d, 'ID_VENDOR'),
-                           "vendor_id": extract_udevadm_info(d, 'ID_VENDOR_ID'),
-                           "model": extract_udevadm_info(d, 'ID_MODEL'),
-                           "model_id": extract_udevadm_info(d, 'ID_MODEL_ID'),
-                           "path": extract_udevadm_info(d, 'DEVPATH')}
-    return devices_dict
+    nodes = _get_tty_nodes()
+    c = _tty_device_cache
+    if not use_cache or c['nodes'] != nodes or time.time() - c['ts'] > TTY_DEVICE_CACHE_TTL:
+        devices_dict = {}
+        for n in nodes:
+            p = get_udev_properties(n[0])
+            devices_dict[n[0]] = {"serial": p.get('ID_SERIAL_SHORT'),
+                                  "vendor": p.get('ID_VENDOR'),
+                                  "vendor_id": p.get('ID_VENDOR_ID'),
+                                  "model": p.get('ID_MODEL'),
+                                  "model_id": p.get('ID_MODEL_ID'),
+                                  "path": p.get('DEVPATH')}
+        c['devices'] = devices_dict
+        c['nodes'] = nodes
+        c['ts'] = time.time()
+    return {k: dict(v) for k, v in c['devices'].items()}
 
 
 def extract_udevadm_info(usb_port, ID_NAME=None):
@@ -574,14 +627,7 @@ def extract_udevadm_info(usb_port, ID_NAME=None):
     ID_VENDOR_FROM_DATABASE
     ID_VENDOR
     """
-    value = None
-    dname = bytes(usb_port[5:], 'utf-8')
-    out = exec_process([b'udevadm', b'info', b'-n', dname], True)
     if ID_NAME is None:
-        value = out.decode(encoding='UTF-8')
-    else:
-        for a in out.split(b'\n'):
-            a = a.decode(encoding='UTF-8')
-            if "{}=".format(ID_NAME) in a:
-                value = a.split('=')[-1]
-    return value
+        dname = bytes(usb_port[5:], 'utf-8')
+        return exec_process([b'udevadm', b'info', b'-n', dname], True).decode(encoding='UTF-8')
+    return get_udev_properties(usb_port).get(ID_NAME)
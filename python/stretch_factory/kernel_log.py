@@ -0,0 +1,164 @@
+import collections
+import os
+import select
+import subprocess
+import threading
+
+FILTERS = {'usb': ['usb'],
+           'uvc': ['uvc'],
+           'hid': ['hid', 'input'],
+           'tty': ['tty', 'cdc_acm', 'ftdi']}
+
+
+class KernelLogFollower:
+    """
+    Follow new kernel log messages from a background thread without clearing the ring buffer
+    (unlike 'dmesg -c', other tools still see every message).
+
+    Reads /dev/kmsg, starting at the end of the buffer, blocking until a record arrives. If /dev/kmsg
+    can't be read (eg, kernel.dmesg_restrict without root) it falls back to following 'sudo dmesg --follow'.
+
+    Messages are formatted as dmesg prints them, '[   12.345678] usb 1-2: new high-speed USB device...',
+    and kept in a ring buffer of at most maxlen lines.
+
+    Params
+    ------
+    filters = Only keep messages containing one of these substrings (case-insensitive). Names from FILTERS
+              (eg, ['usb','uvc']) expand to their substrings. None keeps everything.
+    maxlen = Size of the ring buffer
+    on_message = Optional callback(msg) called from the follower thread for each kept message
+    """
+
+    def __init__(self, filters=None, maxlen=10000, on_message=None):
+        self.filters = None
+        if filters is not None:
+            self.filters = []
+            for f in filters:
+                self.filters = self.filters + FILTERS.get(f, [f])
+            self.filters = [f.lower() for f in self.filters]
+        self.messages = collections.deque(maxlen=maxlen)
+        self.on_message = on_message
+        self.lock = threading.Lock()
+        self.thread = None
+        self.proc = None
+        self.source = None
+        self._stop = threading.Event()
+        self._started = threading.Event()
+
+    def matches(self, msg):
+        if self.filters is None:
+            return True
+        m = msg.lower()
+        for f in self.filters:
+            if f in m:
+                return True
+        return False
+
+    def _add(self, msg):
+        if len(msg) == 0 or not self.matches(msg):
+            return
+        with self.lock:
+            self.messages.append(msg)
+        if self.on_message is not None:
+            self.on_message(msg)
+
+    # ########################### Sources ##################################
+
+    def _open_kmsg(self):
+        try:
+            fd = os.open('/dev/kmsg', os.O_RDONLY | os.O_NONBLOCK)
+        except OSError:
+            return None
+        try:
+            os.lseek(fd, 0, os.SEEK_END)  # Skip messages already in the buffer
+            return fd
+        except OSError:
+            os.close(fd)
+            return None
+
+    def _follow_kmsg(self, fd):
+        # Each read returns exactly one record: 'pri,seq,ts_usec,flags;message\n[ KEY=value\n]...'
+        try:
+            while not self._stop.is_set():
+                r, _, _ = select.select([fd], [], [], 0.25)
+                if not r:
+                    continue
+                try:
+                    rec = os.read(fd, 8192).decode('utf-8', 'replace')
+                except BlockingIOError:
+                    continue
+                except BrokenPipeError:
+                    continue  # Records were overwritten before being read, carry on with the next
+                hdr, _, body = rec.partition(';')
+                try:
+                    ts_usec = int(hdr.split(',')[2])
+                except (IndexError, ValueError):
+                    continue
+                self._add('[%12.6f] %s' % (ts_usec / 1000000.0, body.split('\n')[0]))
+        finally:
+            os.close(fd)
+
+    def _follow_dmesg(self):
+        # The buffer is printed first, so drop anything stamped before we started
+        try:
+            with open('/proc/uptime', 'r') as f:
+                t_start = float(f.read().split()[0])
+        except (IOError, ValueError):
+            t_start = 0.0
+        try:
+            self.proc = subprocess.Popen(['sudo', 'dmesg', '--follow'], stdout=subprocess.PIPE, stderr=subprocess.DEVNULL)
+        except OSError:
+            return
+        for line in self.proc.stdout:
+            if self._stop.is_set():
+                break
+            line = line.decode('utf-8', 'replace').rstrip('\n')
+            try:
+                if float(line[1:line.index(']')]) < t_start:
+                    continue
+            except ValueError:
+                pass
+            self._add(line)
+
+    def _run(self):
+        fd = self._open_kmsg()
+        self.source = '/dev/kmsg' if fd is not None else 'dmesg --follow'
+        self._started.set()
+        if fd is not None:
+            self._follow_kmsg(fd)
+        else:
+            self._follow_dmesg()
+
+    # ########################### API ##################################
+
+    def start(self):
+        self._stop.clear()
+        self._started.clear()
+        self.thread = threading.Thread(target=self._run, daemon=True)
+        self.thread.start()
+        self._started.wait(1.0)
+
+    def stop(self):
+        self._stop.set()
+        if self.proc is not None:
+            try:
+                self.proc.terminate()
+            except OSError:
+                pass
+        if self.thread is not None:
+            self.thread.join(2.0)
+        self.thread = None
+        self.proc = None
+
+    def get_messages(self):
+        with self.lock:
+            return list(self.messages)
+
+    def get_latest(self):
+        with self.lock:
+            return self.messages[-1] if len(self.messages) else None
+
+    def clear(self):
+        # Clears our copy only, the kernel buffer is untouched
+        with self.lock:
+            self.messages.clear()
@@ -0,0 +1,133 @@
+"""
+Timing spans for multi-step procedures such as the firmware update state machine
+
+A span is a dict:
+    {'name': 'establish_comms', 'device': 'hello-motor-arm', 'parent': None, 'ts': 1700000000.12, 'dur_s': 0.8, 'ok': True}
+where parent is the name of the enclosing span of the same thread (None at the top level). Sleeps are recorded
+as spans named 'sleep' with a reason, so the time spent waiting can be told apart from the time spent working.
+
+Spans can be exported as plain JSON or as a Chrome trace (load in chrome://tracing or https://ui.perfetto.dev),
+with one row per device.
+"""
+
+import contextlib
+import json
+import threading
+import time
+from tabulate import tabulate
+
+
+class PhaseTimer():
+    """
+    Record spans into the list spans (eg, part of a state dict that is saved as YAML). Thread safe.
+    """
+    def __init__(self, spans=None, lock=None):
+        self.spans = [] if spans is None else spans
+        self.lock = threading.Lock() if lock is None else lock
+        self.local = threading.local()
+
+    def _get_stack(self):
+        if not hasattr(self.local, 'stack'):
+            self.local.stack = []
+        return self.local.stack
+
+    def add(self, name, device, ts, dur_s, parent=None, ok=True, **kwargs):
+        s = {'name': name, 'device': device, 'parent': parent, 'ts': ts, 'dur_s': dur_s, 'ok': ok}
+        s.update(kwargs)
+        with self.lock:
+            self.spans.append(s)
+        return s
+
+    @contextlib.contextmanager
+    def span(self, name, device=None, **kwargs):
+        """
+        Time the enclosed block. Yields a dict of extra fields for the span: set its 'ok' to record the outcome
+        of the block. The span is marked not ok if the block raises.
+        """
+        stack = self._get_stack()
+        parent = stack[-1] if len(stack) else None
+        stack.append(name)
+        info = {}
+        ts = time.time()
+        ok = False
+        try:
+            yield info
+            ok = bool(info.pop('ok', True))
+        finally:
+            stack.pop()
+            kwargs.update(info)
+            self.add(name, device, ts, time.time() - ts, parent, ok, **kwargs)
+
+    def sleep(self, seconds, device=None, reason=''):
+        with self.span('sleep', device, reason=reason):
+            time.sleep(seconds)
+
+    # ########################### Summary ##################################
+
+    def get_totals(self, device=None, top_level=True):
+        """
+        {name: total seconds} over the spans of device, of the top level spans only unless top_level is False
+        """
+        out = {}
+        with self.lock:
+            spans = list(self.spans)
+        for s in spans:
+            if s['device'] == device and (not top_level or s['parent'] is None):
+                out[s['name']] = out.get(s['name'], 0.0) + s['dur_s']
+        return out
+
+    def get_sleeps(self):
+        """
+        {reason: (count, total seconds)} of all sleeps
+        """
+        out = {}
+        with self.lock:
+            spans = [s for s in self.spans if s['name'] == 'sleep']
+        for s in spans:
+            n, t = out.get(s.get('reason', ''), (0, 0.0))
+            out[s.get('reason', '')] = (n + 1, t + s['dur_s'])
+        return out
+
+    def pretty_print(self, names, devices):
+        """
+        Table of the total time of the named top level spans for each device, followed by the sleeps
+        """
+        rows = []
+        for d in devices:
+            t = self.get_totals(d)
+            rows.append([d] + ['%.1f' % t[n] if n in t else '-' for n in names] + ['%.1f' % sum(t.values())])
+        print(tabulate(rows, headers=['DEVICE'] + [n.upper() for n in names] + ['TOTAL (S)']))
+        sleeps = self.get_sleeps()
+        if len(sleeps):
+            print('')
+            print(tabulate([[r, n, '%.1f' % t] for r, (n, t) in sorted(sleeps.items(), key=lambda x: -x[1][1])],
+                           headers=['SLEEP', 'COUNT', 'TOTAL (S)']))
+        print('')
+
+    # ########################### Export ##################################
+
+    def to_chrome_trace(self):
+        """
+        The spans in Chrome trace event format, one thread row per device
+        """
+        with self.lock:
+            spans = list(self.spans)
+        devices = sorted(set([s['device'] for s in spans if s['device'] is not None]))
+        tids = {None: 0}
+        tids.update({d: i + 1 for i, d in enumerate(devices)})
+        events = [{'name': 'thread_name', 'ph': 'M', 'pid': 1, 'tid': tid, 'args': {'name': d or 'host'}} for d, tid in tids.items()]
+        for s in spans:
+            args = {k: v for k, v in s.items() if k not in ('name', 'device', 'ts', 'dur_s')}
+            events.append({'name': s['name'] if s['name'] != 'sleep' else 'sleep: %s' % s.get('reason', ''),
+                           'cat': s['parent'] or 'phase', 'ph': 'X', 'pid': 1, 'tid': tids[s['device']],
+                           'ts': int(s['ts'] * 1e6), 'dur': int(s['dur_s'] * 1e6), 'args': args})
+        return {'traceEvents': events, 'displayTimeUnit': 'ms'}
+
+    def save(self, filename, format='chrome'):
+        if format == 'chrome':
+            data = self.to_chrome_trace()
+        else:
+            with self.lock:
+                data = {'spans': list(self.spans)}
+        with open(filename, 'w') as fh:
+            json.dump(data, fh, indent=1)
@@ -0,0 +1,221 @@
+import glob
+import os
+import numpy as np
+import yaml
+from yaml import CLoader as Loader
+import stretch_body.hello_utils as hu
+import stretch_factory.trace_columnar as tc
+
+
+class RobotTraceStore:
+    """
+    Access to the robot trace files written by stretch_body.robot_trace to log/trace
+
+    A sidecar index (.trace_index.yaml, hidden so RobotTrace.cleanup() doesn't see it) holds a summary of each file:
+    {'trace_stretch-se3-3001_20240101120000_00000.yaml': {'mtime': 1704110400.0, 'size': 30512, 'ts_start': 1704110380.1,
+                                                          'ts_end': 1704110399.9, 'n_samples': 100, 'fields': ['arm.pos', ...]}}
+    The index is updated incrementally: only files that are new or whose mtime/size changed are parsed.
+
+    Trace files converted to the columnar format (see trace_columnar) are used in place of their YAML
+    original, and their fields are memory-mapped on demand.
+    """
+    index_name = '.trace_index.yaml'
+    seg_thresh_s = 0.2  # Segment boundaries are defined as having a time gap of over 0.2s
+
+    def __init__(self, trace_directory=None):
+        self.trace_directory = trace_directory if trace_directory is not None else hu.get_stretch_directory() + 'log/trace'
+        self.index_filename = os.path.join(self.trace_directory, self.index_name)
+        self.index = None
+        self.yaml_cache = {}  # Parsed YAML trace files of the most recently read segment
+
+    # ########################### Index ##################################
+
+    def get_all_files_sorted(self):
+        # Retrieve sorted list of all trace files
+        # Sorted chronological (id 0 is oldest)
+        columnar = set(glob.glob(self.trace_directory + '/*' + tc.SUFFIX))
+        all_files = [f for f in glob.glob(self.trace_directory + '/*.yaml') if tc.columnar_name(f) not in columnar]
+        all_files = all_files + [f for f in columnar if tc.is_columnar_trace(f)]
+        all_files.sort()
+        return all_files
+
+    def get_file_stat(self, filename):
+        if filename.endswith(tc.SUFFIX):
+            return os.stat(os.path.join(filename, tc.HEADER_NAME))
+        return os.stat(filename)
+
+    def read_trace_file(self, filename):
+        """
+        Return the samples of a trace file as a chronological list of dicts
+        """
+        with open(filename, 'r') as s:
+            trace = yaml.load(s, Loader=Loader)
+        if not trace:
+            return []
+        x = list(trace.keys())
+        x.sort()  # Chronological list of samples eg [trace_0000, trace_0001,...], oldest ID 0
+        return [trace[xx] for xx in x]
+
+    def summarize_file(self, filename):
+        st = self.get_file_stat(filename)
+        if filename.endswith(tc.SUFFIX):
+            h = tc.ColumnarTrace(filename).header
+            return {'mtime': st.st_mtime, 'size': st.st_size, 'n_samples': h['n_samples'], 'ts_start': h.get('ts_start'),
+                    'ts_end': h.get('ts_end'), 'fields': sorted(h['fields'].keys())}
+        samples = self.read_trace_file(filename)
+        e = {'mtime': st.st_mtime, 'size': st.st_size, 'n_samples': len(samples), 'ts_start': None, 'ts_end': None, 'fields': []}
+        if len(samples):
+            e['ts_start'] = float(samples[0]['timestamp'])
+            e['ts_end'] = float(samples[-1]['timestamp'])
+            e['fields'] = sorted(samples[0].keys())
+        return e
+
+    def load_index(self):
+        try:
+            with open(self.index_filename, 'r') as s:
+                self.index = yaml.load(s, Loader=Loader)
+        except (IOError, yaml.YAMLError):
+            self.index = None
+        if not isinstance(self.index, dict):
+            self.index = {}
+        return self.index
+
+    def save_index(self):
+        tmp_filename = self.index_filename + '.tmp'
+        try:
+            with open(tmp_filename, 'w') as fh:
+                yaml.dump(self.index, fh, default_flow_style=False)
+            os.replace(tmp_filename, self.index_filename)
+        except IOError:
+            pass  # Read only trace directory, index will be rebuilt next time
+
+    def update_index(self):
+        """
+        Bring the index up to date with the trace directory and return it
+        """
+        if self.index is None:
+            self.load_index()
+        dirty = False
+        present = set()
+        for f in self.get_all_files_sorted():
+            fn = os.path.basename(f)
+            present.add(fn)
+            try:
+                st = self.get_file_stat(f)
+                e = self.index.get(fn)
+                if e is None or e['mtime'] != st.st_mtime or e['size'] != st.st_size:
+                    self.index[fn] = self.summarize_file(f)
+                    dirty = True
+            except (OSError, ValueError, yaml.YAMLError, KeyError, TypeError):
+                # Deleted by RobotTrace.cleanup() or partially written, skip it
+                if self.index.pop(fn, None) is not None:
+                    dirty = True
+        for fn in list(self.index.keys()):
+            if fn not in present:
+                self.index.pop(fn)
+                dirty = True
+        if dirty:
+            self.save_index()
+        return self.index
+
+    # ########################### Segments ##################################
+
+    def get_segments(self):
+        # Return a list of all segments found in the trace dir
+        # ID 0 is most recent, ID -1 is oldest
+        # A segment is a timespan of samples (that may bridge multiple files)
+        index = self.update_index()
+        segments = []
+        for fn in sorted(index.keys()):
+            e = index[fn]
+            if e['n_samples'] == 0:
+                continue
+            sub_seg = {'ts_start': e['ts_start'], 'ts_end': e['ts_end'], 'filename': [os.path.join(self.trace_directory, fn)],
+                       'n_samples': e['n_samples']}
+            # See if this extends current segment or is a new one
+            if len(segments) and sub_seg['ts_start'] - segments[-1]['ts_end'] < self.seg_thresh_s:
+                segments[-1]['ts_end'] = sub_seg['ts_end']
+                segments[-1]['filename'].append(sub_seg['filename'][0])
+                segments[-1]['n_samples'] += sub_seg['n_samples']
+            else:
+                segments.append(sub_seg)
+        segments.reverse()
+        return segments
+
+    def get_segment_for_range(self, ts_start=None, ts_end=None):
+        """
+        Return a segment spanning every file with samples between ts_start and ts_end (None for open ended)
+        or None if there are none. Unlike get_segments() it may bridge gaps.
+        """
+        index = self.update_index()
+        seg = None
+        for fn in sorted(index.keys()):
+            e = index[fn]
+            if e['n_samples'] == 0 or (ts_start is not None and e['ts_end'] < ts_start) or (ts_end is not None and e['ts_start'] > ts_end):
+                continue
+            if seg is None:
+                seg = {'ts_start': e['ts_start'], 'ts_end': e['ts_end'], 'filename': [], 'n_samples': 0}
+            seg['ts_end'] = e['ts_end']
+            seg['filename'].append(os.path.join(self.trace_directory, fn))
+            seg['n_samples'] += e['n_samples']
+        return seg
+
+    def get_fields(self, seg):
+        fields = set()
+        for f in seg['filename']:
+            e = self.index.get(os.path.basename(f)) if self.index is not None else None
+            if e is not None:
+                fields.update(e['fields'])
+        return sorted(fields)
+
+    def get_file_columns(self, filename):
+        """
+        Return a {field: array} like view of one trace file
+        """
+        if filename.endswith(tc.SUFFIX):
+            return tc.ColumnarTrace(filename)
+        if filename not in self.yaml_cache:
+            self.yaml_cache[filename] = tc.robot_samples_to_columns(self.read_trace_file(filename))
+        return self.yaml_cache[filename]
+
+    def get_columns(self, seg, fields=None):
+        """
+        Return a dict of {field: array} over the whole segment
+        Each array is allocated once at the segment length and filled in bulk per file
+        """
+        fields = self.get_fields(seg) if fields is None else fields
+        for f in [f for f in self.yaml_cache if f not in seg['filename']]:
+            self.yaml_cache.pop(f)
+        files = []
+        for f in seg['filename']:
+            cols = self.get_file_columns(f)
+            n = len(cols['timestamp']) if 'timestamp' in cols else max([len(cols[k]) for k in cols.keys()] + [0])
+            files.append((cols, n))
+        total = sum([n for cols, n in files])
+        data = {}
+        for k in fields:
+            dtype = next((cols[k].dtype for cols, n in files if k in cols), np.float64)
+            data[k] = np.empty(total, dtype=dtype)
+            i = 0
+            for cols, n in files:
+                if k in cols:
+                    data[k][i:i + n] = cols[k][:n]
+                else:
+                    data[k][i:i + n] = np.nan if data[k].dtype.kind == 'f' else ''  # Field not traced in this file
+                i = i + n
+        return data
+
+    def get_field(self, seg, field):
+        """
+        Return one field over the whole segment as an array
+        Only that field is read from columnar files, and a single columnar file is returned memory-mapped
+        """
+        if len(seg['filename']) == 1 and seg['filename'][0].endswith(tc.SUFFIX):
+            return self.get_file_columns(seg['filename'][0]).get(field)
+        return self.get_columns(seg, [field])[field]
+
+    def get_trace_data(self, seg):
+        """
+        Assemble a dict with each field of the segment as an array
+        """
+        return {'ts_start': seg['ts_start'], 'ts_end': seg['ts_end'], 'trace': self.get_columns(seg)}
@@ -0,0 +1,107 @@
+"""
+Fake arduino-cli and bossac for the simulated hardware (see hardware_sim.py)
+
+    python -m stretch_factory.sim_toolchain arduino-cli version
+    python -m stretch_factory.sim_toolchain arduino-cli compile --fqbn hello-robot:samd:hello_pimu <sketch_path> --export-binaries
+    python -m stretch_factory.sim_toolchain bossac -i -d --port=<port> -U true -i -e -w -v <binary> -R
+    python -m stretch_factory.sim_toolchain reset
+
+The compile writes a binary holding the sketch's FIRMWARE_VERSION. bossac installs that version on the
+device on the sim bus that is in its bootloader at <port>. reset returns the sim bus to its configured state.
+"""
+
+import os
+import sys
+import time
+import stretch_factory.hardware_sim as hsim
+
+ARDUINO_CLI_VERSION = '0.31.0'
+BINARY_MAGIC = b'STRETCH_SIM_FIRMWARE '
+
+
+def arduino_cli(argv):
+    if len(argv) and argv[0] == 'version':
+        print('arduino-cli  Version: %s Commit: 0000000 Date: 2023-01-01T00:00:00Z' % ARDUINO_CLI_VERSION)
+        return 0
+    if len(argv) and argv[0] == 'compile':
+        args = [a for a in argv[1:] if not a.startswith('-')]
+        fqbn = argv[argv.index('--fqbn') + 1] if '--fqbn' in argv else None
+        sketch_path = [a for a in args if a != fqbn and os.path.isdir(a)]
+        if not sketch_path:
+            print('Error: sketch not found')
+            return 1
+        sketch_path = sketch_path[-1].rstrip('/')
+        sketch = os.path.basename(sketch_path)
+        version = None
+        try:
+            with open(os.path.join(sketch_path, 'Common.h'), 'r') as f:
+                for l in f.readlines():
+                    if l.find('FIRMWARE_VERSION') >= 0:
+                        version = l[l.find('"') + 1:l.rfind('"')]
+        except IOError:
+            pass
+        if version is None:
+            print('Error: FIRMWARE_VERSION not found in %s' % sketch_path)
+            return 1
+        time.sleep(hsim.get_config()['compile_time_s'])
+        build = os.path.join(sketch_path, 'build', 'hello-robot.samd.%s' % sketch)
+        os.makedirs(build, exist_ok=True)
+        data = BINARY_MAGIC + version.encode('utf-8') + b'\n'
+        with open(os.path.join(build, sketch + '.ino.bin'), 'wb') as f:
+            f.write(data)
+        print('Sketch uses %d bytes (0%%) of program storage space. Maximum is 262144 bytes.' % len(data))
+        return 0
+    print('Error: unsupported arduino-cli command %s' % ' '.join(argv))
+    return 1
+
+
+def bossac(argv):
+    port = None
+    binary = None
+    for a in argv:
+        if a.startswith('--port='):
+            port = a[len('--port='):]
+        elif a.endswith('.bin'):
+            binary = a
+    if port is None or binary is None:
+        print('bossac: no port or binary given')
+        return 1
+    try:
+        with open(binary, 'rb') as f:
+            data = f.read()
+    except IOError:
+        print('bossac: unable to read %s' % binary)
+        return 1
+    if not data.startswith(BINARY_MAGIC):
+        print('bossac: not a sim firmware binary')
+        return 1
+    print('Write %d bytes to flash' % len(data))
+    time.sleep(hsim.get_config()['flash_time_s'])
+    if not hsim.SimBus().flash(port, data[len(BINARY_MAGIC):].decode('utf-8').strip()):
+        print('No device found on %s' % port)
+        return 1
+    print('Verify successful')
+    print('CPU reset.')
+    return 0
+
+
+def main(argv):
+    if len(argv) < 1:
+        print('Usage: sim_toolchain arduino-cli|bossac|reset ...')
+        return 1
+    if not hsim.enabled():
+        hsim.enable()
+    if argv[0] == 'arduino-cli':
+        return arduino_cli(argv[1:])
+    if argv[0] == 'bossac':
+        return bossac(argv[1:])
+    if argv[0] == 'reset':
+        hsim.SimBus().reset()
+        print('Reset sim bus at %s' % hsim.get_sim_dir())
+        return 0
+    print('Unknown command %s' % argv[0])
+    return 1
+
+
+if __name__ == '__main__':
+    sys.exit(main(sys.argv[1:]))
@@ -0,0 +1,172 @@
+"""
+Headless summary statistics for robot and firmware traces
+
+A report is a dict of the form:
+{'source': 'robot', 'n_samples': 36000, 'ts_start': 1704110380.1, 'ts_end': 1704114000.0, 'duration_s': 3619.9,
+ 'rate_hz': 9.94, 'active_rate_hz': 10.0, 'gaps': {'threshold_s': 0.2, 'n_gaps': 2, 'max_gap_s': 31.2, 'total_gap_s': 40.5},
+ 'fields': {'arm.pos': {'n': 36000, 'min': 0.01, 'max': 0.52, 'mean': 0.2, 'std': 0.1, 'p1': .., 'p5': .., 'p50': .., 'p95': .., 'p99': ..}}}
+"""
+
+import csv
+import json
+import os
+import time
+import warnings
+import numpy as np
+import yaml
+from yaml import CLoader as Loader
+import stretch_factory.trace_columnar as tc
+
+PERCENTILES = [1, 5, 50, 95, 99]
+
+
+def compute_field_stats(columns, timestamp_field='timestamp', gap_thresh_s=0.2):
+    """
+    Summarize a dict of {field: array}. All numeric fields are stacked and reduced in a single pass.
+    """
+    report = {'n_samples': 0, 'ts_start': None, 'ts_end': None, 'duration_s': None, 'rate_hz': None, 'gaps': None, 'fields': {}}
+    fields = sorted([k for k in columns.keys() if np.asarray(columns[k]).dtype.kind in 'fiub'])
+    if len(fields) == 0:
+        return report
+    n = min([len(columns[k]) for k in fields])
+    report['n_samples'] = n
+    if n == 0:
+        return report
+    x = np.empty((n, len(fields)), dtype=np.float64)
+    for i, k in enumerate(fields):
+        x[:, i] = columns[k][:n]
+    finite = np.isfinite(x)
+    counts = finite.sum(axis=0)
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', category=RuntimeWarning)  # All-NaN fields are reported as None
+        mins = np.nanmin(x, axis=0)
+        maxs = np.nanmax(x, axis=0)
+        means = np.nanmean(x, axis=0)
+        stds = np.nanstd(x, axis=0)
+        pct = np.nanpercentile(x, PERCENTILES, axis=0)
+    for i, k in enumerate(fields):
+        s = {'min': mins[i], 'max': maxs[i], 'mean': means[i], 'std': stds[i]}
+        for j, p in enumerate(PERCENTILES):
+            s['p%d' % p] = pct[j, i]
+        report['fields'][k] = {kk: (float(v) if np.isfinite(v) else None) for kk, v in s.items()}
+        report['fields'][k]['n'] = int(counts[i])
+
+    if timestamp_field in columns and n > 1:
+        ts = np.asarray(columns[timestamp_field][:n], dtype=np.float64)
+        dt = np.diff(ts)
+        report['ts_start'] = float(ts[0])
+        report['ts_end'] = float(ts[-1])
+        report['duration_s'] = float(ts[-1] - ts[0])
+        if report['duration_s'] > 0:
+            report['rate_hz'] = float((n - 1) / report['duration_s'])
+        if gap_thresh_s is not None:
+            g = dt[dt > gap_thresh_s]
+            report['gaps'] = {'threshold_s': gap_thresh_s, 'n_gaps': int(len(g)), 'max_gap_s': float(g.max()) if len(g) else 0.0,
+                              'total_gap_s': float(g.sum())}
+            active_s = report['duration_s'] - report['gaps']['total_gap_s']
+            report['active_rate_hz'] = float((n - 1 - len(g)) / active_s) if active_s > 0 else None  # Excluding gaps
+    return report
+
+
+# ########################### Loading ##################################
+
+def clip_columns(columns, ts_start=None, ts_end=None, timestamp_field='timestamp'):
+    if timestamp_field not in columns or (ts_start is None and ts_end is None):
+        return columns
+    ts = np.asarray(columns[timestamp_field])
+    m = np.ones(len(ts), dtype=bool)
+    if ts_start is not None:
+        m = m & (ts >= ts_start)
+    if ts_end is not None:
+        m = m & (ts <= ts_end)
+    return {k: np.asarray(v)[m] for k, v in columns.items()}
+
+
+def analyze_robot_traces(store, ts_start=None, ts_end=None, fields=None, gap_thresh_s=None):
+    """
+    Report on the robot trace samples between ts_start and ts_end (None for open ended)
+    """
+    seg = store.get_segment_for_range(ts_start, ts_end)
+    columns = {}
+    report = compute_field_stats(columns)
+    if seg is not None:
+        if fields is not None:
+            fields = sorted(set(fields) | {'timestamp'})
+        columns = clip_columns(store.get_columns(seg, fields), ts_start, ts_end)
+        report = compute_field_stats(columns, gap_thresh_s=gap_thresh_s if gap_thresh_s is not None else store.seg_thresh_s)
+        report['files'] = [os.path.basename(f) for f in seg['filename']]
+    report['source'] = 'robot'
+    return report, columns
+
+
+def load_firmware_trace_columns(filename):
+    if tc.is_columnar_trace(filename):
+        t = tc.ColumnarTrace(filename)
+        return t.header.get('trace_type'), {k: t[k] for k in t.keys()}
+    with open(filename, 'r') as s:
+        return tc.firmware_trace_to_columns(yaml.load(s, Loader=Loader) or [])
+
+
+def analyze_firmware_trace(filename, fields=None, gap_thresh_s=None):
+    tt, columns = load_firmware_trace_columns(filename)
+    if fields is not None:
+        columns = {k: v for k, v in columns.items() if k in fields or k == 'timestamp'}
+    report = compute_field_stats(columns, gap_thresh_s=gap_thresh_s)
+    report['source'] = 'firmware'
+    report['trace_type'] = tt
+    report['files'] = [os.path.basename(filename)]
+    return report, columns
+
+
+# ########################### Output ##################################
+
+def save_json(reports, filename, **meta):
+    out = {'generated': time.time(), 'reports': reports}
+    out.update(meta)
+    with open(filename, 'w') as fh:
+        json.dump(out, fh, indent=1)
+
+
+def save_csv(reports, filename):
+    with open(filename, 'w', newline='') as fh:
+        w = csv.writer(fh)
+        cols = ['n', 'min', 'max', 'mean', 'std'] + ['p%d' % p for p in PERCENTILES]
+        w.writerow(['name', 'source', 'field', 'rate_hz'] + cols)
+        for name in sorted(reports.keys()):
+            r = reports[name]
+            for k in sorted(r['fields'].keys()):
+                w.writerow([name, r['source'], k, r['rate_hz']] + [r['fields'][k][c] for c in cols])
+
+
+def save_plots(name, columns, out_dir, fields=None):
+    """
+    Write one PNG per numeric field against time (or sample). Uses the Agg backend so no display is needed.
+    """
+    import matplotlib
+    matplotlib.use('Agg')
+    import matplotlib.pyplot as plt
+    fields = sorted(columns.keys()) if fields is None else fields
+    if 'timestamp' in columns and len(columns['timestamp']):
+        xval = (np.asarray(columns['timestamp']) - columns['timestamp'][0]) / 60.0
+        xlabel = 'Time (m)'
+    else:
+        xval = None
+        xlabel = 'Sample'
+    written = []
+    for k in fields:
+        if k == 'timestamp' or k not in columns or np.asarray(columns[k]).dtype.kind not in 'fiub':
+            continue
+        fig, axes = plt.subplots(1, 1, figsize=(15.0, 8.0))
+        axes.set_title('%s | %s' % (name, k))
+        axes.set_xlabel(xlabel)
+        axes.set_ylabel(k.upper())
+        axes.grid(True)
+        if xval is not None:
+            axes.plot(xval, columns[k], 'b')
+        else:
+            axes.plot(columns[k], 'b')
+        fn = os.path.join(out_dir, '%s_%s.png' % (name, k.replace('/', '_')))
+        fig.savefig(fn)
+        plt.close(fig)
+        written.append(fn)
+    return written
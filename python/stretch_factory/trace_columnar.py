@@ -0,0 +1,154 @@
+"""
+Columnar on-disk format for robot and firmware traces
+
+A trace is a directory named <name>.trace holding one .npy array per field and a header.json:
+{'format': 'stretch_trace_columnar', 'version': 1, 'kind': 'robot', 'n_samples': 100,
+ 'ts_start': 1704110380.1, 'ts_end': 1704110399.9,
+ 'fields': {'arm.pos': {'file': 'f0001.npy', 'dtype': 'float64'}, ...}}
+Fields are memory-mapped on demand so that reading one field never touches the others.
+"""
+
+import json
+import os
+import shutil
+import numpy as np
+import yaml
+from yaml import CLoader as Loader
+
+FORMAT_NAME = 'stretch_trace_columnar'
+FORMAT_VERSION = 1
+SUFFIX = '.trace'
+HEADER_NAME = 'header.json'
+
+
+def is_columnar_trace(path):
+    return os.path.isfile(os.path.join(path, HEADER_NAME))
+
+
+def columnar_name(yaml_filename):
+    return os.path.splitext(yaml_filename)[0] + SUFFIX
+
+
+class ColumnarTrace:
+    """
+    Read access to a columnar trace directory
+    """
+    def __init__(self, path):
+        self.path = path
+        with open(os.path.join(path, HEADER_NAME), 'r') as fh:
+            self.header = json.load(fh)
+        if self.header.get('format') != FORMAT_NAME or self.header.get('version', 0) > FORMAT_VERSION:
+            raise ValueError('Unsupported trace format in %s' % path)
+        self.fields = sorted(self.header['fields'].keys())
+        self.n_samples = self.header['n_samples']
+
+    def __len__(self):
+        return self.n_samples
+
+    def __contains__(self, field):
+        return field in self.header['fields']
+
+    def keys(self):
+        return list(self.fields)
+
+    def get(self, field):
+        """
+        Return the field as a read-only memory-mapped array
+        """
+        return np.load(os.path.join(self.path, self.header['fields'][field]['file']), mmap_mode='r')
+
+    def __getitem__(self, field):
+        return self.get(field)
+
+
+def save_columnar_trace(path, columns, **meta):
+    """
+    Write a dict of {field: array-like} as a columnar trace, replacing any existing trace at path.
+    Written to a temporary directory first so a reader never sees a partial trace.
+    """
+    tmp_path = path + '.tmp'
+    shutil.rmtree(tmp_path, ignore_errors=True)
+    os.makedirs(tmp_path)
+    header = {'format': FORMAT_NAME, 'version': FORMAT_VERSION, 'n_samples': 0, 'fields': {}}
+    header.update(meta)
+    for i, k in enumerate(sorted(columns.keys())):
+        a = np.asarray(columns[k])
+        fn = 'f%04d.npy' % i
+        np.save(os.path.join(tmp_path, fn), a, allow_pickle=False)
+        header['fields'][k] = {'file': fn, 'dtype': str(a.dtype)}
+        header['n_samples'] = max(header['n_samples'], len(a))
+    if 'timestamp' in columns and len(columns['timestamp']):
+        header.setdefault('ts_start', float(columns['timestamp'][0]))
+        header.setdefault('ts_end', float(columns['timestamp'][-1]))
+    with open(os.path.join(tmp_path, HEADER_NAME), 'w') as fh:
+        json.dump(header, fh, indent=1)
+    shutil.rmtree(path, ignore_errors=True)
+    os.replace(tmp_path, path)
+    return path
+
+
+def _to_array(values):
+    """
+    Build a column from a list of values in a single pass
+    Numeric and bool fields become float64 (so can scope), anything else becomes a string column
+    """
+    try:
+        return np.fromiter(values, dtype=np.float64, count=len(values))
+    except (TypeError, ValueError):
+        return np.array([str(v) for v in values])
+
+
+# ########################### Robot traces ##################################
+
+def robot_samples_to_columns(samples):
+    """
+    Convert a chronological list of robot trace samples ({'timestamp':..,'pimu.voltage':..}) to a dict of arrays
+    """
+    if len(samples) == 0:
+        return {}
+    return {k: _to_array([s[k] for s in samples]) for k in samples[0].keys()}
+
+
+def convert_robot_trace_file(yaml_filename, out_path=None):
+    with open(yaml_filename, 'r') as s:
+        trace = yaml.load(s, Loader=Loader)
+    x = sorted(trace.keys()) if trace else []  # Chronological list of samples eg [trace_0000, trace_0001,...]
+    columns = robot_samples_to_columns([trace[xx] for xx in x])
+    out_path = out_path if out_path is not None else columnar_name(yaml_filename)
+    return save_columnar_trace(out_path, columns, kind='robot', source=os.path.basename(yaml_filename))
+
+
+# ########################### Firmware traces ##################################
+
+def get_firmware_trace_type(trace_data):
+    if len(trace_data) == 0:
+        return None
+    for tt in ['status', 'debug', 'print']:
+        if len(trace_data[0][tt]):
+            return tt
+    return None
+
+
+def firmware_trace_to_columns(trace_data):
+    """
+    Convert a firmware trace (list of {'status':{..},'debug':{..},'print':{..}}) to a dict of arrays
+    Returns the trace type and the columns of that type
+    """
+    tt = get_firmware_trace_type(trace_data)
+    if tt is None:
+        return None, {}
+    s0 = trace_data[0][tt]
+    return tt, {k: _to_array([t[tt][k] for t in trace_data]) for k in s0.keys() if type(s0[k]) in [int, float, bool, str]}
+
+
+def convert_firmware_trace_file(yaml_filename, out_path=None, device_name=None):
+    with open(yaml_filename, 'r') as s:
+        trace_data = yaml.load(s, Loader=Loader) or []
+    tt, columns = firmware_trace_to_columns(trace_data)
+    if device_name is None:
+        ll = os.path.basename(yaml_filename)
+        if ll.startswith('trace_fw_'):  # trace_fw_<device_name>_<time_string>.yaml
+            device_name = ll[9:].rsplit('_', 1)[0]
+    out_path = out_path if out_path is not None else columnar_name(yaml_filename)
+    return save_columnar_trace(out_path, columns, kind='firmware', trace_type=tt, device=device_name,
+                               source=os.path.basename(yaml_filename))
@@ -1,13 +1,20 @@
 #!/usr/bin/env python
 
+import array as arr
 import click
 from colorama import Style
 import glob
 import matplotlib.pyplot as plt
+import signal
+import sys
+import threading
+import time
 import stretch_body.hello_utils as hu
+import os
 from os import makedirs
 import yaml
 from yaml import CDumper as Dumper
+import stretch_factory.trace_columnar as tc
 
 class TraceMgmt:
     """
@@ -17,6 +24,8 @@ class TraceMgmt:
         self.device=device
         self.device_name = device.name
         self.trace_directory = hu.get_stretch_directory() + 'log/trace_firmware'
+        self.trace_columns=None
+        self.streamed_trace=None #(trace_data, filename) of the last trace streamed to disk
         try:
             makedirs(self.trace_directory)
         except OSError:
@@ -30,6 +39,8 @@ class TraceMgmt:
             print("Error Invalid Input")
 
     def get_trace_type(self,trace_data):
+        if isinstance(trace_data,tc.ColumnarTrace):
+            return trace_data.header['trace_type']
         if len(trace_data)==0:
             return None
         if len(trace_data[0]['status']):
@@ -46,7 +57,11 @@ class TraceMgmt:
             if len(trace_data):
                 tt=self.get_trace_type(trace_data)
                 msg = 'Current trace: Device %s | Type: %s: ' % (self.device_name, tt.upper())
-                if tt =='status' or tt=='print':
+                if isinstance(trace_data,tc.ColumnarTrace) and 'timestamp' in trace_data:
+                    ts=trace_data['timestamp']
+                    t0,t1=ts[0],ts[-1]
+                    msg = msg + '| Duration (s): %f | Start timestamp %f' % (t1 - t0, t0)
+                elif tt =='status' or tt=='print':
                     t0=trace_data[0][tt]['timestamp']
                     t1=trace_data[-1][tt]['timestamp']
                     msg =  msg+ '| Duration (s): %f | Start timestamp %f'%(t1-t0,t0)
@@ -60,6 +75,7 @@ class TraceMgmt:
             print('d: load trace from device')
             print('l: load trace from file')
             print('s: save trace to file')
+            print('c: save trace to file (columnar)')
             print('y: display trace data')
             print('x: print trace to console')
             print('q: quit')
@@ -76,10 +92,16 @@ class TraceMgmt:
                 trace_data=self.load_trace_from_file()
             elif r == 's':
                 self.save_trace(trace_data)
+            elif r == 'c':
+                self.save_trace(trace_data,columnar=True)
             elif r == 'y':
                 self.display_trace(trace_data)
             elif r== 'x':
-                print(trace_data)
+                if isinstance(trace_data,tc.ColumnarTrace):
+                    for k in trace_data.keys():
+                        print('%s: %s'%(k,list(trace_data[k])))
+                else:
+                    print(trace_data)
             else:
                 self.device.pull_status()
                 self.device.pretty_print()
@@ -97,15 +119,15 @@ class TraceMgmt:
         input("Hit enter to end recording")
         self.device.disable_firmware_trace()
         self.device.push_command()
-        print('Reading trace back from recording. This may take a minute...')
-        trace_data = self.device.read_firmware_trace()
+        print('Reading trace back from recording. Ctrl-C to stop early...')
+        trace_data = self.read_trace_streaming()
         if len(trace_data)==0:
             print('No trace data found for %s'%self.device_name)
         return trace_data
 
     def load_trace_from_file(self):
             # Retrieve sorted list of all trace files
-            all_files = glob.glob(self.trace_directory + '/*.yaml')
+            all_files = glob.glob(self.trace_directory + '/*.yaml')+glob.glob(self.trace_directory + '/*'+tc.SUFFIX)
             all_files.sort()
             if len(all_files):
                 print('--- Firmware Trace Files ---')
@@ -114,27 +136,110 @@ class TraceMgmt:
                 fn=all_files[self.get_int([0,len(all_files)-1],'FILE_ID')]
                 ll=fn[fn.find('trace_fw_')+9:]
                 device_name=ll[:ll.find('_')]
+                if fn.endswith(tc.SUFFIX):
+                    return tc.ColumnarTrace(fn) #Fields are memory-mapped when displayed
                 with open(fn, 'r') as s:
-                    return(yaml.load(s, Loader=yaml.FullLoader))
+                    return(yaml.load(s, Loader=yaml.FullLoader) or [])
             else:
                 print('No trace files available')
             return [],''
     def load_trace_from_device(self):
         print('')
-        print('Reading trace from device. This may take a minute...')
+        print('Reading trace from device. Ctrl-C to stop early...')
         print('')
-        trace_data = self.device.read_firmware_trace()
+        trace_data = self.read_trace_streaming()
         if len(trace_data)==0:
             print('No trace data found for %s'%self.device_name)
         return trace_data
 
-    def save_trace(self,trace_data):
+    def stream_firmware_trace(self,timeout=60.0,stop=None):
+        """
+        Generator that yields trace records as they are read back from the device
+        Mirrors device.read_firmware_trace() but hands over each record as soon as its RPC returns
+        """
+        if not hasattr(self.device,'RPC_READ_TRACE'):
+            for t in self.device.read_firmware_trace():
+                yield t
+            return
+        d=self.device
+        d.trace_buf = []
+        d.timestamp.reset() #Timestamp holds state, reset before reading back
+        d.n_trace_read=1
+        n=0
+        ts=time.time()
+        while d.n_trace_read and time.time()-ts<timeout and not (stop is not None and stop.is_set()):
+            payload = arr.array('B', [d.RPC_READ_TRACE])
+            d.transport.do_pull_rpc_sync(payload, d.rpc_read_firmware_trace_reply)
+            if len(d.trace_buf)<n: #Reply error, the device cleared the buffer
+                return
+            while n<len(d.trace_buf):
+                yield d.trace_buf[n]
+                n=n+1
+            time.sleep(.001)
+
+    def read_trace_streaming(self,save=True):
+        """
+        Read the trace back from the device, appending each record to disk as it arrives
+        Ctrl-C stops the readback and keeps the records read so far
+        """
+        trace_data=[]
+        fn=None
+        fh=None
+        if save:
+            fn = self.trace_directory + '/trace_fw_' + self.device_name + '_' + hu.create_time_string() + '.yaml'
+            fh=open(fn,'w')
+            fh.write('###%s###\n'%self.device_name)
+        stop=threading.Event()
+        try:
+            old_handler=signal.signal(signal.SIGINT, lambda signum,frame: stop.set()) #Don't interrupt an RPC mid transfer
+        except ValueError:
+            old_handler=None #Not on the main thread
+        ts=time.time()
+        t_last=ts
+        try:
+            for t in self.stream_firmware_trace(stop=stop):
+                trace_data.append(t)
+                if fh is not None:
+                    fh.write(yaml.dump([t], default_flow_style=False, Dumper=Dumper)) #Append-only, file is a valid YAML list after every record
+                if time.time()-t_last>0.5:
+                    t_last=time.time()
+                    if fh is not None:
+                        fh.flush()
+                    sys.stdout.write('\rRead %d records | %d remaining | %.0f records/s   '%(len(trace_data),self.device.n_trace_read if hasattr(self.device,'n_trace_read') else 0,len(trace_data)/(t_last-ts)))
+                    sys.stdout.flush()
+        finally:
+            if old_handler is not None:
+                signal.signal(signal.SIGINT, old_handler)
+            if fh is not None:
+                fh.close()
+        print(('\rRead %d records in %.1fs%s'%(len(trace_data),time.time()-ts,' (stopped early)' if stop.is_set() else '')).ljust(60))
+        if fn is not None:
+            if len(trace_data):
+                print('Saved trace: %s'%fn)
+                self.streamed_trace=(trace_data,fn)
+            else:
+                os.remove(fn)
+        return trace_data
+
+    def save_trace(self,trace_data,columnar=False):
+        if isinstance(trace_data,tc.ColumnarTrace):
+            print('Trace already saved: %s'%trace_data.path)
+            return
         if len(trace_data)==0:
             print('No trace data to save')
             return
+        if not columnar and self.streamed_trace is not None and self.streamed_trace[0] is trace_data:
+            print('Trace already saved: %s'%self.streamed_trace[1])
+            return
 
         time_string = hu.create_time_string()
         fn = self.trace_directory + '/trace_fw_' + self.device_name + '_' +time_string+'.yaml'
+        if columnar:
+            fn=tc.columnar_name(fn)
+            print('Creating trace: %s'%fn)
+            tt,columns=tc.firmware_trace_to_columns(trace_data)
+            tc.save_columnar_trace(fn,columns,kind='firmware',trace_type=tt,device=self.device_name)
+            return
         print('Creating trace: %s'%fn)
         with open(fn, 'w+') as fh:
             fh.write('###%s###\n'%self.device_name)
@@ -142,6 +247,9 @@ class TraceMgmt:
 
     def display_trace(self,trace_data):
         tt=self.get_trace_type(trace_data)
+        if isinstance(trace_data,tc.ColumnarTrace):
+            self.do_plot_columnar(trace_data)
+            return
         if tt=='status':
             self.do_plot_status(trace_data)
         if tt=='debug':
@@ -164,7 +272,7 @@ class TraceMgmt:
             plt.ion()  # enable interactivity
             fig, axes = plt.subplots(1, 1, figsize=(15.0, 8.0), sharex=True)
             if fig.canvas.manager is not None:
-                fig.canvas.manager.set_window_title('TRACE %s | %s' % (self.device_name.upper(), field_name.upper()))
+                fig.canvas.manager.set_window_title('TRACE %s | PRINT' % self.device_name.upper())
             axes.set_yscale('linear')
             axes.set_xlabel('Sample')
             axes.set_ylabel('X')
@@ -172,62 +280,43 @@ class TraceMgmt:
             axes.plot(data, 'b')
             fig.canvas.draw_idle()
 
-    def do_plot_debug(self,trace_data):
-        print(Style.BRIGHT + '############### Plotting Debug Trace: %s ################'%self.device_name.upper() + Style.RESET_ALL)
-        print('----- Trace Fields -----')
-        s0=trace_data[0]['debug']
-        kk=list(s0.keys())
-        if len(kk)==0:
-            print('No data available')
-            return
-        kk.sort()
-        field_keys=[]
-        for k in kk:
-            if type(s0[k])==int or type(s0[k])==float or type(s0[k])==bool:
-                field_keys.append(k)
-                print('%d: %s'%(len(field_keys)-1,str(k)))
-        print('')
-        field_name=field_keys[self.get_int([0,len(field_keys)-1],'FIELD ID')]
-        data=[]
-        for t in trace_data:
-            data.append(t['debug'][field_name])
-        print('---------- PLOT DATA ----------')
-        print(data)
-        print('')
+    def get_trace_columns(self,trace_data):
+        #Convert the per-sample trace to a dict of arrays once, reused across plots of the same trace
+        if self.trace_columns is None or self.trace_columns[0] is not trace_data:
+            self.trace_columns=(trace_data,tc.firmware_trace_to_columns(trace_data)[1])
+        return self.trace_columns[1]
 
-        plt.ion()  # enable interactivity
-        fig, axes = plt.subplots(1, 1, figsize=(15.0, 8.0), sharex=True)
-        if fig.canvas.manager is not None:
-            fig.canvas.manager.set_window_title('TRACE %s | %s' % (self.device_name.upper(), field_name.upper()))
-        axes.set_yscale('linear')
-        axes.set_xlabel('Sample')
-        axes.set_ylabel(field_name.upper())
-        axes.grid(True)
-        axes.plot(data, 'b')
-        fig.canvas.draw_idle()
+    def do_plot_debug(self,trace_data):
+        self.do_plot_fields('Debug',self.get_trace_columns(trace_data))
 
     def do_plot_status(self,trace_data):
-        print(Style.BRIGHT + '############### Plotting Status Trace: %s ################'%self.device_name.upper() + Style.RESET_ALL)
+        self.do_plot_fields('Status',self.get_trace_columns(trace_data))
+
+    def do_plot_columnar(self,trace_data):
+        self.do_plot_fields(str(self.get_trace_type(trace_data)).capitalize(),trace_data,print_data=False)
+
+    def do_plot_fields(self,trace_type,columns,print_data=True):
+        """
+        Plot one numeric field of a dict of arrays (or a ColumnarTrace, in which case only that field is read from disk)
+        """
+        print(Style.BRIGHT + '############### Plotting %s Trace: %s ################'%(trace_type,self.device_name.upper()) + Style.RESET_ALL)
         print('----- Trace Fields -----')
-        s0=trace_data[0]['status']
-        kk=list(s0.keys())
-        if len(kk)==0:
+        if isinstance(columns,tc.ColumnarTrace):
+            field_keys=[k for k in columns.keys() if columns.header['fields'][k]['dtype'].startswith('float')]
+        else:
+            field_keys=[k for k in sorted(columns.keys()) if columns[k].dtype.kind=='f']
+        if len(field_keys)==0:
             print('No data available')
             return
-        kk.sort()
-        field_keys=[]
-        for k in kk:
-            if type(s0[k])==int or type(s0[k])==float or type(s0[k])==bool:
-                field_keys.append(k)
-                print('%d: %s'%(len(field_keys)-1,str(k)))
+        for i in range(len(field_keys)):
+            print('%d: %s'%(i,str(field_keys[i])))
         print('')
         field_name=field_keys[self.get_int([0,len(field_keys)-1],'FIELD ID')]
-        data=[]
-        for t in trace_data:
-            data.append(t['status'][field_name])
-        print('---------- PLOT DATA ----------')
-        print(data)
-        print('')
+        data=columns[field_name]
+        if print_data:
+            print('---------- PLOT DATA ----------')
+            print(data.tolist())
+            print('')
 
         plt.ion()  # enable interactivity
         fig, axes = plt.subplots(1, 1, figsize=(15.0, 8.0), sharex=True)
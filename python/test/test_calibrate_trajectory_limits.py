@@ -1,9 +1,11 @@
+import copy
 import json
 import os
+import tempfile
 import unittest
 
 
-from python.tools.REx_calibrate_trajectory_limits import JointTypes, MotionProfileTypes, TrajectoryCalibrationData, save_calibrated_dynamic_limits_to_config
+from python.tools.REx_calibrate_trajectory_limits import JointTypes, MotionProfileTypes, MotionSamples, TrajectoryCalibrationData, save_calibrated_dynamic_limits_to_config, StepCalibrationResult, _CalibrationSession, _SpeedModel, _get_model_travel_duration
 
 test_dir = os.path.dirname(os.path.abspath(__file__))
 
@@ -22,3 +24,98 @@ class TestCalibrateTrajectoryLimits(unittest.TestCase):
         save_calibrated_dynamic_limits_to_config(joint=JointTypes.arm.get_joint_instance(), calibration_data=calibration_data, skip_confirm=True)
        
 
+    def test_motion_samples(self):
+        samples = MotionSamples(2)
+        for i in range(5):
+            samples.append(0.1 * i, float(i), 1.0, -float(i), 0.5)
+        self.assertEqual(len(samples), 5)
+        self.assertGreaterEqual(len(samples.data), 5)
+        self.assertEqual(samples.column("pos").tolist(), [0.0, 1.0, 2.0, 3.0, 4.0])
+        self.assertTrue(all(v != v for v in samples.column("pos_y")))  # Unset columns are NaN
+
+    def test_motion_data_cache(self):
+        with open(f"{test_dir}/stubs/calibrate_trajectory_limits/arm_positive_cubic.json", "r") as fp:
+            motion_data = TrajectoryCalibrationData.from_json(json.load(fp)).motion_data[0]
+        n = len(motion_data.samples)
+        self.assertEqual(len(motion_data.timestamps_during_motion), n)
+        effort_max = motion_data.effort_percent_max
+        motion_data.samples.append(motion_data.timestamps_during_motion[-1] + 0.1, 0.0, 0.0, effort_max + 10.0, 0.0)
+        self.assertEqual(len(motion_data.timestamps_during_motion), n + 1)
+        self.assertEqual(motion_data.effort_percent_max, round(effort_max + 10.0, 2))
+
+    def test_model_search(self):
+        with open(f"{test_dir}/stubs/calibrate_trajectory_limits/arm_positive_cubic.json", "r") as fp:
+            calibration_data = TrajectoryCalibrationData.from_json(json.load(fp))
+        good = calibration_data.last_good_calibration
+        bad = calibration_data.last_bad_calibration
+        calibration_data.motion_data = [good, bad]
+        good_travel_duration = good.trajectory.travel_duration_seconds
+        bad_travel_duration = bad.trajectory.travel_duration_seconds
+
+        model = _SpeedModel(calibration_data.motion_data)
+        self.assertTrue(model.is_fitted())
+        self.assertTrue(model.is_exceeded(calibration_data.calibration_targets, bad_travel_duration))
+        self.assertFalse(model.is_exceeded(calibration_data.calibration_targets, good_travel_duration))
+
+        travel_duration = _get_model_travel_duration(calibration_data, good_travel_duration, bad_travel_duration)
+        self.assertGreater(travel_duration, bad_travel_duration)
+        self.assertLessEqual(travel_duration, good_travel_duration)
+
+        # Not enough motions to fit a model, so the bisection step is used
+        calibration_data.motion_data = [good]
+        self.assertIsNone(_get_model_travel_duration(calibration_data, good_travel_duration, None))
+
+    def test_session_checkpoint(self):
+        with open(f"{test_dir}/stubs/calibrate_trajectory_limits/arm_positive_cubic.json", "r") as fp:
+            calibration_data = TrajectoryCalibrationData.from_json(json.load(fp))
+        # Part way through the calibration, before the first overshoot:
+        good = calibration_data.last_good_calibration
+        calibration_data.motion_data = [good]
+        calibration_data.last_bad_calibration = None
+        calibration_data.optimal_calibration_motion_data = None
+
+        with tempfile.TemporaryDirectory() as folder:
+            session = _CalibrationSession(folder, "arm", "label")
+            session.checkpoint(calibration_data)
+            calibration_data.motion_data.append(good)
+            session.checkpoint(calibration_data)
+            with open(f"{folder}/{_CalibrationSession.MOTIONS_FILENAME}", "r") as fp:
+                self.assertEqual(len(fp.readlines()), 2)  # Each motion is written once
+            restored = _CalibrationSession.load(folder).restore(calibration_data)
+
+        self.assertIsNot(restored, calibration_data)
+        self.assertIsNone(restored.last_bad_calibration)
+        self.assertFalse(restored.is_calibrated())
+        self.assertEqual(len(restored.motion_data), 2)
+        self.assertIs(restored.last_good_calibration, restored.motion_data[0])
+        self.assertEqual(
+            restored.last_good_calibration.trajectory.travel_duration_seconds,
+            good.trajectory.travel_duration_seconds,
+        )
+        self.assertEqual(restored.motion_data[-1].step_calibration_result, good.step_calibration_result)
+
+        # The last good motion is marked optimal after it was saved, then the run crashes mid-write
+        calibration_data.motion_data = [copy.deepcopy(good)]
+        calibration_data.last_good_calibration = calibration_data.motion_data[0]
+        calibration_data.last_good_calibration.step_calibration_result = StepCalibrationResult.TARGETS_NOT_REACHED
+        with tempfile.TemporaryDirectory() as folder:
+            session = _CalibrationSession(folder, "arm", "label")
+            session.checkpoint(calibration_data)
+            calibration_data.optimal_calibration_motion_data = calibration_data.last_good_calibration
+            calibration_data.optimal_calibration_motion_data.step_calibration_result = StepCalibrationResult.TARGET_REACHED
+            session.checkpoint(calibration_data)
+            with open(f"{folder}/{_CalibrationSession.MOTIONS_FILENAME}", "a") as fp:
+                fp.write('{"key": "cubic_pos')
+            session = _CalibrationSession.load(folder)
+            restored = session.restore(calibration_data)
+            restored.motion_data.append(copy.deepcopy(good))
+            session.checkpoint(restored)
+            self.assertEqual(len(_CalibrationSession.load(folder).restore(calibration_data).motion_data), 2)
+
+            os.remove(f"{folder}/{_CalibrationSession.MOTIONS_FILENAME}")
+            with self.assertRaises(Exception):
+                _CalibrationSession.load(folder)
+
+        self.assertTrue(restored.is_calibrated())
+        self.assertIs(restored.optimal_calibration_motion_data, restored.motion_data[0])
+        self.assertEqual(restored.optimal_calibration_motion_data.step_calibration_result, StepCalibrationResult.TARGET_REACHED)
@@ -0,0 +1,44 @@
+import os
+import shutil
+import subprocess
+import tempfile
+import time
+import unittest
+from stretch_factory.firmware_mirror import FirmwareMirror
+
+
+class TestFirmwareMirror(unittest.TestCase):
+    def setUp(self):
+        self.dir = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, self.dir)
+        self.repo = os.path.join(self.dir, 'stretch_firmware')
+        subprocess.check_call(['git', 'init', '-q', self.repo])
+        self.shas = []
+        for i in range(4):
+            with open(os.path.join(self.repo, 'version.txt'), 'w') as fh:
+                fh.write('%d\n' % i)
+            self.git('add', 'version.txt')
+            self.git('-c', 'user.name=test', '-c', 'user.email=test@example.com', 'commit', '-q', '-m', 'v%d' % i)
+            self.shas.append(self.git('rev-parse', 'HEAD').strip())
+
+    def git(self, *args):
+        return subprocess.check_output(['git', '-C', self.repo] + list(args)).decode('utf-8')
+
+    def test_worktree_eviction(self):
+        m = FirmwareMirror(mirror_dir=os.path.join(self.dir, 'mirror'), url=self.repo, max_worktrees=2)
+        m.update()
+        paths = [m.get_worktree(sha) for sha in self.shas[:2]]
+        os.utime(paths[0], (time.time() + 1, time.time() + 1))  # paths[0] used last
+        m.get_worktree(self.shas[2])
+        self.assertEqual(len(m.get_worktrees()), 2)
+        self.assertTrue(os.path.isdir(paths[0]))
+        self.assertFalse(os.path.isdir(paths[1]))
+
+        # Worktrees not used for max_age_days are evicted even below max_worktrees
+        m.max_worktrees = 8
+        old = time.time() - (m.max_age_days + 1) * 24 * 3600
+        os.utime(paths[0], (old, old))
+        path = m.get_worktree(self.shas[3])
+        self.assertEqual(m.get_worktrees()[-1], path)
+        self.assertFalse(os.path.isdir(paths[0]))
+        self.assertEqual(len(m.get_worktrees()), 2)
@@ -0,0 +1,24 @@
+import unittest
+from stretch_factory.firmware_version import FirmwareVersion
+
+
+class TestFirmwareVersion(unittest.TestCase):
+    def test_ordering(self):
+        # Higher fields must be equal before minor / bugfix are compared
+        self.assertTrue(FirmwareVersion('Stepper.v1.0.0p3') > FirmwareVersion('Stepper.v0.9.9p3'))
+        self.assertFalse(FirmwareVersion('Stepper.v0.9.9p3') > FirmwareVersion('Stepper.v1.0.0p3'))
+        self.assertFalse(FirmwareVersion('Stepper.v1.0.5p3') < FirmwareVersion('Stepper.v0.2.9p3'))
+        self.assertTrue(FirmwareVersion('Stepper.v0.9.9p4') > FirmwareVersion('Stepper.v1.0.0p3'))
+        self.assertTrue(FirmwareVersion('Pimu.v0.2.0p1') >= FirmwareVersion('Pimu.v0.2.0p1'))
+
+    def test_sort(self):
+        tags = ['Wacc.v0.2.0p1', 'Wacc.v0.10.0p1', 'Wacc.v0.1.9p1', 'Wacc.v1.0.0p1', 'Wacc.v0.3.0p0']
+        vs = sorted([FirmwareVersion(t) for t in tags])
+        self.assertEqual([v.to_string() for v in vs],
+                         ['Wacc.v0.3.0p0', 'Wacc.v0.1.9p1', 'Wacc.v0.2.0p1', 'Wacc.v0.10.0p1', 'Wacc.v1.0.0p1'])
+
+    def test_invalid(self):
+        v = FirmwareVersion('not-a-version')
+        self.assertFalse(v.valid)
+        self.assertFalse(v > FirmwareVersion('Pimu.v0.0.1p0'))
+        self.assertFalse(v < FirmwareVersion('Pimu.v0.0.1p0'))
@@ -0,0 +1,65 @@
+import os
+import tempfile
+import unittest
+import yaml
+import stretch_factory.fleet_updater as fleet
+
+
+class TestFleetUpdater(unittest.TestCase):
+    def write_manifest(self, m):
+        fd, fn = tempfile.mkstemp(suffix='.yaml')
+        with os.fdopen(fd, 'w') as s:
+            yaml.dump(m, s)
+        self.addCleanup(os.remove, fn)
+        return fn
+
+    def test_manifest_defaults(self):
+        m = fleet.load_manifest(self.write_manifest({'parallel': 2, 'robots': [{'name': 'stretch-se3-3001'},
+                                {'name': 'sim-a', 'transport': 'sim', 'devices': ['hello-pimu']}]}))
+        self.assertEqual(m['parallel'], 2)
+        r = m['robots'][0]
+        self.assertEqual(r['fleet_id'], 'stretch-se3-3001')
+        self.assertEqual(r['transport'], 'local')
+        self.assertEqual(r['devices'], fleet.DEVICES)
+        self.assertEqual(m['robots'][1]['devices'], ['hello-pimu'])
+
+    def test_manifest_errors(self):
+        for robots in [[{'name': 'a', 'transport': 'ssh'}], [{'name': 'a', 'devices': ['hello-foo']}],
+                       [{'name': 'a'}, {'name': 'a'}], [{'fleet_id': 'a'}]]:
+            with self.assertRaises(fleet.FleetUpdaterError):
+                fleet.load_manifest(self.write_manifest({'robots': robots}))
+
+    def run_robot(self, plans, updated=True):
+        # A robot whose plan phase reads the given plans in turn, without running the firmware tools
+        class FakeRobotUpdate(fleet.RobotUpdate):
+            def run_plan(self, filename):
+                with open(filename, 'w') as s:
+                    yaml.dump(plans[0], s)
+                return plans.pop(0)
+
+            def run_update(self, plan, resume):
+                return updated
+        d = tempfile.mkdtemp()
+        self.addCleanup(__import__('shutil').rmtree, d)
+        return FakeRobotUpdate({'name': 'a', 'fleet_path': d, 'fleet_id': 'a', 'transport': 'local',
+                                'devices': ['hello-pimu', 'hello-wacc']}, d).run()
+
+    def test_unreadable_device(self):
+        pimu = {'installed': 'Pimu.v0.6.0p5', 'target': 'Pimu.v0.7.0p6', 'update': True, 'error': None}
+        wacc = {'installed': 'Wacc.v0.5.0p4', 'target': 'Wacc.v0.5.0p4', 'update': False, 'error': None}
+        offline = {'installed': None, 'target': None, 'update': False, 'error': 'not on bus'}
+        pimu_updated = dict(pimu, installed='Pimu.v0.7.0p6', update=False)
+
+        r = self.run_robot([{'hello-pimu': offline, 'hello-wacc': offline}])
+        self.assertEqual(r['status'], 'failed')
+
+        r = self.run_robot([{'hello-pimu': pimu, 'hello-wacc': offline}])
+        self.assertEqual(r['status'], 'failed')
+        self.assertIn('hello-wacc', r['error'])
+
+        r = self.run_robot([{'hello-pimu': pimu, 'hello-wacc': wacc}, {'hello-pimu': pimu_updated, 'hello-wacc': offline}])
+        self.assertEqual(r['status'], 'failed')
+        self.assertEqual(r['devices']['hello-wacc']['error'], 'not on bus after the update')
+
+        r = self.run_robot([{'hello-pimu': pimu, 'hello-wacc': wacc}, {'hello-pimu': pimu_updated, 'hello-wacc': wacc}])
+        self.assertEqual(r['status'], 'updated')
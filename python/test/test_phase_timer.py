@@ -0,0 +1,36 @@
+import unittest
+from stretch_factory.phase_timer import PhaseTimer
+
+
+class TestPhaseTimer(unittest.TestCase):
+    def test_nesting(self):
+        t = PhaseTimer()
+        with t.span('flash', 'hello-pimu') as span:
+            with t.span('compile', 'hello-pimu'):
+                pass
+            t.sleep(0.01, 'hello-pimu', 'after bossac')
+            span['ok'] = False
+        by_name = {s['name']: s for s in t.spans}
+        self.assertEqual(by_name['compile']['parent'], 'flash')
+        self.assertEqual(by_name['sleep']['reason'], 'after bossac')
+        self.assertIsNone(by_name['flash']['parent'])
+        self.assertFalse(by_name['flash']['ok'])
+        self.assertGreaterEqual(by_name['flash']['dur_s'], by_name['sleep']['dur_s'])
+        self.assertEqual(list(t.get_totals('hello-pimu').keys()), ['flash'])
+        self.assertEqual(t.get_sleeps()['after bossac'][0], 1)
+
+    def test_exception(self):
+        t = PhaseTimer()
+        with self.assertRaises(ValueError):
+            with t.span('flash'):
+                raise ValueError()
+        self.assertFalse(t.spans[0]['ok'])
+
+    def test_chrome_trace(self):
+        t = PhaseTimer()
+        t.add('preflight', None, 10.0, 0.5)
+        t.add('flash', 'hello-wacc', 11.0, 2.0)
+        events = t.to_chrome_trace()['traceEvents']
+        x = [e for e in events if e['ph'] == 'X']
+        self.assertEqual([(e['tid'], e['ts'], e['dur']) for e in x], [(0, 10000000, 500000), (1, 11000000, 2000000)])
+        self.assertEqual({e['tid']: e['args']['name'] for e in events if e['ph'] == 'M'}, {0: 'host', 1: 'hello-wacc'})
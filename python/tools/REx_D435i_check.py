@@ -6,6 +6,7 @@ import sys
 from subprocess import Popen, PIPE, STDOUT
 from colorama import Fore, Back, Style
 import stretch_factory.hello_device_utils as hdu
+from stretch_factory.kernel_log import KernelLogFollower
 from threading import Thread
 import time
 import signal
@@ -25,7 +26,6 @@ group.add_argument("--scan_head", help="Test data capture rate with Head Pan and
 
 
 args = parser.parse_args()
-thread_stop = False
 check_log = []
 dmesg_log = []
 log_file_path = "/tmp/d435i_check_log.txt"
@@ -285,27 +285,20 @@ def check_dmesg(msgs):
         print(Fore.GREEN+'[Pass] No unexpected dmesg warnings')
     print(Style.RESET_ALL)
 
-def check_dmesg_thread():
-    global thread_stop, check_log, pan_tilt_pos, dmesg_log
+def on_dmesg_message(mesg):
+    global check_log, pan_tilt_pos, dmesg_log
+    if pan_tilt_pos[0]:
+        check_log.append(mesg+'   (Pan, Tilt)='+str(pan_tilt_pos))
+    else:
+        check_log.append(mesg)
+    dmesg_log.append(mesg)
+
+def start_dmesg_monitor():
+    # Follows only new kernel messages, so there is no need to clear the buffer with 'dmesg -c' first
     print('\nMonitoring the DMESG Buffer for issues while collecting camera stream.\n\n')
-    while thread_stop==False:
-        out = hdu.exec_process(['sudo', 'dmesg', '-c'], True).decode("utf-8").split('\n')
-        filtered_out = []
-        filters = ['uvc','usb','input','hid']
-        for o in out:
-            for f in filters:
-                if f in o:
-                    filtered_out.append(o)
-                    break
-        if len(filtered_out)>0:
-            for mesg in filtered_out:
-                if len(mesg)>0:
-                    if pan_tilt_pos[0]:
-                        check_log.append(mesg+'   (Pan, Tilt)='+str(pan_tilt_pos))
-                        dmesg_log.append(mesg)
-                    else:
-                        check_log.append(mesg)
-                        dmesg_log.append(mesg)
+    monitor_dmesg = KernelLogFollower(filters=['uvc','usb','input','hid'], on_message=on_dmesg_message)
+    monitor_dmesg.start()
+    return monitor_dmesg
 
 def check_throughput(usbrate_file):
     global check_log
@@ -443,7 +436,7 @@ def scan_head_check_rate():
     """
     Check D435i rates with head moving to extremities
     """
-    global thread_stop, dmesg_log
+    global dmesg_log
     check_install_usbtop()
     get_usb_busID()
     check_usb()
@@ -451,11 +444,8 @@ def scan_head_check_rate():
     robot=stretch_body.robot.Robot()
     robot.startup()
 
-    hdu.exec_process(['sudo', 'dmesg', '-c'], True)
     hdu.exec_process(['sudo', 'modprobe', 'usbmon'], True)
-    thread_stop = False
-    monitor_dmesg = Thread(target=check_dmesg_thread)
-    monitor_dmesg.start()
+    monitor_dmesg = start_dmesg_monitor()
 
     conf_type = '---------- HIGH RES CHECK ----------'
     check_log.append('\n'+conf_type + '\n')
@@ -477,8 +467,7 @@ def scan_head_check_rate():
     check_throughput('/tmp/usbrate.txt')
     time.sleep(1.5)
 
-    thread_stop = True
-    monitor_dmesg.join()
+    monitor_dmesg.stop()
     
     check_dmesg(dmesg_log)
     save_collected_log(check_log)
@@ -490,20 +479,16 @@ def check_rate_exec():
     """
     Check D435i rates without head moving
     """
-    global thread_stop, dmesg_log
+    global dmesg_log
     check_install_usbtop()
     get_usb_busID()
     check_usb()
     check_ros()
-    hdu.exec_process(['sudo', 'dmesg', '-c'], True)
     hdu.exec_process(['sudo', 'modprobe', 'usbmon'], True)
-    
 
     conf_type = '---------- HIGH RES CHECK ----------'
     check_log.append('\n'+conf_type + '\n')
-    thread_stop = False
-    monitor_dmesg = Thread(target=check_dmesg_thread)
-    monitor_dmesg.start()
+    monitor_dmesg = start_dmesg_monitor()
 
     print(conf_type)
     print('Checking high-res data rates. This will take 30s...')
@@ -519,8 +504,7 @@ def check_rate_exec():
     check_data_rate(target)
     check_throughput('/tmp/usbrate.txt')
 
-    thread_stop = True
-    monitor_dmesg.join()
+    monitor_dmesg.stop()
 
     check_dmesg(dmesg_log)
     save_collected_log(check_log)
@@ -1,8 +1,11 @@
 #!/usr/bin/python3
-from dataclasses import asdict, dataclass, field
+from concurrent.futures import ProcessPoolExecutor
+from dataclasses import asdict, dataclass, field, replace
 from enum import IntEnum
 import json
+import multiprocessing
 import os
+import pickle
 import subprocess
 
 from stretch_body.hello_utils import *
@@ -14,6 +17,7 @@ from stretch_body.lift import Lift
 from stretch_body.arm import Arm
 from stretch_body.base import Base
 from stretch_body.prismatic_joint import PrismaticJoint
+import stretch_factory.hardware_sim as hsim
 
 import numpy as np
 import matplotlib
@@ -26,6 +30,28 @@ logging.basicConfig(
     level=logging.DEBUG, format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
+SAMPLING_RATE_HZ = 10  # Default rate that joint status is sampled at during a motion
+HIGH_RATE_SAMPLING_MAX_HZ = 500  # Cap of the high rate mode
+HIGH_RATE_SAMPLING_HEADROOM = 0.8  # Fraction of the measured max status rate targeted, so the schedule can be kept
+
+# Rate to sample joint status at during a motion. None samples at the joint's max status rate (--high_rate_sampling)
+sampling_rate_hz: "float | None" = SAMPLING_RATE_HZ
+
+# When the plots and JSON of each motion are written (--plot_mode):
+#   sync: right away, on the robot loop
+#   background: by a worker process while the robot keeps moving
+#   deferred: all at the end of the run
+#   none: the JSON only, by the worker process. No plots
+PLOT_MODES = ("sync", "background", "deferred", "none")
+
+# How the next travel duration of a dynamic limit calibration step is picked (--search_mode):
+#   bisection: speed up by a step scaled by the distance to the targets, then halve the good/bad bracket
+#   model: fit effort and goal error against speed over the motions so far, and go to the predicted limit
+SEARCH_MODES = ("bisection", "model")
+search_mode = "bisection"
+MODEL_SEARCH_MARGIN = 0.9  # Fraction of the calibration targets the model search aims for
+MODEL_SEARCH_MAX_SPEEDUP = 2.0  # Before the first overshoot, speed up by at most this factor per step (or the bisection's max step)
+
 
 class MotionProfileTypes(IntEnum):
     linear = 0
@@ -39,6 +65,10 @@ class JointTypes(IntEnum):
     base = 2
 
     def get_joint_instance(self):
+        if hsim.enabled():
+            if self == JointTypes.base:
+                raise NotImplementedError(f"{self} joint type is not simulated.")
+            return hsim.make_prismatic_joint(self.name)
         if self == JointTypes.arm:
             return Arm()
         if self == JointTypes.lift:
@@ -242,32 +272,119 @@ class CalibrationTargets:
         )
 
 
+class MotionSamples:
+    """
+    Samples of a motion in a growable NumPy structured array, one row per sample.
+
+    Columns are returned as views of the first `n` rows, valid until the next `append()`. `version` changes on
+    every append so that values derived from the samples can be cached.
+    """
+
+    __slots__ = ("data", "n", "version")
+
+    DTYPE = np.dtype(
+        [
+            ("t", "f8"),
+            ("pos", "f8"),
+            ("vel", "f8"),
+            ("effort", "f8"),
+            ("current", "f8"),
+            # For DiffDrive
+            ("pos_y", "f8"),
+            ("pos_theta", "f8"),
+            ("vel_y", "f8"),
+            ("vel_theta", "f8"),
+            ("effort_2", "f8"),
+            ("current_2", "f8"),
+        ]
+    )
+
+    def __init__(self, capacity: int = 256):
+        self.data = np.full(max(1, capacity), np.nan, dtype=MotionSamples.DTYPE)
+        self.n = 0
+        self.version = 0
+
+    def __len__(self) -> int:
+        return self.n
+
+    def reserve(self, capacity: int):
+        if capacity > len(self.data):
+            data = np.full(capacity, np.nan, dtype=MotionSamples.DTYPE)
+            data[: self.n] = self.data[: self.n]
+            self.data = data
+
+    def append(self, *values: float):
+        """
+        Add a sample with values in the order of `DTYPE`. Trailing columns that are not given are NaN.
+        """
+        if self.n == len(self.data):
+            self.reserve(2 * len(self.data))
+        self.data[self.n] = values + (np.nan,) * (len(MotionSamples.DTYPE) - len(values))
+        self.n += 1
+        self.version += 1
+
+    def column(self, name: str) -> np.ndarray:
+        return self.data[name][: self.n]
+
+    @staticmethod
+    def from_columns(**columns: list[float]) -> "MotionSamples":
+        n = max([len(c) for c in columns.values()] + [0])
+        samples = MotionSamples(n)
+        for name, c in columns.items():
+            samples.data[name][: len(c)] = c
+        samples.n = n
+        samples.version = 1
+        return samples
+
+
+def _sample_column(name: str, doc: str) -> property:
+    return property(lambda self: self.samples.column(name), doc=doc)
+
+
 @dataclass
 class MotionData:
     """
     Keeps track of timestamps, joint positions, and motor efforts during motion.
 
-    Provides a `collect_data()` method to sample data.
+    Samples are kept in `samples`, and read as arrays through the `*_during_motion` properties.
+    Values derived from the samples are cached until the next sample is added.
     """
 
     trajectory: "TrajectoryFlattened"
     calibration_targets: "CalibrationTargets"
-    timestamps_during_motion: list[float] = field(default_factory=list)
-    positions_during_motion: list[float] = field(default_factory=list)
-    velocities_during_motion: list[float] = field(default_factory=list)
-    effort_during_motion: list[float] = field(default_factory=list)
-    current_during_motion: list[float] = field(default_factory=list)
+    samples: MotionSamples = field(default_factory=MotionSamples, repr=False)
     step_calibration_result: StepCalibrationResult | None = None
 
     is_motion_stopped_for_safety: bool = False
 
+    # See `_MotionSampler`
+    sampling_rate_target_hz: float | None = None
+    sampling_rate_achieved_hz: float | None = None
+    sampling_jitter_ms: float | None = None  # RMS deviation of the sample times from the schedule
+    sampling_overruns: int = 0  # Samples that were late by more than a period
+
+    _cache: dict = field(default_factory=dict, init=False, repr=False, compare=False)
+
+    timestamps_during_motion = _sample_column("t", "Sample times (s)")
+    positions_during_motion = _sample_column("pos", "Joint position, or base x (m)")
+    velocities_during_motion = _sample_column("vel", "Joint velocity, or base x velocity (m/s)")
+    effort_during_motion = _sample_column("effort", "Motor effort (%), left wheel for the base")
+    current_during_motion = _sample_column("current", "Motor current (A), left wheel for the base")
+
     # For DiffDrive
-    positions_y_during_motion: list[float] = field(default_factory=list)
-    positions_theta_during_motion: list[float] = field(default_factory=list)
-    velocities_y_during_motion: list[float] = field(default_factory=list)
-    velocities_theta_during_motion: list[float] = field(default_factory=list)
-    effort_2_during_motion: list[float] = field(default_factory=list)
-    current_2_during_motion: list[float] = field(default_factory=list)
+    positions_y_during_motion = _sample_column("pos_y", "")
+    positions_theta_during_motion = _sample_column("pos_theta", "")
+    velocities_y_during_motion = _sample_column("vel_y", "")
+    velocities_theta_during_motion = _sample_column("vel_theta", "")
+    effort_2_during_motion = _sample_column("effort_2", "Right wheel effort (%)")
+    current_2_during_motion = _sample_column("current_2", "Right wheel current (A)")
+
+    def _cached(self, key: str, fn):
+        if self._cache.get("_version") != self.samples.version:
+            self._cache = {"_version": self.samples.version}
+        if key not in self._cache:
+            self._cache[key] = fn()
+        return self._cache[key]
 
     def motion_overview(self, joint: "PrismaticJoint|Base", prefix: str = "") -> str:
         warnings = ""
@@ -289,6 +406,7 @@ class MotionData:
     Target effort reached? {self.is_exceeds_effort_target()} 
     Target absolute goal position error reached? {self.is_exceeds_absolute_goal_error_target()}
     Target percentage goal position error reached? {self.is_exceeds_percent_goal_error_target()}
+    Sampled at {self.sampling_rate_achieved_hz}Hz (target {self.sampling_rate_target_hz}Hz). Jitter: {self.sampling_jitter_ms}ms. Overruns: {self.sampling_overruns}
     {warnings}
 """
 
@@ -300,19 +418,28 @@ class MotionData:
     @property
     def timestamps_normalized(self):
 
-        return np.subtract(
-            self.timestamps_during_motion, np.min(self.timestamps_during_motion)
+        return self._cached(
+            "timestamps_normalized",
+            lambda: np.subtract(
+                self.timestamps_during_motion, np.min(self.timestamps_during_motion)
+            ),
         )
 
     @property
     def positions_cm(self):
-        return np.round(np.multiply(self.positions_during_motion, 100), 2)
+        return self._cached(
+            "positions_cm",
+            lambda: np.round(np.multiply(self.positions_during_motion, 100), 2),
+        )
 
     @property
     def accelerations(self) -> tuple[np.ndarray, np.ndarray]:
         """
         Returns a tuple of accelerations (m/s^2) and the timestamps corresponding to those values.
         """
+        return self._cached("accelerations", self._get_accelerations)
+
+    def _get_accelerations(self) -> tuple[np.ndarray, np.ndarray]:
         timestamps_normalized = self.timestamps_normalized
 
         accelerations = np.diff(self.velocities_during_motion) / np.diff(
@@ -328,15 +455,20 @@ class MotionData:
     
     @property
     def max_abs_velocity_during_motion(self) -> float:
-        if not self.velocities_during_motion:
+        if len(self.velocities_during_motion) == 0:
             return 0
-        return float(np.max(np.abs(self.velocities_during_motion)))
+        return self._cached(
+            "max_abs_velocity",
+            lambda: float(np.max(np.abs(self.velocities_during_motion))),
+        )
     
     @property
     def max_abs_acceletation_during_motion(self) -> float:
         accelerations = self.accelerations[0]
         if accelerations.size == 0: return 0
-        return float(np.max(np.abs(accelerations)))
+        return self._cached(
+            "max_abs_acceleration", lambda: float(np.max(np.abs(accelerations)))
+        )
 
     def is_exceeds_effort_target(self) -> bool:
         return (
@@ -395,7 +527,10 @@ class MotionData:
 
     @property
     def effort_percent_average_last_10_readings(self) -> float:
-        return round(float(np.average(np.abs(self.effort_during_motion[-10:]))), 2)
+        return self._cached(
+            "effort_average_last_10",
+            lambda: round(float(np.average(np.abs(self.effort_during_motion[-10:]))), 2),
+        )
 
     @property
     def effort_percent_max_absolute(self) -> float:
@@ -406,11 +541,15 @@ class MotionData:
 
     @property
     def effort_percent_max(self) -> float:
-        return round(float(np.max(self.effort_during_motion)), 2)
+        return self._cached(
+            "effort_max", lambda: round(float(np.max(self.effort_during_motion)), 2)
+        )
 
     @property
     def effort_percent_min(self) -> float:
-        return round(float(np.min(self.effort_during_motion)), 2)
+        return self._cached(
+            "effort_min", lambda: round(float(np.min(self.effort_during_motion)), 2)
+        )
 
     @property
     def linear_speed_cm_per_second(self) -> float:
@@ -424,16 +563,21 @@ class MotionData:
         return json.loads(
             json.dumps(
                 {
-                    "timestamps_during_motion": self.timestamps_during_motion,
-                    "positions_during_motion": self.positions_during_motion,
-                    "velocities_during_motion": self.velocities_during_motion,
-                    "effort_during_motion": self.effort_during_motion,
-                    "current_during_motion": self.current_during_motion,
+                    "timestamps_during_motion": self.timestamps_during_motion.tolist(),
+                    "positions_during_motion": self.positions_during_motion.tolist(),
+                    "velocities_during_motion": self.velocities_during_motion.tolist(),
+                    "effort_during_motion": self.effort_during_motion.tolist(),
+                    "current_during_motion": self.current_during_motion.tolist(),
                     "positions_cm": self.positions_cm.tolist(),
                     "accelerations": self.accelerations[0].tolist(),
                     "step_calibration_result": self.step_calibration_result,
+                    "is_motion_stopped_for_safety": self.is_motion_stopped_for_safety,
                     "trajectory": self.trajectory.to_json(),
                     "calibration_targets": asdict(self.calibration_targets),
+                    "sampling_rate_target_hz": self.sampling_rate_target_hz,
+                    "sampling_rate_achieved_hz": self.sampling_rate_achieved_hz,
+                    "sampling_jitter_ms": self.sampling_jitter_ms,
+                    "sampling_overruns": self.sampling_overruns,
                 }
             )
         )
@@ -443,16 +587,23 @@ class MotionData:
         return MotionData(
             trajectory=TrajectoryFlattened(**json_data["trajectory"]),
             calibration_targets=CalibrationTargets(**json_data["calibration_targets"]),
-            timestamps_during_motion=json_data["timestamps_during_motion"],
-            positions_during_motion=json_data["positions_during_motion"],
-            velocities_during_motion=json_data["velocities_during_motion"],
-            effort_during_motion=json_data["effort_during_motion"],
-            current_during_motion=json_data["current_during_motion"],
+            samples=MotionSamples.from_columns(
+                t=json_data["timestamps_during_motion"],
+                pos=json_data["positions_during_motion"],
+                vel=json_data["velocities_during_motion"],
+                effort=json_data["effort_during_motion"],
+                current=json_data["current_during_motion"],
+            ),
             step_calibration_result=(
                 StepCalibrationResult(json_data["step_calibration_result"])
-                if json_data["step_calibration_result"]
+                if json_data["step_calibration_result"] is not None
                 else None
             ),
+            is_motion_stopped_for_safety=json_data.get("is_motion_stopped_for_safety", False),
+            sampling_rate_target_hz=json_data.get("sampling_rate_target_hz"),
+            sampling_rate_achieved_hz=json_data.get("sampling_rate_achieved_hz"),
+            sampling_jitter_ms=json_data.get("sampling_jitter_ms"),
+            sampling_overruns=json_data.get("sampling_overruns", 0),
         )
 
 
@@ -591,6 +742,7 @@ class TrajectoryCalibrationData:
                         else None
                     ),
                     "messages": self.messages,
+                    "last_motion_stopped_for_safety": self.last_motion_stopped_for_safety,
                 }
             )
         )
@@ -603,7 +755,7 @@ class TrajectoryCalibrationData:
             is_positive_direction=json_data["is_positive_direction"],
             is_use_velocity=json_data["is_use_velocity"],
             is_use_acceleration=json_data["is_use_acceleration"],
-            calibration_targets=json_data["calibration_targets"],
+            calibration_targets=CalibrationTargets(**json_data["calibration_targets"]),
             motion_type=MotionProfileTypes(json_data["motion_type"]),
         )
         motion_data_json: list[dict] = json_data["motion_data"]
@@ -611,27 +763,37 @@ class TrajectoryCalibrationData:
             MotionData.from_json(motion_data) for motion_data in motion_data_json
         ]
         calibration_data.messages = json_data["messages"]
-        calibration_data.last_bad_calibration = MotionData.from_json(
-            json_data["last_bad_calibration"]
+        calibration_data.last_motion_stopped_for_safety = json_data.get(
+            "last_motion_stopped_for_safety", False
         )
 
-        calibration_data.last_good_calibration = MotionData.from_json(
-            json_data["last_good_calibration"]
-        )
+        # These are None until the calibration gets that far:
+        if json_data["last_bad_calibration"] is not None:
+            calibration_data.last_bad_calibration = MotionData.from_json(
+                json_data["last_bad_calibration"]
+            )
 
-        calibration_data.optimal_calibration_motion_data = MotionData.from_json(
-            json_data["optimal_calibration_motion_data"]
-        )
+        if json_data["last_good_calibration"] is not None:
+            calibration_data.last_good_calibration = MotionData.from_json(
+                json_data["last_good_calibration"]
+            )
+
+        if json_data["optimal_calibration_motion_data"] is not None:
+            calibration_data.optimal_calibration_motion_data = MotionData.from_json(
+                json_data["optimal_calibration_motion_data"]
+            )
 
         return calibration_data
 
 
 def _collect_data_prismatic(motion_data: MotionData, joint: "PrismaticJoint"):
-    motion_data.timestamps_during_motion.append(time.time())
-    motion_data.positions_during_motion.append(joint.status["pos"])
-    motion_data.velocities_during_motion.append(joint.status["vel"])
-    motion_data.effort_during_motion.append(joint.motor.status["effort_pct"])
-    motion_data.current_during_motion.append(joint.motor.status["current"])
+    motion_data.samples.append(
+        time.time(),
+        joint.status["pos"],
+        joint.status["vel"],
+        joint.motor.status["effort_pct"],
+        joint.motor.status["current"],
+    )
 
 
 def _collect_data_base(
@@ -639,7 +801,7 @@ def _collect_data_base(
     joint: "Base",
     starting_position: tuple[float, float, float],
 ):
-    motion_data.timestamps_during_motion.append(time.time())
+    t = time.time()
 
     x = (
         joint.status["x"] - starting_position[0]
@@ -654,14 +816,6 @@ def _collect_data_base(
     y_vel = joint.status["y_vel"]
     theta_vel = joint.status["theta_vel"]
 
-    motion_data.positions_during_motion.append(x)
-    motion_data.positions_y_during_motion.append(y)
-    motion_data.positions_theta_during_motion.append(theta)
-
-    motion_data.velocities_during_motion.append(x_vel)
-    motion_data.velocities_y_during_motion.append(y_vel)
-    motion_data.velocities_theta_during_motion.append(theta_vel)
-
     current = joint.status["left_wheel"]["current"]
     current_right_wheel = joint.status["right_wheel"]["current"]
 
@@ -669,10 +823,10 @@ def _collect_data_base(
     effort = joint.status["left_wheel"]["effort_pct"]
     effort_2 = joint.status["right_wheel"]["effort_pct"]
 
-    motion_data.effort_during_motion.append(effort)
-    motion_data.effort_2_during_motion.append(effort_2)
-    motion_data.current_during_motion.append(current)
-    motion_data.current_2_during_motion.append(current_right_wheel)
+    # In the order of MotionSamples.DTYPE
+    motion_data.samples.append(
+        t, x, x_vel, effort, current, y, theta, y_vel, theta_vel, effort_2, current_right_wheel
+    )
 
 
 def _collect_data(
@@ -689,6 +843,147 @@ def _collect_data(
         )
 
 
+class _MotionSampler:
+    """
+    Drift-compensated fixed rate schedule: sample k is due at start + k * period, so time spent pulling
+    status and checking effort does not add up into a lower rate. If a sample is late by more than a period
+    the schedule is moved forward rather than bursting to catch up.
+    """
+
+    def __init__(self, rate_hz: float):
+        self.rate_hz = rate_hz
+        self.period = 1.0 / rate_hz
+        self.start = None
+        self.next = None
+        self.lateness = []
+        self.overruns = 0
+
+    def wait(self):
+        """
+        Sleep until the next sample is due.
+        """
+        now = time.perf_counter()
+        if self.start is None:
+            self.start = now
+            self.next = now + self.period
+            return
+        if self.next > now:
+            time.sleep(self.next - now)
+        now = time.perf_counter()
+        late = now - self.next
+        self.lateness.append(late)
+        if late > self.period:
+            self.overruns += 1
+            self.next = now  # Drop the missed samples
+        self.next += self.period
+
+    @property
+    def jitter_ms(self) -> float:
+        if not self.lateness:
+            return 0.0
+        return round(float(np.sqrt(np.mean(np.square(self.lateness)))) * 1000, 3)
+
+
+def _measure_max_status_rate_hz(joint: "PrismaticJoint|Base", n: int = 20) -> float:
+    """
+    The rate the joint can be sampled at, from the median time of n status pulls and trajectory updates.
+    """
+    dt = []
+    for _ in range(n):
+        ts = time.perf_counter()
+        joint.pull_status()
+        joint.update_trajectory()
+        dt.append(time.perf_counter() - ts)
+    return 1.0 / max(float(np.median(dt)), 1.0 / HIGH_RATE_SAMPLING_MAX_HZ)
+
+
+def _record_sampling_stats(motion_data: MotionData, sampler: _MotionSampler):
+    motion_data.sampling_rate_target_hz = round(sampler.rate_hz, 1)
+    motion_data.sampling_jitter_ms = sampler.jitter_ms
+    motion_data.sampling_overruns = sampler.overruns
+    ts = motion_data.timestamps_during_motion
+    if len(ts) > 1 and ts[-1] > ts[0]:
+        motion_data.sampling_rate_achieved_hz = round((len(ts) - 1) / (ts[-1] - ts[0]), 1)
+
+
+class _PlotWorker:
+    """
+    Writes the plots and JSON of motions as given by `mode` (see `PLOT_MODES`).
+
+    Each submitted motion is snapshotted (pickled) right away, so the calibration can keep changing while it waits
+    to be written. Rendering happens in a separate process so that it doesn't compete with sampling for the GIL.
+    Call `flush()` to wait for all outputs to be written.
+    """
+
+    def __init__(self, mode: str = "sync"):
+        if mode not in PLOT_MODES:
+            raise ValueError(f"Unknown plot mode {mode}. Choose from {PLOT_MODES}")
+        self.mode = mode
+        self.executor: ProcessPoolExecutor | None = None
+        self.futures = []
+        self.deferred: list[bytes] = []
+
+    def submit(
+        self,
+        calibration_data: "TrajectoryCalibrationData",
+        motion_data: "MotionData",
+        filename_prefix: str = "",
+        write_to_json=True,
+    ):
+        if self.mode == "sync":
+            _save_motion_outputs(
+                calibration_data, motion_data, trajectory_folder_to_save_plots, filename_prefix, write_to_json
+            )
+            return
+
+        # Only the last motion is exported, so leave the others out of the snapshot
+        snapshot = replace(
+            calibration_data,
+            motion_data=calibration_data.motion_data[-1:],
+            messages=list(calibration_data.messages),
+        )
+        job = pickle.dumps(
+            (snapshot, motion_data, trajectory_folder_to_save_plots, filename_prefix, write_to_json, self.mode != "none")
+        )
+        if self.mode == "deferred":
+            self.deferred.append(job)
+        else:
+            self._submit_job(job)
+
+    def _submit_job(self, job: bytes):
+        if self.executor is None:
+            # Spawn rather than fork, as the joint's threads and serial ports shouldn't be copied into the worker
+            self.executor = ProcessPoolExecutor(
+                max_workers=1, mp_context=multiprocessing.get_context("spawn")
+            )
+        self.futures.append(self.executor.submit(_save_motion_outputs_job, job))
+
+    def flush(self):
+        """
+        Write any deferred outputs and wait for all outputs to be written.
+        """
+        if self.deferred:
+            print(f"Writing plots of {len(self.deferred)} motions...")
+        for job in self.deferred:
+            self._submit_job(job)
+        self.deferred = []
+        for future in self.futures:
+            try:
+                future.result()
+            except Exception as e:
+                click.secho(f"Failed to save the plot of a motion: {e}", fg="red")
+        self.futures = []
+
+    def close(self):
+        self.flush()
+        if self.executor is not None:
+            self.executor.shutdown()
+            self.executor = None
+
+
+plot_worker = _PlotWorker()
+
+
 def _plot_motion_profiles_and_save_outputs(
     calibration_data: "TrajectoryCalibrationData",
     motion_data: "MotionData",
@@ -699,8 +994,60 @@ def _plot_motion_profiles_and_save_outputs(
     """
     Plot the motion profiles and joint effort.
     Also saves the plots and a JSON file of the calibration data.
+
+    The outputs are written by `plot_worker`, except when `show_plot` is set.
+    """
+    if show_plot:
+        _save_motion_outputs(
+            calibration_data, motion_data, trajectory_folder_to_save_plots, filename_prefix, write_to_json, show_plot=True
+        )
+        return
+    plot_worker.submit(calibration_data, motion_data, filename_prefix, write_to_json)
+
+
+def _save_motion_outputs_job(job: bytes):
     """
+    Runs in the `_PlotWorker` process.
+    """
+    matplotlib.use("Agg")
+    (calibration_data, motion_data, folder, filename_prefix, write_to_json, is_plot) = pickle.loads(job)
+    _save_motion_outputs(calibration_data, motion_data, folder, filename_prefix, write_to_json, is_plot=is_plot)
+
+
+def _save_motion_outputs(
+    calibration_data: "TrajectoryCalibrationData",
+    motion_data: "MotionData",
+    folder: str,
+    filename_prefix: str = "",
+    write_to_json=True,
+    is_plot=True,
+    show_plot=False,
+):
+    # Save data
+    title_snakecase = f"{filename_prefix}{calibration_data.description}_{calibration_data.profile_name}_{motion_data.linear_speed_cm_per_second}cm/s"
+    title_snakecase = title_snakecase.replace(" ", "_").replace("/", "_per_").lower()
+
+    if motion_data.is_motion_stopped_for_safety:
+        title_snakecase += "_stopped_for_safety"
+
+    if motion_data.step_calibration_result == StepCalibrationResult.FIRST_OVERSHOOT:
+        title_snakecase += "_first_overshoot"
+
+    if write_to_json:
+        filename = f"{folder}/{title_snakecase}.json"
+        with open(filename, "w") as json_file:
+            json.dump(calibration_data.to_json(), json_file, indent=4)
+
+    if is_plot:
+        _plot_motion_profiles(calibration_data, motion_data, show_plot)
+        plt.savefig(f"{folder}/{title_snakecase}.png")
+
 
+def _plot_motion_profiles(
+    calibration_data: "TrajectoryCalibrationData",
+    motion_data: "MotionData",
+    show_plot=False,
+):
     trajectory = motion_data.trajectory
 
     waypoints_time = trajectory.timestamps
@@ -803,24 +1150,6 @@ def _plot_motion_profiles_and_save_outputs(
 
         plt.show(block=False)
 
-    # Save data
-    title_snakecase = f"{filename_prefix}{calibration_data.description}_{calibration_data.profile_name}_{motion_data.linear_speed_cm_per_second}cm/s"
-    title_snakecase = title_snakecase.replace(" ", "_").replace("/", "_per_").lower()
-
-    if motion_data.is_motion_stopped_for_safety:
-        title_snakecase += "_stopped_for_safety"
-
-    if motion_data.step_calibration_result == StepCalibrationResult.FIRST_OVERSHOOT:
-        title_snakecase += "_first_overshoot"
-
-    global trajectory_folder_to_save_plots
-    if write_to_json:
-        filename = f"{trajectory_folder_to_save_plots}/{title_snakecase}.json"
-        with open(filename, "w") as json_file:
-            json.dump(calibration_data.to_json(), json_file, indent=4)
-
-    plt.savefig(f"{trajectory_folder_to_save_plots}/{title_snakecase}.png")
-
 
 def run_profile_trajectory(
     joint: "PrismaticJoint|Base",
@@ -830,7 +1159,7 @@ def run_profile_trajectory(
     disable_dynamic_limits: bool = True,
 ) -> MotionData:
     """
-    Follows a trajectory and captures position and effort data.
+    Follows a trajectory and captures position and effort data, sampled at `sampling_rate_hz`.
 
     This monitors joint effort and calls `joint.motor.enable_safety()` if the effort exceeds a threshold.
     """
@@ -873,6 +1202,13 @@ def run_profile_trajectory(
 
     time.sleep(1)  # let things settle
 
+    rate_hz = sampling_rate_hz
+    if rate_hz is None:
+        rate_hz = _measure_max_status_rate_hz(joint) * HIGH_RATE_SAMPLING_HEADROOM
+    sampler = _MotionSampler(rate_hz)
+    # Room for the whole motion plus some margin, so that sampling doesn't reallocate
+    motion_data.samples.reserve(int(max(trajectory.timestamps) * rate_hz * 1.5) + 16)
+
     if not isinstance(joint, Base):
         starting_position = joint.status["pos"]
     else:
@@ -888,12 +1224,12 @@ def run_profile_trajectory(
     joint.pull_status()
     joint.update_trajectory()
     joint.pull_status()
-    SAMPLING_RATE_HZ = 10
 
     assert joint.is_trajectory_active(), "Trajectory is not active, when it should be."
 
+    sampler.wait()  # Start the schedule
     while joint.is_trajectory_active():
-        time.sleep(1 / SAMPLING_RATE_HZ)  # Sample at 1/SAMPLING_RATE seconds
+        sampler.wait()
 
         joint.pull_status()
         joint.update_trajectory()
@@ -914,6 +1250,8 @@ def run_profile_trajectory(
 
             break
 
+    _record_sampling_stats(motion_data, sampler)
+
     return motion_data
 
 
@@ -1076,13 +1414,25 @@ def _get_dynamic_decrease_time_by(
     """
     Linearly decreases the travel duration by a value between 0.1 and 1.5, depending on distance to the goal.
     """
-    decrement_by = (
-        calibration_data.calibration_targets.travel_duration_decrement_by_max_seconds
+    return _get_decrease_time_by(
+        calibration_targets=calibration_data.calibration_targets,
+        error_percent=motion_data.error_percent,
+        effort_percent_max=motion_data.effort_percent_max,
+        is_use_effort_for_dynamic_decrease=is_use_effort_for_dynamic_decrease,
     )
 
+
+def _get_decrease_time_by(
+    calibration_targets: CalibrationTargets,
+    error_percent: float,
+    effort_percent_max: float,
+    is_use_effort_for_dynamic_decrease: bool,
+) -> float:
+    decrement_by = calibration_targets.travel_duration_decrement_by_max_seconds
+
     decrement_error_percent = decrement_by - _map_range(
-        motion_data.error_percent,
-        (0, calibration_data.calibration_targets.goal_error_percentage_target),
+        error_percent,
+        (0, calibration_targets.goal_error_percentage_target),
         (0.1, decrement_by),
     )
 
@@ -1090,14 +1440,150 @@ def _get_dynamic_decrease_time_by(
         return decrement_error_percent
 
     decrement_effort = decrement_by - _map_range(
-        motion_data.effort_percent_max,
-        (0, calibration_data.calibration_targets.effort_percent_target),
+        effort_percent_max,
+        (0, calibration_targets.effort_percent_target),
         (0.1, decrement_by),
     )
 
     return np.min([decrement_error_percent, decrement_effort])
 
 
+class _SpeedModel:
+    """
+    Polynomial fits of motion metrics against speed (1 / travel duration), over the motions of one calibration direction.
+
+    Motions stopped for safety are left out, as their effort and position are cut short.
+    Over a fixed range, acceleration (and so effort) grows with the square of the speed, so metrics are fitted as
+    a + b * speed^2 with 2 or 3 distinct travel durations, and as a full quadratic in speed with 4 or more.
+    """
+
+    # MotionData property: CalibrationTargets field it is checked against (None if it isn't a target)
+    METRICS = {
+        "effort_percent_max_absolute": "effort_percent_target",
+        "error_absolute_cm": "goal_error_absolute_target_cm",
+        "error_percent": "goal_error_percentage_target",
+        "effort_percent_max": None,
+    }
+
+    def __init__(self, motion_data: list[MotionData]):
+        motion_data = [m for m in motion_data if not m.is_motion_stopped_for_safety]
+        speeds = [1.0 / m.trajectory.travel_duration_seconds for m in motion_data]
+        self.n = len(motion_data)
+        self.fits: dict[str, np.poly1d] = {}
+        n_distinct = len(set(np.round(speeds, 4)))
+        if n_distinct < 2:
+            return
+        self.is_square_basis = n_distinct < 4
+        x = np.square(speeds) if self.is_square_basis else speeds
+        for metric in _SpeedModel.METRICS:
+            values = [float(getattr(m, metric)) for m in motion_data]
+            self.fits[metric] = np.poly1d(np.polyfit(x, values, 1 if self.is_square_basis else 2))
+
+    def is_fitted(self) -> bool:
+        return len(self.fits) > 0
+
+    def predict(self, metric: str, travel_duration: float) -> float:
+        speed = 1.0 / travel_duration
+        return float(self.fits[metric](speed**2 if self.is_square_basis else speed))
+
+    def is_exceeded(
+        self,
+        calibration_targets: CalibrationTargets,
+        travel_duration: float,
+        margin: float = 1.0,
+    ) -> bool:
+        """
+        Whether a motion of travel_duration is predicted to reach `margin` of any calibration target.
+        """
+        for metric, target in _SpeedModel.METRICS.items():
+            if target is not None and self.predict(metric, travel_duration) >= margin * getattr(
+                calibration_targets, target
+            ):
+                return True
+        return False
+
+
+def _get_model_travel_duration(
+    calibration_data: TrajectoryCalibrationData,
+    good_travel_duration: float,
+    bad_travel_duration: float | None,
+) -> float | None:
+    """
+    The shortest travel duration between the last bad and good ones that the motions so far predict to stay within
+    `MODEL_SEARCH_MARGIN` of the calibration targets. It is kept an `end_condition_time_step` away from the bad one,
+    and before the first overshoot, no faster than `MODEL_SEARCH_MAX_SPEEDUP` times the good one or the bisection's
+    largest step, whichever is faster.
+
+    Returns None if there aren't enough motions to fit, or if nothing faster than the good motion is predicted to be
+    safe before the first overshoot (the bisection step is taken instead).
+    """
+    model = _SpeedModel(calibration_data.motion_data)
+    if not model.is_fitted():
+        return None
+
+    targets = calibration_data.calibration_targets
+    if bad_travel_duration is not None:
+        shortest = bad_travel_duration + targets.end_condition_time_step
+    else:
+        shortest = max(
+            1.0,
+            min(
+                good_travel_duration / MODEL_SEARCH_MAX_SPEEDUP,
+                good_travel_duration - targets.travel_duration_decrement_by_max_seconds,
+            ),
+        )
+
+    # Shortest first, not including the good one:
+    candidates = np.arange(shortest, good_travel_duration - 0.005, 0.01)
+    for travel_duration in candidates:
+        if not model.is_exceeded(targets, travel_duration, margin=MODEL_SEARCH_MARGIN):
+            return round(float(travel_duration), 2)
+
+    if bad_travel_duration is None:
+        return None
+
+    # The good motion is predicted to be at the limit already
+    return good_travel_duration
+
+
+def _estimate_bisection_strokes(calibration_data: TrajectoryCalibrationData) -> int | None:
+    """
+    Estimate of the number of motions the bisection search would take to calibrate this direction, by replaying it
+    against a model fitted to all the motions that were done.
+    """
+    model = _SpeedModel(calibration_data.motion_data)
+    if not model.is_fitted():
+        return None
+
+    targets = calibration_data.calibration_targets
+    good, bad = None, None
+    travel_duration = targets.travel_duration_start_seconds
+    for strokes in range(1, 100):
+        if model.is_exceeded(targets, travel_duration):
+            if good is None:
+                return None
+            bad = travel_duration
+        else:
+            good = travel_duration
+
+        if bad is None:
+            change_time_by = _get_decrease_time_by(
+                calibration_targets=targets,
+                error_percent=model.predict("error_percent", good),
+                effort_percent_max=model.predict("effort_percent_max", good),
+                is_use_effort_for_dynamic_decrease=True,
+            )
+        else:
+            change_time_by = (good - bad) / 2
+            if change_time_by < targets.end_condition_time_step:
+                return strokes
+        travel_duration = round(good - change_time_by, 2)
+        if travel_duration <= 1.0:
+            return strokes
+
+    return None
+
+
 def _good_step(
     calibration_data: TrajectoryCalibrationData,
     motion_data: MotionData,
@@ -1249,6 +1735,22 @@ def _get_next_travel_duration_in_seconds(
     The last known good travel time is {good_travel_duration}s. {stopped_for_safety_message}
 """
 
+    if search_mode == "model" and not calibration_data.last_motion_stopped_for_safety:
+        model_travel_duration = _get_model_travel_duration(
+            calibration_data=calibration_data,
+            good_travel_duration=good_travel_duration,
+            bad_travel_duration=bad_travel_duration,
+        )
+        if model_travel_duration is not None:
+            new_travel_duration = model_travel_duration
+            change_time_by = round(new_travel_duration - good_travel_duration, 2)
+            message = f"""New {calibration_data.direction_name} calibration step:
+    The model of the last {len(calibration_data.motion_data)} motions puts the limit at {new_travel_duration}s ({change_time_by:.2f}s from the last good travel time {good_travel_duration}s) for this run.
+"""
+            if bad_travel_duration:
+                message += f"""    The last bad travel time is {bad_travel_duration}s.
+"""
+
     if new_travel_duration <= 1.0:
         # Can't have travel duration go below zero. For safety, if it's below 1, we're done going to assume we're done.
         new_travel_duration: float = good_travel_duration
@@ -1446,6 +1948,10 @@ def _do_calibration_trajectory_mode_dynamic_limits(
         calibration_targets=negative_calibration_targets,
     )
 
+    if calibration_session is not None:
+        positive_motion = calibration_session.restore(positive_motion)
+        negative_motion = calibration_session.restore(negative_motion)
+
     while not positive_motion.is_calibrated() or not negative_motion.is_calibrated():
 
         new_motion_to_plot = _step_calibration(
@@ -1455,6 +1961,9 @@ def _do_calibration_trajectory_mode_dynamic_limits(
             disable_dynamic_limits=True,
         )
 
+        if calibration_session is not None:
+            calibration_session.checkpoint(positive_motion)
+
         if new_motion_to_plot:
             _plot_motion_profiles_and_save_outputs(
                 calibration_data=positive_motion,
@@ -1469,6 +1978,9 @@ def _do_calibration_trajectory_mode_dynamic_limits(
             disable_dynamic_limits=True,
         )
 
+        if calibration_session is not None:
+            calibration_session.checkpoint(negative_motion)
+
         if new_motion_to_plot:
             _plot_motion_profiles_and_save_outputs(
                 calibration_data=negative_motion,
@@ -1504,6 +2016,16 @@ Optimal Negative {joint.name} {negative_motion.profile_name} Motion Profile:
 """
     )
 
+    if search_mode == "model":
+        for calibration_data in (positive_motion, negative_motion):
+            strokes = len(calibration_data.motion_data)
+            bisection_strokes = _estimate_bisection_strokes(calibration_data)
+            message = f"{calibration_data.direction_name} {joint.name} {calibration_data.profile_name}: model search took {strokes} motions"
+            if bisection_strokes is not None:
+                message += f", bisection would take about {bisection_strokes} ({bisection_strokes - strokes} strokes saved)"
+            calibration_data.messages.append(message)
+            click.secho(message, fg="green")
+
     return (positive_motion, negative_motion)
 
 
@@ -1819,29 +2341,229 @@ def tictoc_timer(tag: str):
     tictoc_timer_tracker[tag] = time.time()
 
 
+class _CalibrationSession:
+    """
+    Checkpoint of a dynamic limit calibration run in its output folder, updated after every calibration step.
+    `--resume` reloads it to continue each profile and direction from its last good/bad motion.
+
+    Each motion is serialized once and appended to `MOTIONS_FILENAME` as a JSON line. `SESSION_FILENAME` is a small
+    index rewritten on every checkpoint: the state of each profile and direction, the step result of each of its
+    motions (which changes after a motion is saved) and its last good/bad/optimal motions as indices into them.
+    """
+
+    SESSION_FILENAME = "session.json"
+    MOTIONS_FILENAME = "session_motions.jsonl"
+
+    def __init__(self, folder: str, joint_name: str, label: str):
+        self.folder = folder
+        self.joint_name = joint_name
+        self.label = label
+        self.calibration_data: dict[str, dict] = {}  # {"cubic_positive": index entry, see checkpoint()}
+        self.motions: dict[str, list[dict]] = {}  # {"cubic_positive": [MotionData.to_json()]}, only filled by load()
+        self.n_saved: dict[str, int] = {}  # Motions of each profile and direction already in MOTIONS_FILENAME
+
+    @staticmethod
+    def _get_key(calibration_data: TrajectoryCalibrationData) -> str:
+        return f"{calibration_data.motion_type.name}_{calibration_data.direction_name.lower()}"
+
+    def restore(
+        self, calibration_data: TrajectoryCalibrationData
+    ) -> TrajectoryCalibrationData:
+        """
+        The saved calibration data of the same profile and direction if there is one, else calibration_data.
+        """
+        key = _CalibrationSession._get_key(calibration_data)
+        saved = self.calibration_data.get(key)
+        if saved is None:
+            return calibration_data
+
+        restored = TrajectoryCalibrationData(
+            description=saved["description"],
+            battery_info=BatteryInfo(**saved["battery_info"]),
+            motion_type=MotionProfileTypes(saved["motion_type"]),
+            is_positive_direction=saved["is_positive_direction"],
+            is_use_velocity=saved["is_use_velocity"],
+            is_use_acceleration=saved["is_use_acceleration"],
+            calibration_targets=CalibrationTargets(**saved["calibration_targets"]),
+        )
+        restored.motion_data = [
+            MotionData.from_json(m) for m in self.motions.get(key, [])[: saved["n_motions"]]
+        ]
+        for motion, result in zip(restored.motion_data, saved["step_calibration_results"]):
+            motion.step_calibration_result = (
+                StepCalibrationResult(result) if result is not None else None
+            )
+        restored.messages = saved["messages"]
+        restored.last_motion_stopped_for_safety = saved["last_motion_stopped_for_safety"]
+
+        def get_motion(index: int | None) -> MotionData | None:
+            return restored.motion_data[index] if index is not None else None
+
+        restored.last_good_calibration = get_motion(saved["last_good_calibration"])
+        restored.last_bad_calibration = get_motion(saved["last_bad_calibration"])
+        restored.optimal_calibration_motion_data = get_motion(
+            saved["optimal_calibration_motion_data"]
+        )
+        self.n_saved[key] = len(restored.motion_data)
+
+        status = "calibrated" if restored.is_calibrated() else "resuming"
+        click.secho(
+            f"{restored.description} {restored.profile_name}: {len(restored.motion_data)} motions saved, {status}.",
+            fg="yellow",
+        )
+        return restored
+
+    def checkpoint(self, calibration_data: TrajectoryCalibrationData):
+        """
+        Append the motions of calibration_data that aren't saved yet, then update the index.
+        """
+        key = _CalibrationSession._get_key(calibration_data)
+        motion_data = calibration_data.motion_data
+        n_saved = self.n_saved.get(key, 0)
+        if len(motion_data) > n_saved:
+            with open(f"{self.folder}/{_CalibrationSession.MOTIONS_FILENAME}", "a") as motions_file:
+                for index in range(n_saved, len(motion_data)):
+                    motions_file.write(
+                        json.dumps({"key": key, "index": index, "motion": motion_data[index].to_json()}) + "\n"
+                    )
+            self.n_saved[key] = len(motion_data)
+
+        def get_index(motion: MotionData | None) -> int | None:
+            # The good/bad/optimal motions are always ones of motion_data
+            if motion is None:
+                return None
+            return next(i for i, m in enumerate(motion_data) if m is motion)
+
+        self.calibration_data[key] = {
+            "description": calibration_data.description,
+            "battery_info": calibration_data.battery_info.to_json(),
+            "motion_type": int(calibration_data.motion_type),
+            "is_positive_direction": calibration_data.is_positive_direction,
+            "is_use_velocity": calibration_data.is_use_velocity,
+            "is_use_acceleration": calibration_data.is_use_acceleration,
+            "calibration_targets": asdict(calibration_data.calibration_targets),
+            "messages": calibration_data.messages,
+            "last_motion_stopped_for_safety": calibration_data.last_motion_stopped_for_safety,
+            "n_motions": len(motion_data),
+            "step_calibration_results": [m.step_calibration_result for m in motion_data],
+            "last_good_calibration": get_index(calibration_data.last_good_calibration),
+            "last_bad_calibration": get_index(calibration_data.last_bad_calibration),
+            "optimal_calibration_motion_data": get_index(
+                calibration_data.optimal_calibration_motion_data
+            ),
+        }
+        self.save()
+
+    def save(self):
+        # Write to a temp file and rename so that a crash never leaves a partial index
+        filename = f"{self.folder}/{_CalibrationSession.SESSION_FILENAME}"
+        with open(filename + ".tmp", "w") as json_file:
+            json.dump(
+                {
+                    "joint": self.joint_name,
+                    "label": self.label,
+                    "calibration_data": self.calibration_data,
+                },
+                json_file,
+            )
+        os.replace(filename + ".tmp", filename)
+
+    @staticmethod
+    def load(folder: str) -> "_CalibrationSession":
+        with open(f"{folder}/{_CalibrationSession.SESSION_FILENAME}", "r") as json_file:
+            json_data = json.load(json_file)
+        session = _CalibrationSession(folder, json_data["joint"], json_data["label"])
+        session.calibration_data = json_data["calibration_data"]
+
+        motions: dict[str, dict[int, dict]] = {}
+        filename = f"{folder}/{_CalibrationSession.MOTIONS_FILENAME}"
+        if os.path.isfile(filename):
+            with open(filename, "rb+") as motions_file:
+                lines = motions_file.read()
+                # Drop a last line cut short by a crash, so that the next checkpoint starts on a new line
+                end = lines.rfind(b"\n") + 1
+                if end < len(lines):
+                    motions_file.truncate(end)
+            for line in lines[:end].decode().splitlines():
+                try:
+                    entry = json.loads(line)
+                except ValueError:
+                    continue
+                # A motion saved again after a resume replaces the earlier copy
+                motions.setdefault(entry["key"], {})[entry["index"]] = entry["motion"]
+        for key, saved in session.calibration_data.items():
+            saved_motions = motions.get(key, {})
+            missing = [index for index in range(saved["n_motions"]) if index not in saved_motions]
+            if len(missing):
+                raise Exception(
+                    f"Motions {missing} of {key} are missing from {filename}. Unable to resume this session."
+                )
+            session.motions[key] = [saved_motions[index] for index in range(saved["n_motions"])]
+        return session
+
+    @staticmethod
+    def find_latest() -> str | None:
+        """
+        The most recent output folder of dynamic limit calibration that has a session, or None.
+        """
+        parent = get_stretch_directory("calibration_trajectory_dynamic_limits")
+        if not os.path.isdir(parent):
+            return None
+        folders = [
+            f"{parent}/{name}"
+            for name in os.listdir(parent)
+            if name.isdigit()
+            and os.path.isfile(f"{parent}/{name}/{_CalibrationSession.SESSION_FILENAME}")
+        ]
+        return max(folders, key=lambda folder: int(os.path.basename(folder)), default=None)
+
+
+# Output folder of a dynamic limit calibration to continue from (--resume). None starts a new one
+resume_folder: "str | None" = None
+calibration_session: "_CalibrationSession | None" = None
+
+
 def _run_dynamic_limits_calibration(
     joint: "PrismaticJoint|Base",
 ) -> list[TrajectoryCalibrationData]:
     """
     Entry point for running Dynamic Limits Calibration.
     """
-    global trajectory_folder_to_save_plots
+    global trajectory_folder_to_save_plots, calibration_session, resume_folder
 
-    trajectory_folder_to_save_plots = get_stretch_directory(
-        f"calibration_trajectory_dynamic_limits/{int(time.time())}"
-    )
+    if resume_folder is not None:
+        calibration_session = _CalibrationSession.load(resume_folder)
+        resume_folder = None  # Only the first run resumes
+        if calibration_session.joint_name != joint.name:
+            raise Exception(
+                f"The session in {calibration_session.folder} is of the {calibration_session.joint_name} joint, not {joint.name}."
+            )
+        trajectory_folder_to_save_plots = calibration_session.folder
+        label = calibration_session.label
+        print(f"Resuming {trajectory_folder_to_save_plots}")
+    else:
+        trajectory_folder_to_save_plots = get_stretch_directory(
+            f"calibration_trajectory_dynamic_limits/{int(time.time())}"
+        )
 
-    os.system("mkdir -p " + trajectory_folder_to_save_plots)
+        os.system("mkdir -p " + trajectory_folder_to_save_plots)
 
-    print(f"Writing to {trajectory_folder_to_save_plots}")
+        print(f"Writing to {trajectory_folder_to_save_plots}")
 
-    tictoc_timer("Calibration Trajectory")
+        robot_name = __import__("platform").node()  # get computer name
+        label = f"{robot_name}_{round(time.time()*1000)}"
 
-    robot_name = __import__("platform").node()  # get computer name
-    label = f"{robot_name}_{round(time.time()*1000)}"
+        calibration_session = _CalibrationSession(
+            trajectory_folder_to_save_plots, joint.name, label
+        )
+        calibration_session.save()
+
+    tictoc_timer("Calibration Trajectory")
 
     results = run_dynamic_limit_calibration(joint, label=label)
 
+    plot_worker.flush()
+
     tictoc_timer("Calibration Trajectory")
 
     return results
@@ -1870,6 +2592,8 @@ def _run_trajectory_efforts_calibration(
 
     results = run_trajectory_effort_calibration(joint, label=label)
 
+    plot_worker.flush()
+
     print(
         """
 Trajectory calibration results:
@@ -2088,13 +2812,55 @@ if __name__ == "__main__":
         "--ncycle", type=int, help="Number of sweeps to run. Applies to trajectory_effort_mode only. [4]", default=4
     )
     parser.add_argument("--skip_homing", help="Skip joint homing", action="store_true")
+    parser.add_argument(
+        "--sampling_rate_hz", type=float, help=f"Rate to sample joint status at during a motion [{SAMPLING_RATE_HZ}]", default=SAMPLING_RATE_HZ
+    )
+    parser.add_argument(
+        "--high_rate_sampling",
+        help="Sample joint status during a motion as fast as the joint can report it. Overrides --sampling_rate_hz",
+        action="store_true",
+    )
+    parser.add_argument(
+        "--search_mode",
+        choices=SEARCH_MODES,
+        help="How the dynamic_limit_mode picks the next travel duration: bisection, or model (fit effort and goal error against speed to converge in fewer motions) [bisection]",
+        default="bisection",
+    )
+    parser.add_argument(
+        "--plot_mode",
+        choices=PLOT_MODES,
+        help="When to write the plots and JSON of each motion: sync, background (a worker process, while the robot keeps moving), deferred (at the end of the run) or none (JSON only) [background]",
+        default="background",
+    )
+    parser.add_argument(
+        "--resume",
+        help="Continue a dynamic_limit_mode calibration from its last checkpoint. Optionally give its output folder [latest]",
+        nargs="?",
+        const="",
+        default=None,
+    )
     parser.add_argument(
         "--run_continously_until_battery_low",
         help="Runs calibration continuously until the battery is low.",
         action="store_true",
     )
+    parser.add_argument(
+        "--sim",
+        help="Run against a simulated joint (no homing). Optionally give a sim config YAML",
+        nargs="?",
+        const="",
+        default=None,
+    )
     args = parser.parse_args()
 
+    if args.sim is not None:
+        hsim.enable(args.sim)
+        args.skip_homing = True
+
+    sampling_rate_hz = None if args.high_rate_sampling else args.sampling_rate_hz
+    plot_worker = _PlotWorker(args.plot_mode)
+    search_mode = args.search_mode
+
     if not args.skip_homing:
         click.secho(
             "The Lift, Arm and Wrist yaw will need to be first homed. Ensure workspace is collision free.",
@@ -2126,6 +2892,17 @@ if __name__ == "__main__":
         if args.trajectory_effort_mode:
             run_mode = _RunMode.trajectory_effort_mode
 
+    if args.resume is not None:
+        if run_mode is not _RunMode.dynamic_limit_mode:
+            click.secho("--resume is only supported by the dynamic_limit_mode", fg="red")
+            exit(1)
+        resume_folder = args.resume or _CalibrationSession.find_latest()
+        if resume_folder is None or not os.path.isfile(
+            f"{resume_folder}/{_CalibrationSession.SESSION_FILENAME}"
+        ):
+            click.secho(f"No calibration session to resume in {resume_folder}", fg="red")
+            exit(1)
+
     if not (args.arm or args.lift or args.arm):
         joint_choices = "".join(
             [
@@ -2164,7 +2941,7 @@ Choose the joint to run the calibration on:
 
     _joint = joint_type.get_joint_instance()
 
-    if not isinstance(_joint, Base):
+    if not isinstance(_joint, Base) and not hsim.enabled():
         # Skip contact sensing for base:
         check_deprecated_contact_model_prismatic_joint(
             _joint, "REx_calibrate_guarded_contacts.py", None, None, None, None
@@ -2177,7 +2954,7 @@ Choose the joint to run the calibration on:
         print("Joint not calibrated. Exiting.")
         exit(1)
 
-    pimu = Pimu()
+    pimu = hsim.SimPimu() if hsim.enabled() else Pimu()
     if not pimu.startup(threaded=False):
         print("Could not start the PIMU")
         exit(1)
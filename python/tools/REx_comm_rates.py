@@ -1,165 +1,100 @@
 #!/usr/bin/env python3
 import argparse
-import stretch_body.pimu
-import stretch_body.wacc
-import stretch_body.arm
-import stretch_body.base
-import stretch_body.lift
-import stretch_body.head
-import stretch_body.end_of_arm
-import stretch_body.robot
+import os
+import shutil
 import stretch_body.hello_utils as hu
-import time
 import click
+import stretch_factory.hardware_sim as hsim
+import stretch_factory.comms_benchmark as cb
 
 
 hu.print_stretch_re_use()
 
-
-r=stretch_body.robot.Robot()
-r.startup()
-click.secho('Measuring rates. This will take about 60s...', fg="yellow",bold=True)
+parser = argparse.ArgumentParser(description='Benchmark the communication latency and throughput of the robot devices')
+parser.add_argument("--devices", help="Devices to benchmark [all hello-* devices]", nargs='+', default=None)
+parser.add_argument("--dxl", help="Also benchmark the head and end_of_arm Dynamixel chains", action="store_true")
+parser.add_argument("--n", help="Timed iterations per test [1000]", type=int, default=1000)
+parser.add_argument("--warmup", help="Untimed iterations before each test [50]", type=int, default=50)
+parser.add_argument("--no_concurrency", help="Skip the concurrent thread test", action="store_true")
+parser.add_argument("--no_payload", help="Skip the stepper load test payload sweep", action="store_true")
+parser.add_argument("--hist", help="Print the latency histograms", action="store_true")
+parser.add_argument("--out", help="Output JSON file (default log/comms_benchmark/<time>.json)", type=str, default=None)
+parser.add_argument("--compare", help="Compare against a baseline JSON (the stored baseline if no file given)", nargs='?', const='', default=None)
+parser.add_argument("--save_baseline", help="Store this run as the baseline for --compare", action="store_true")
+parser.add_argument("--tolerance", help="Percent slowdown of p50/p95/p99 flagged as a regression [20]", type=float, default=20.0)
+parser.add_argument("--sim", help="Run against simulated hardware. Optionally give a sim config YAML", nargs='?', const='', default=None)
+args = parser.parse_args()
+
+if args.sim is not None:
+    hsim.enable(args.sim)
+    click.secho('Using simulated hardware', fg="yellow", bold=True)
+
+names = args.devices if args.devices is not None else list(cb.HELLO_DEVICES)
+if args.dxl:
+    names = names + cb.DXL_CHAINS
+
+click.secho('Measuring comms. n=%d, warmup=%d...' % (args.n, args.warmup), fg="yellow", bold=True)
 print('')
-# ########################################################################
-ts = time.time()
-nitr1=1000
-nitr2=100
-for i in range(nitr1):
-    r.arm.move_by(0)
-    r.lift.move_by(0)
-    r.base.translate_by(0)
-    r.pimu.set_fan_on()
-    r.wacc.set_D2(0)
-    r.push_command()
-dt1 = time.time() - ts
-
-s = r.get_status()
-ts = time.time()
-for i in range(nitr2):
-    for m in r.head.motors:
-        r.head.motors[m].move_to(s['head'][m]['pos'])
-    for m in r.end_of_arm.motors:
-        r.end_of_arm.motors[m].move_to(s['end_of_arm'][m]['pos'])
-dt2 = time.time() - ts
+result = cb.run(names, n=args.n, warmup=args.warmup, concurrency=not args.no_concurrency, payload=not args.no_payload)
 
 # ########################################################################
-click.secho(' Robot Threads '.center(75, '-'), fg="white", bold=True)
-click.secho('%s | %s | %s | %s | %s' % ('Name'.ljust(25),'Average'.ljust(10),'Worst Case'.ljust(10),'Std Dev.'.ljust(10),'Target'.ljust(10)), fg="green", bold=True)
-click.secho('%s | %s | %s | %s | %s' % ('non_dxl_thread'.upper().ljust(25),
-                                   ('%.2f'%r.non_dxl_thread.stats.status['avg_rate_hz']).ljust(10),
-                                   ('%.2f' % r.non_dxl_thread.stats.status['min_rate_hz']).ljust(10),
-                                   ('%.2f'%r.non_dxl_thread.stats.status['std_rate_hz']).ljust(10),
-                                   ('%.2f'%r.params['rates']['NonDXLStatusThread_Hz']).ljust(10)), fg="green", bold=False)
-
-click.secho('%s | %s | %s | %s | %s' % ('dxl_head_thread'.upper().ljust(25),
-                                   ('%.2f' % r.dxl_head_thread.stats.status['avg_rate_hz']).ljust(10),
-                                   ('%.2f' % r.dxl_head_thread.stats.status['min_rate_hz']).ljust(10),
-                                   ('%.2f' % r.dxl_head_thread.stats.status['std_rate_hz']).ljust(10),
-                                   ('%.2f' % r.params['rates']['DXLStatusThread_Hz']).ljust(10)), fg="green",bold=False)
-
-click.secho('%s | %s | %s | %s | %s' % ('dxl_end_of_arm_thread'.upper().ljust(25),
-                                   ('%.2f' % r.dxl_end_of_arm_thread.stats.status['avg_rate_hz']).ljust(10),
-                                   ('%.2f' % r.dxl_end_of_arm_thread.stats.status['min_rate_hz']).ljust(10),
-                                   ('%.2f' % r.dxl_end_of_arm_thread.stats.status['std_rate_hz']).ljust(10),
-                                   ('%.2f' % r.params['rates']['DXLStatusThread_Hz']).ljust(10)), fg="green",bold=False)
-
-click.secho('%s | %s | %s | %s | %s' % ('sys_thread'.upper().ljust(25),
-                                   ('%.2f' % r.sys_thread.stats.status['avg_rate_hz']).ljust(10),
-                                   ('%.2f' % r.sys_thread.stats.status['min_rate_hz']).ljust(10),
-                                   ('%.2f' % r.sys_thread.stats.status['std_rate_hz']).ljust(10),
-                                   ('%.2f' % r.params['rates']['SystemMonitorThread_Hz']).ljust(10)), fg="green",bold=False)
+print('')
+click.secho(' Round Trip Latency (ms) '.center(110, '-'), fg="white", bold=True)
+click.secho('%s | %s | %s | %s | %s | %s | %s' % ('Device'.ljust(25), 'Test'.ljust(10), 'p50'.ljust(8), 'p95'.ljust(8),
+                                               'p99'.ljust(8), 'Max'.ljust(8), 'Rate (Hz)'.ljust(10)), fg="green", bold=True)
+for d in result['latency']:
+    for t, st in result['latency'][d].items():
+        click.secho('%s | %s | %s | %s | %s | %s | %s' % (d.upper().ljust(25), t.ljust(10), ('%.3f' % st['p50_ms']).ljust(8),
+                                                       ('%.3f' % st['p95_ms']).ljust(8), ('%.3f' % st['p99_ms']).ljust(8),
+                                                       ('%.3f' % st['max_ms']).ljust(8), ('%.1f' % st['rate_hz']).ljust(10)))
+        if args.hist:
+            print(cb.format_histogram(st))
+
+if len(result['concurrency']):
+    print('')
+    click.secho(' Concurrent Push-Pull '.center(110, '-'), fg="white", bold=True)
+    for c in result['concurrency']:
+        if len(c['per_device']):
+            worst = max([st['p99_ms'] for st in c['per_device'].values()])
+            click.secho('%s | Aggregate %s Hz | Worst p99 %s ms' % (('%d threads' % c['threads']).ljust(12),
+                                                                  ('%.1f' % c['aggregate_hz']).ljust(10), '%.3f' % worst))
+        for d, e in c.get('errors', {}).items():
+            click.secho('%s | %s failed: %s' % (('%d threads' % c['threads']).ljust(12), d.upper(), e), fg="red")
+
+if len(result['payload']):
+    print('')
+    click.secho(' Load Test Payload Sweep '.center(110, '-'), fg="white", bold=True)
+    for d in result['payload']:
+        for direction in ['push', 'pull']:
+            for size, st in result['payload'][d][direction].items():
+                click.secho('%s | %s | %s bytes | p50 %s ms | %.1f kB/s' % (d.upper().ljust(25), direction.ljust(4), size.rjust(5),
+                                                                         ('%.3f' % st['p50_ms']).ljust(8), st['bytes_per_s'] / 1000.0))
 
-r.stop()
 # ########################################################################
+out = args.out
+if out is None:
+    out = os.path.join(cb.get_default_dir(), hu.create_time_string() + '.json')
+cb.save_result(result, out)
 print('')
-click.secho('Device Comms '.center(75, '-'), fg="white", bold=True)
-print('Robot non-DXL push:\t{:.2f}Hz'.format(nitr1 / dt1))
-print('Robot DXL push:\t\t{:.2f}Hz'.format(nitr2 / dt2))
-
-p=stretch_body.pimu.Pimu()
-p.startup()
-ts = time.time()
-for i in range(nitr1):
-    p.set_fan_off()
-    p.push_command()
-    p.pull_status()
-dt = time.time() - ts
-p.stop()
-print('Pimu push-pull:\t\t{:.2f}Hz'.format(nitr1 / dt))
-
-w=stretch_body.wacc.Wacc()
-w.startup()
-ts = time.time()
-for i in range(nitr1):
-    w.set_D3(0)
-    w.push_command()
-    w.pull_status()
-dt = time.time() - ts
-w.stop()
-print('Wacc push-pull:\t\t{:.2f}Hz'.format(nitr1 / dt))
-
-a=stretch_body.arm.Arm()
-a.startup()
-ts = time.time()
-for i in range(nitr1):
-    a.move_by(0)
-    a.push_command()
-    a.pull_status()
-dt = time.time() - ts
-a.stop()
-print('Arm push-pull:\t\t{:.2f}Hz'.format(nitr1 / dt))
-
-l=stretch_body.lift.Lift()
-l.startup()
-ts = time.time()
-for i in range(nitr1):
-    l.move_by(0)
-    l.push_command()
-    l.pull_status()
-dt = time.time() - ts
-l.stop()
-print('Lift push-pull:\t\t{:.2f}Hz'.format(nitr1 / dt))
-
-b=stretch_body.base.Base()
-b.startup()
-ts = time.time()
-for i in range(nitr1):
-    b.translate_by(0)
-    b.left_wheel.push_command()
-    b.left_wheel.pull_status()
-dt = time.time() - ts
-print('Left Wheel push-pull:\t{:.2f}Hz'.format(nitr1 / dt))
-
-ts = time.time()
-for i in range(nitr1):
-    b.translate_by(0)
-    b.right_wheel.push_command()
-    b.right_wheel.pull_status()
-dt = time.time() - ts
-b.stop()
-print('Right Wheel push-pull:\t{:.2f}Hz'.format(nitr1 / dt))
-
-h = stretch_body.head.Head()
-h.startup()
-ts = time.time()
-h.pull_status()
-for i in range(nitr2):
-    for m in h.motors:
-        h.motors[m].move_to(h.motors[m].status['pos'])
-    h.pull_status()
-dt = time.time() - ts
-h.stop()
-print('Head push-pull:\t\t{:.2f}fHz'.format(nitr2 / dt))
-
-e = stretch_body.end_of_arm.EndOfArm()
-e.startup()
-ts = time.time()
-for i in range(nitr2):
-    for m in e.motors:
-        e.motors[m].move_to(e.motors[m].status['pos'])
-    e.pull_status()
-dt = time.time() - ts
-e.stop()
-print('Endof Arm push-pull:\t{:.2f}fHz'.format(nitr2 / dt))
-
-print('')
\ No newline at end of file
+print('Wrote %s' % out)
+
+if args.save_baseline:
+    shutil.copyfile(out, cb.get_baseline_filename())
+    print('Stored baseline %s' % cb.get_baseline_filename())
+
+if args.compare is not None:
+    fn = args.compare if args.compare else cb.get_baseline_filename()
+    if not os.path.isfile(fn):
+        click.secho('No baseline at %s. Run with --save_baseline first.' % fn, fg="yellow", bold=True)
+        exit(1)
+    rows = cb.compare(result, cb.load_result(fn), tolerance_pct=args.tolerance)
+    regressions = [r for r in rows if r['regression']]
+    print('')
+    click.secho((' Comparison to %s ' % fn).center(110, '-'), fg="white", bold=True)
+    for r in regressions:
+        click.secho('REGRESSION: %s | %s | %s | %s | %.3f -> %.3f ms (%+.0f%%)' % (r['section'].ljust(14), r['device'].upper().ljust(25),
+                    r['test'].ljust(12), r['metric'].ljust(6), r['baseline'], r['current'], r['change_pct']), fg="red")
+    if len(regressions):
+        click.secho('%d of %d metrics regressed by more than %.0f%%' % (len(regressions), len(rows), args.tolerance), fg="red", bold=True)
+        exit(1)
+    click.secho('No regressions in %d metrics' % len(rows), fg="green", bold=True)
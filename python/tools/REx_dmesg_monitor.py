@@ -1,51 +1,35 @@
 #!/usr/bin/env python
-from threading import Thread, Lock
-from subprocess import Popen, PIPE, STDOUT
 import time
 import os
 import sys
 import stretch_body.hello_utils as hu
+from stretch_factory.kernel_log import KernelLogFollower
 
 hu.print_stretch_re_use()
 
 class Dmesg_monitor:
     """
-    Run live dmesg fetching in the backgorund using threading. Query the collected dmesg message
-    outputs or clear them in between sessions. Save the collected dmesg output at the end.
+    Follow new dmesg messages in the background (without clearing the kernel buffer). Query the collected
+    dmesg message outputs or clear them in between sessions. Save the collected dmesg output at the end.
 
     Params
     ------
     print_new_msg =  Prints Dmesg live if True
     log_fn = Optional file path to save the log at stop of dmesg monitor
+    filters = Optional list of filters (eg ['usb','tty']), see kernel_log.FILTERS
+    maxlen = Number of messages kept in memory
 
     """
 
-    def __init__(self, print_new_msg=False, log_fn=None):
-        self.prev_out = None
-        self.thread = None
-        self.output_list = []
-        self.is_live = False
-        self.lock = Lock()
+    def __init__(self, print_new_msg=False, log_fn=None, filters=None, maxlen=100000):
         self.print_new_msg = print_new_msg
         self.log_fn = log_fn
+        self.follower = KernelLogFollower(filters=filters, maxlen=maxlen, on_message=self.on_message)
         os.system("sudo echo ''")
 
-    def dmesg_fetch_clear(self):
-        out = Popen("sudo dmesg -c", shell=True, bufsize=64, stdin=PIPE, stdout=PIPE, close_fds=True,
-                    stderr=PIPE).stdout.read().decode("utf-8")
-        out = str(out).split('\n')
-        with self.lock:
-            try:
-                # Filter ghost lines
-                if out[0] != self.prev_out[-1]:
-                    for o in out:
-                        if len(o) > 0:
-                            self.output_list.append(o)
-                            if self.print_new_msg:
-                                print("[DMESG]...{}".format(o))
-            except:
-                pass
-        self.prev_out = out
+    def on_message(self, msg):
+        if self.print_new_msg:
+            print("[DMESG]...{}".format(msg))
 
     def write_lines_to_file(self, lines, file_path):
         with open(os.path.expanduser(file_path), 'w') as file:
@@ -55,34 +39,27 @@ class Dmesg_monitor:
 
     def start(self):
         print("Starting DMESG capture....")
-        self.is_live = True
-        self.thread = Thread(target=self.live)
-        self.thread.start()
+        self.follower.start()
+        print("Following {}".format(self.follower.source))
 
     def stop(self):
-        self.is_live = False
-        self.thread.join()
+        self.follower.stop()
         print("Ending DMESG capture....")
         self.save_log()
 
     def save_log(self):
         if self.log_fn is not None:
-            self.write_lines_to_file(self.output_list, self.log_fn)
-
-    def live(self):
-        while self.is_live:
-            self.dmesg_fetch_clear()
+            self.write_lines_to_file(self.get_output_list(), self.log_fn)
 
     def clear(self):
         print("Clearing the dmesg log buffer.")
-        with self.lock:
-            self.output_list = []
+        self.follower.clear()
 
     def get_latest_msg(self):
-        return self.prev_out
+        return self.follower.get_latest()
 
     def get_output_list(self):
-        return self.output_list
+        return self.follower.get_messages()
 
 fn = f'/tmp/dmesg_log_{int(time.time())}.log'
 dmesg_monitor = Dmesg_monitor(print_new_msg=True,log_fn=fn)
@@ -41,23 +41,23 @@ if args.flash:
     sketch_to_device = {'hello_stepper': 'hello-motor-arm', 'hello_pimu': 'hello-pimu', 'hello_wacc': 'hello-wacc'}
     a = FirmwareAvailable({sketch_to_device[sketch_name]: True})
     version = a.get_most_recent_version(sketch_to_device[sketch_name], None).to_string()
-    os.system(f"cd {a.repo_path}; git pull > /dev/null 2>&1; git checkout tags/{version} > /dev/null 2>&1")
+    src_path = a.get_source_path(version)
 
     # verify arduino cli setup
     if not fwu.check_arduino_cli_install():
         print(Fore.RED + "Arduino CLI not available." + Style.RESET_ALL)
         sys.exit(1)
-    acli_path = hdu.create_arduinocli_config_file(a.repo_path)
+    acli_path = hdu.create_arduinocli_config_file(src_path)
 
     # compile firmware
-    if not hdu.compile_arduino_firmware(sketch_name, a.repo_path, config_file=acli_path):
+    if not hdu.compile_arduino_firmware(sketch_name, src_path, config_file=acli_path):
         print(Fore.RED + f"Failed to compile Arduino Sketch:{sketch_name}." + Style.RESET_ALL)
         sys.exit(1)
     print(Fore.GREEN + f"Compiled Arduino Sketch:{sketch_name} Successfully." + Style.RESET_ALL)
     # hdu.place_arduino_in_bootloader(port)
     time.sleep(1.0)
 
-    if not hdu.burn_arduino_firmware(port, sketch_name, a.repo_path, config_file=acli_path):
+    if not hdu.burn_arduino_firmware(port, sketch_name, src_path, config_file=acli_path):
         print(Fore.RED + f"Failed to burn Arduino Sketch:{sketch_name} to port:{port}." + Style.RESET_ALL)
         sys.exit(1)
     print(Fore.GREEN + f"Burned Arduino Sketch:{sketch_name} Successfully to port:{port}." + Style.RESET_ALL)
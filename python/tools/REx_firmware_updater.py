@@ -1,12 +1,16 @@
 #!/usr/bin/env python
 import argparse
 from stretch_factory.firmware_available import FirmwareAvailable
+from stretch_factory.firmware_mirror import FirmwareMirror
 from stretch_factory.firmware_recommended import FirmwareRecommended
 from stretch_factory.firmware_installed import FirmwareInstalled
 from stretch_factory.firmware_updater import FirmwareUpdater
+from stretch_factory.firmware_build_cache import FirmwareBuildCache
 import os
 import click
 import stretch_factory.hello_device_utils as hdu
+import stretch_factory.hardware_sim as hsim
+import time
 
 parser = argparse.ArgumentParser(description='Upload Stretch firmware to microcontrollers')
 
@@ -30,8 +34,25 @@ parser.add_argument("--left_wheel", help="Upload Left Wheel Stepper firmware", a
 parser.add_argument("--right_wheel", help="Upload Right Wheel Stepper firmware", action="store_true")
 parser.add_argument("--no_prompts", help="Proceed without prompts", action="store_true")
 parser.add_argument("--verbose", help="Verbose output", action="store_true")
+parser.add_argument("--no_build_cache", help="Always compile firmware instead of reusing cached binaries", action="store_true")
+parser.add_argument("--clear_build_cache", help="Remove all cached firmware binaries", action="store_true")
+parser.add_argument("--clear_worktrees", help="Remove all checkouts of the firmware mirror. They are recreated when needed", action="store_true")
+parser.add_argument("--preflight_only", help="Run the preflight checks for the install (and compile its firmware) without flashing", action="store_true")
+parser.add_argument("--parallel", help="Number of devices to update concurrently. Each device logs to its own file. [1]", type=int, default=1)
+parser.add_argument("--offline", help="Don't fetch the firmware repo from Github. Use the local mirror or --bundle", action="store_true")
+parser.add_argument("--bundle", help="Git bundle of the stretch_firmware repo to create or update the local mirror from", type=str, default=None)
+parser.add_argument("--refresh", help="Fetch the firmware repo now instead of waiting for the refresh interval", action="store_true")
+parser.add_argument("--refresh_interval", help="Hours between fetches of the firmware repo [%.1f]" % FirmwareMirror.refresh_interval_h, type=float, default=None)
+parser.add_argument("--timing", help="Write the time spent in each update phase of each device to this JSON file", type=str, default=None)
+parser.add_argument("--timing_format", help="Format of the --timing file [chrome]. A chrome trace can be viewed in chrome://tracing", choices=['chrome', 'json'], default='chrome')
+parser.add_argument("--resume_file", help="Keep the resume state in this file instead of the default in /tmp", type=str, default=None)
+parser.add_argument("--sim", help="Run against simulated hardware and toolchain. Optionally give a sim config YAML", nargs='?', const='', default=None)
 args = parser.parse_args()
 
+if args.sim is not None:
+    hsim.enable(args.sim)
+    click.secho('Using simulated hardware in %s' % hsim.get_sim_dir(), fg="yellow", bold=True)
+
 mgmt = """
 FIRMWARE MANAGEMENT
 --------------------
@@ -99,6 +120,18 @@ if args.mgmt:
     print(mgmt)
     exit()
 
+if args.clear_build_cache:
+    c = FirmwareBuildCache()
+    c.clear()
+    c.pretty_print_stats()
+    exit()
+
+if args.clear_worktrees:
+    m = FirmwareMirror(mirror_dir=os.path.join(hsim.get_sim_dir(), 'firmware_mirror') if hsim.enabled() else None)
+    m.clear_worktrees()
+    print('Removed the checkouts of %s' % m.mirror_dir)
+    exit()
+
 if args.map:
         mapping = hdu.get_hello_ttyACMx_mapping()
         click.secho('------------------------------------------', fg="yellow", bold=True)
@@ -112,25 +145,32 @@ if args.map:
         exit()
 
 if args.current:
-    c = FirmwareInstalled(use_device)
+    c = FirmwareInstalled(use_device, use_cache=True)
     c.pretty_print()
     exit()
 
+def get_available():
+    return FirmwareAvailable(use_device, offline=args.offline, bundle=args.bundle,
+                             refresh_interval_h=args.refresh_interval, force_refresh=args.refresh)
+
 if args.recommended:
-    r = FirmwareRecommended(use_device)
+    r = FirmwareRecommended(use_device, installed=FirmwareInstalled(use_device, use_cache=True), available=get_available())
     r.pretty_print()
     r.print_recommended_args()
     exit()
 
 if args.available:
-    a = FirmwareAvailable(use_device)
+    a = get_available()
     a.pretty_print()
     exit()
 
 
 if args.resume or args.install or args.install_version or args.install_branch or args.install_path:
+    ts = time.time()
     u = FirmwareUpdater(use_device, args)
     success = u.run()
+    if args.sim is not None:
+        print('Firmware update took %.1fs (wall clock)' % (time.time() - ts))
     exit(0 if success else 1)
 else:
     parser.print_help()
@@ -0,0 +1,29 @@
+#!/usr/bin/env python
+import argparse
+import click
+import stretch_factory.fleet_updater as fleet
+
+parser = argparse.ArgumentParser(description='Update the firmware of a fleet of robots. See stretch_factory/fleet_updater.py for the manifest format')
+parser.add_argument("manifest", help="Fleet manifest YAML", type=str)
+parser.add_argument("--parallel", help="Number of robots to update concurrently [manifest, else 1]", type=int, default=None)
+parser.add_argument("--device_parallel", help="Number of devices of a robot to update concurrently [1]", type=int, default=1)
+parser.add_argument("--state_dir", help="Directory of the per-robot resume state and the report [stretch_user/log/fleet_firmware_update]", type=str, default=None)
+parser.add_argument("--plan_only", help="Plan the target firmware of each robot without updating", action="store_true")
+parser.add_argument("--offline", help="Don't fetch the firmware repo from Github. Use the local mirror or --bundle", action="store_true")
+parser.add_argument("--bundle", help="Git bundle of the stretch_firmware repo to create or update the local mirror from", type=str, default=None)
+args = parser.parse_args()
+
+try:
+    manifest = fleet.load_manifest(args.manifest)
+except (fleet.FleetUpdaterError, IOError) as e:
+    click.secho('Unable to load manifest: %s' % str(e), fg="red", bold=True)
+    exit(1)
+
+f = fleet.FleetUpdater(manifest, state_dir=args.state_dir, parallel=args.parallel, offline=args.offline,
+                       bundle=args.bundle, device_parallel=args.device_parallel)
+click.secho('%s %d robots, %d at a time...' % ('Planning' if args.plan_only else 'Updating', len(f.robots), f.parallel),
+            fg="yellow", bold=True)
+success = f.run(plan_only=args.plan_only)
+print('')
+f.pretty_print()
+exit(0 if success else 1)
@@ -3,6 +3,7 @@
 import stretch_body.stepper as stepper
 import stretch_body.pimu as pimu
 import stretch_body.hello_utils as hu
+import stretch_factory.firmware_utils as fwu
 import argparse
 import time
 
@@ -35,11 +36,14 @@ def stepper_type():
             for x in motor.supported_protocols.keys():
                 recent_protocol = x.strip('p')
             if int(recent_protocol) >= 5:
-                if not motor.startup():
+                if not fwu.identify_device(motor):
                     print(f"Error with communication to {i}")
                     exit(1)
                 if motor.board_info['protocol_version'] == 'p5':
                     if args.write:
+                        if not motor.startup():
+                            print(f"Error with communication to {i}")
+                            exit(1)
                         print(f"Now setting {i} stepper type to flash...")
                         motor.write_stepper_type_to_flash(i)
                         time.sleep(1)
@@ -52,13 +56,9 @@ def stepper_type():
                         time.sleep(1)
 
                     if args.read:
+                        # The stepper type is reported in the board info
                         print(f"Now reading stepper_type from {i}....")
-                        motor.read_stepper_type_from_flash()
-                        time.sleep(1)
-
                         print(f"stepper_type == {motor.board_info['stepper_type']}\n")
-                        time.sleep(1)
-                        motor.stop()
                 else:
                     print(f"Protocol version for {i} is incorrect please update firmware to proper version")
                     exit(1)
@@ -0,0 +1,78 @@
+#!/usr/bin/env python
+import argparse
+import glob
+import os
+import time
+from datetime import datetime
+import click
+import stretch_body.hello_utils as hu
+from stretch_factory.robot_trace_store import RobotTraceStore
+import stretch_factory.trace_analysis as ta
+import stretch_factory.trace_columnar as tc
+
+hu.print_stretch_re_use()
+
+parser = argparse.ArgumentParser(description='Non-interactive summary statistics of robot and firmware traces (no display required).', )
+parser.add_argument("--robot", help="Analyze the robot traces in log/trace", action="store_true")
+parser.add_argument("--firmware", help="Analyze firmware trace files (all in log/trace_firmware if --files not given)", action="store_true")
+parser.add_argument("--files", help="Firmware trace files (YAML or columnar) to analyze", nargs='+', default=[])
+parser.add_argument("--start", help="Start of robot time range: epoch seconds, 'YYYY-MM-DD HH:MM:SS', or -N for N hours ago", type=str, default=None)
+parser.add_argument("--end", help="End of robot time range (same forms as --start)", type=str, default=None)
+parser.add_argument("--fields", help="Only report these fields", nargs='+', default=None)
+parser.add_argument("--gap", help="Sample gap threshold in seconds", type=float, default=None)
+parser.add_argument("--out", help="Output directory (default log/trace_analysis/<time>)", type=str, default=None)
+parser.add_argument("--csv", help="Also write a CSV of the field statistics", action="store_true")
+parser.add_argument("--plot", help="Also write a PNG per field", action="store_true")
+args = parser.parse_args()
+
+
+def parse_time(s):
+    if s is None:
+        return None
+    try:
+        t = float(s)
+        return time.time() + t * 3600 if t < 0 else t
+    except ValueError:
+        return datetime.fromisoformat(s).timestamp()
+
+
+if not (args.robot or args.firmware or len(args.files)):
+    print('One of --robot, --firmware or --files required')
+    exit(0)
+
+out_dir = args.out if args.out is not None else hu.get_stretch_directory('log/trace_analysis/') + hu.create_time_string()
+os.makedirs(out_dir, exist_ok=True)
+
+reports = {}
+columns = {}
+if args.robot:
+    ts_start, ts_end = parse_time(args.start), parse_time(args.end)
+    reports['robot'], columns['robot'] = ta.analyze_robot_traces(RobotTraceStore(), ts_start, ts_end, args.fields, args.gap)
+    r = reports['robot']
+    print('Robot: %d samples over %s s | rate %s Hz | gaps %s' % (r['n_samples'], r['duration_s'], r['rate_hz'], r['gaps']))
+
+fw_files = list(args.files)
+if args.firmware and len(fw_files) == 0:
+    # A converted trace exists both as YAML and as its columnar copy: analyze only the columnar one
+    fw_dir = hu.get_stretch_directory() + 'log/trace_firmware/'
+    columnar = set(f for f in glob.glob(fw_dir + 'trace_fw_*' + tc.SUFFIX) if tc.is_columnar_trace(f))
+    fw_files = [f for f in glob.glob(fw_dir + 'trace_fw_*.yaml') if tc.columnar_name(f) not in columnar]
+    fw_files = sorted(fw_files + list(columnar))
+for f in fw_files:
+    name = os.path.basename(f.rstrip('/'))
+    try:
+        reports[name], columns[name] = ta.analyze_firmware_trace(f, args.fields, args.gap)
+        print('%s: %d samples | %s trace' % (name, reports[name]['n_samples'], reports[name]['trace_type']))
+    except Exception as e:
+        click.secho('Failed to analyze %s: %s' % (f, str(e)), fg="yellow")
+
+ta.save_json(reports, os.path.join(out_dir, 'trace_stats.json'), fleet_id=hu.get_fleet_id())
+print('Wrote %s' % os.path.join(out_dir, 'trace_stats.json'))
+if args.csv:
+    ta.save_csv(reports, os.path.join(out_dir, 'trace_stats.csv'))
+    print('Wrote %s' % os.path.join(out_dir, 'trace_stats.csv'))
+if args.plot:
+    n = 0
+    for name in columns:
+        n = n + len(ta.save_plots(name, columns[name], out_dir, args.fields))
+    print('Wrote %d plots to %s' % (n, out_dir))
@@ -0,0 +1,45 @@
+#!/usr/bin/env python
+import argparse
+import glob
+import os
+import click
+import stretch_body.hello_utils as hu
+import stretch_factory.trace_columnar as tc
+
+hu.print_stretch_re_use()
+
+parser = argparse.ArgumentParser(description='Convert YAML robot and firmware traces to the columnar trace format.', )
+parser.add_argument("--robot", help="Convert the robot traces in log/trace", action="store_true")
+parser.add_argument("--firmware", help="Convert the firmware traces in log/trace_firmware", action="store_true")
+parser.add_argument("--files", help="Convert these YAML trace files", nargs='+', default=[])
+parser.add_argument("--remove_yaml", help="Delete each YAML trace once converted", action="store_true")
+parser.add_argument("--force", help="Convert even if a columnar trace already exists", action="store_true")
+args = parser.parse_args()
+
+if not (args.robot or args.firmware or len(args.files)):
+    print('One of --robot, --firmware or --files required')
+    exit(0)
+
+jobs = []
+if args.robot:
+    jobs = jobs + [(f, tc.convert_robot_trace_file) for f in sorted(glob.glob(hu.get_stretch_directory() + 'log/trace/*.yaml'))]
+if args.firmware:
+    jobs = jobs + [(f, tc.convert_firmware_trace_file) for f in sorted(glob.glob(hu.get_stretch_directory() + 'log/trace_firmware/*.yaml'))]
+for f in args.files:
+    jobs.append((f, tc.convert_firmware_trace_file if os.path.basename(f).startswith('trace_fw_') else tc.convert_robot_trace_file))
+
+n_converted = 0
+for f, convert in jobs:
+    out = tc.columnar_name(f)
+    if tc.is_columnar_trace(out) and not args.force:
+        print('Skipping %s (already converted)' % f)
+        continue
+    try:
+        convert(f)
+        n_converted = n_converted + 1
+        print('Converted %s -> %s' % (f, out))
+        if args.remove_yaml:
+            os.remove(f)
+    except Exception as e:
+        click.secho('Failed to convert %s: %s' % (f, str(e)), fg="yellow")
+click.secho('Converted %d of %d trace files' % (n_converted, len(jobs)), fg="green", bold=True)
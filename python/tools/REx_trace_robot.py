@@ -5,12 +5,11 @@ import argparse
 import stretch_body.hello_utils as hu
 import click
 from colorama import Style
-import glob
 hu.print_stretch_re_use()
-import yaml
 from datetime import datetime
 import matplotlib.pyplot as plt
 import numpy as np
+from stretch_factory.robot_trace_store import RobotTraceStore
 
 parser = argparse.ArgumentParser(description='Tool to load and view the robot trace files.', )
 args = parser.parse_args()
@@ -20,7 +19,8 @@ class TraceMgmt:
     Manage trace data
     """
     def __init__(self):
-        self.trace_directory = hu.get_stretch_directory()+'log/trace'
+        self.store = RobotTraceStore()
+        self.trace_directory = self.store.trace_directory
 
 
     def get_int(self,range,msg='value'):
@@ -31,20 +31,19 @@ class TraceMgmt:
             print("Error Invalid Input")
 
     def run_menu(self):
-        print('Loading trace data. This will take a minute...')
+        print('Indexing trace data...')
         print('')
-        segs=self.get_segments()
+        segs=self.store.get_segments()
         if len(segs)==0:
             click.secho('No trace data found in %s'%self.trace_directory, fg="yellow")
             return
         active_seg_id=0
-        trace_data=self.get_trace_data(segs[active_seg_id])
 
 
         while True:
             print(Style.BRIGHT + '############### AVAILABLE ################' + Style.RESET_ALL)
             self.pretty_print_segments(segs, active_seg_id)
-            self.pretty_print_fields(trace_data)
+            self.pretty_print_fields(segs[active_seg_id])
             print(Style.BRIGHT + '############### MENU ################' + Style.RESET_ALL)
             print('Enter command.')
             print('s: set active trace')
@@ -58,25 +57,24 @@ class TraceMgmt:
                     return
                 elif r == 's':
                     active_seg_id=self.get_int([0,len(segs)-1])
-                    trace_data = self.get_trace_data(segs[active_seg_id])
                 elif r == 'p':
-                    self.do_plot(trace_data)
+                    self.do_plot(segs[active_seg_id])
                 elif r == 'd':
-                    self.do_print(trace_data)
+                    self.do_print(segs[active_seg_id])
                 else:
                     print('Invalid entry')
             except(TypeError, ValueError):
                 print('Invalid entry')
 
-    def do_plot(self,trace_data):
+    def do_plot(self,seg):
         print(Style.BRIGHT + '############### Plotting ################' + Style.RESET_ALL)
-        self.pretty_print_fields(trace_data)
-        kk = list(trace_data['trace'].keys())
-        kk.sort()
+        self.pretty_print_fields(seg)
+        kk = self.store.get_fields(seg)
         id1=self.get_int([0,len(kk)-1],msg='FIELD ID')
         print('')
-        yval = trace_data['trace'][kk[id1]]
-        xval = np.array(trace_data['trace']['timestamp'])
+        #Only the selected field and timestamp are loaded
+        yval = self.store.get_field(seg,kk[id1])
+        xval = np.array(self.store.get_field(seg,'timestamp'))
         xval = (xval-xval[0])/60.0
         plt.ion()  # enable interactivity
 
@@ -89,27 +87,25 @@ class TraceMgmt:
         axes.plot(xval, yval, 'b')
         fig.canvas.draw_idle()
 
-    def do_print(self,trace_data):
+    def do_print(self,seg):
         print(Style.BRIGHT + '############### Print ################' + Style.RESET_ALL)
-        self.pretty_print_fields(trace_data)
-        kk = list(trace_data['trace'].keys())
-        kk.sort()
+        self.pretty_print_fields(seg)
+        kk = self.store.get_fields(seg)
         id1 = self.get_int([0, len(kk) - 1], msg='FIELD ID')
         print('')
-        yval = trace_data['trace'][kk[id1]]
-        xval = np.array(trace_data['trace']['timestamp'])
+        yval = self.store.get_field(seg,kk[id1])
+        xval = np.array(self.store.get_field(seg,'timestamp'))
         xval = (xval - xval[0]) / 60.0
         for i in range(len(yval)):
             print('%f: %f'%(xval[i],yval[i]))
 
-    def pretty_print_fields(self,trace_data):
+    def pretty_print_fields(self,seg):
         i=0
         click.secho('%s | %s |  %s ' % ('ID'.ljust(8), 'FIELD'.ljust(50), 'SAMPLES'.ljust(25)), fg="cyan",bold=True)
         click.secho('-' * 110, fg="cyan", bold=True)
-        kk=list(trace_data['trace'].keys())
-        kk.sort()
+        kk=self.store.get_fields(seg)
         for k in kk:
-            click.secho('%s | %s |  %s ' % (str(i).ljust(8), str(k).ljust(50), str(len(trace_data['trace'][k])).ljust(25)), fg="cyan",bold=True)
+            click.secho('%s | %s |  %s ' % (str(i).ljust(8), str(k).ljust(50), str(seg['n_samples']).ljust(25)), fg="cyan",bold=True)
             i=i+1
         print('')
 
@@ -133,66 +129,6 @@ class TraceMgmt:
             else:
                 click.secho(ln, fg="cyan")
         print('')
-    def get_trace_data(self,seg):
-        """
-        Assemble a dict with each field as a list of values
-        """
-        data={}
-        data['ts_start']=seg['ts_start']
-        data['ts_end']=seg['ts_end']
-        data['trace']= {}
-        for f in seg['filename']:
-            with open(f, 'r') as s:
-                trace=yaml.load(s,Loader=yaml.FullLoader)
-                x = list(trace.keys())
-                x.sort() #Chronological list of samples eg [trace_0000, trace_0001,...], oldest ID 0
-                for xx in x: #trace_000,...
-                    if len(data['trace'])==0:
-                        #Build initial dict of {pimu.voltage:[],pimu.current:[],...}
-                        for k in trace[x[0]].keys():
-                            data['trace'][k]=[]
-                    for k in trace[xx].keys():
-                        data['trace'][k].append(float(trace[xx][k])) #All data should be a float so can scope
-        return data
-
-    def get_segments(self):
-        #Return a list of all segments found in the trace dir
-        #ID 0 is most recent, ID -1 is oldes
-        #A segment is a timespan of samples (that may bridge multiple files)
-        #Segment boundaries are defined as having a time gap of over 0.2s
-        segments=[]
-        all_files=self.get_all_files_sorted()
-        seg_thresh_s=0.2
-        seg_curr={}
-        for f in all_files:
-            with open(f, 'r') as s:
-                trace=yaml.load(s,Loader=yaml.FullLoader)
-                x=list(trace.keys())
-                x.sort() #Chronological list of samples eg [trace_0000, trace_0001,...], oldest ID 0
-                sub_seg = {'ts_start':trace[x[0]]['timestamp'],'ts_end':trace[x[-1]]['timestamp'],'filename':[f]}
-                if len(segments)==0:
-                    segments=[sub_seg]
-                else:
-                    #See if this extends current segment or is a new one
-                    ts_last = segments[-1]['ts_end']
-                    if sub_seg['ts_start']-ts_last<seg_thresh_s:
-                        segments[-1]['ts_end']=sub_seg['ts_end']
-                        segments[-1]['filename'].append(f)
-                    else:
-                        segments.append(sub_seg)
-        segments.reverse()
-        return segments
-
-    def get_all_files_sorted(self):
-        # Retrieve sorted list of all trace files
-        # Sorted chronological (id 0 is oldest)
-        try:
-            all_files = glob.glob(self.trace_directory + '/*.yaml')
-            all_files.sort()
-            return all_files
-        except:
-            return []
-
 
 mgmt=TraceMgmt()
 mgmt.run_menu()